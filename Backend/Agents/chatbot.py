@@ -4,7 +4,7 @@ import os
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, Optional
 from bson import ObjectId
 
 chat = APIRouter(prefix="/sessions", tags=["AI Chat"])
@@ -14,12 +14,14 @@ from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
 # Import excalidraw extractor (same as check agent)
-from .tools.excalidraw_extractor import extract_excalidraw_components
+from .tools.excalidraw_extractor import describe_diagram
 
 # Import auth and database
 from auth import get_current_user
 from models import User
 from database import db
+import CRUD.problem_crud as problem_crud
+from diagram_offload import run_diagram_op, estimate_diagram_size
 
 model = ChatOpenAI(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"), temperature=0.1, max_tokens=250)
 parser = StrOutputParser()
@@ -55,6 +57,60 @@ async def chat_health_check():
     return {"status": "healthy"}
 
 
+async def stream_chat_reply(
+    session_id: str,
+    problem: Dict[str, Any],
+    diagram_data: Dict[Any, Any],
+    query: str,
+    diagram_hash: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Stream the assistant's answer to query token by token, keeping the
+    session's short in-memory chat history. Used by the SSE endpoint and the
+    live session channel; diagram_hash (when known) reuses the memoized graph.
+    """
+    # STEP 1: Extract problem_title
+    problem_title = problem.get("title", "System Design Problem")
+    
+    # STEP 2: Extract requirements (join them into a string)
+    requirements = ", ".join(problem.get("requirements", []))
+    
+    # STEP 3: Extract diagram data using excalidraw_extractor (like check agent)
+    implemented = await run_diagram_op(
+        "extract", estimate_diagram_size(diagram_data), describe_diagram, diagram_data, diagram_hash
+    )
+    
+    # STEP 4: Get or initialize chat history for this session
+    if session_id not in chat_histories:
+        chat_histories[session_id] = []
+    
+    chat_history = chat_histories[session_id]
+    
+    # Add user message to history
+    chat_history.append({"role": "user", "content": query})
+    
+    collected_response = ""
+    # Stream tokens from LLM
+    async for chunk in chain.astream({
+        "problem_title": problem_title,
+        "requirements": requirements,
+        "implemented": implemented,
+        "chat_history": str(chat_history[-10:]),  # Last 5 Q/A pairs
+        "Query": query
+    }):
+        # Each chunk is a string token
+        if chunk:
+            collected_response += chunk
+            yield chunk
+    
+    # After streaming completes, save to history
+    chat_history.append({"role": "assistant", "content": collected_response})
+    
+    # Keep only last 10 messages (5 Q/A pairs)
+    if len(chat_history) > 10:
+        chat_histories[session_id] = chat_history[-10:]
+
+
 @chat.post("/{session_id}/ai-chat")
 async def chat_with_ai(
     session_id: str,
@@ -68,66 +124,23 @@ async def chat_with_ai(
     session = await sessions_collection.find_one({
         "_id": ObjectId(session_id),
         "user_id": current_user.id
-    })
+    }, {"problem_id": 1})
     
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    # Get problem details
-    problems_collection = db.get_collection("problems")
-    problem = await problems_collection.find_one({
-        "_id": ObjectId(session["problem_id"])
-    })
+    # Get problem details (cached in-process)
+    problem = await problem_crud.get_problem_by_id(session["problem_id"])
     
     if not problem:
         raise HTTPException(status_code=404, detail="Problem not found")
     
-    # STEP 1: Extract problem_title
-    problem_title = problem.get("title", "System Design Problem")
-    
-    # STEP 2: Extract requirements (join them into a string)
-    requirements = ", ".join(problem.get("requirements", []))
-    
-    # STEP 3: Extract diagram data using excalidraw_extractor (like check agent)
-    implemented = extract_excalidraw_components.invoke({"diagram_data": request.diagram_data})
-    
-    # STEP 4: Get or initialize chat history for this session
-    if session_id not in chat_histories:
-        chat_histories[session_id] = []
-    
-    chat_history = chat_histories[session_id]
-    
-    # STEP 5: User's query
-    Query = request.message
-    
-    # Add user message to history
-    chat_history.append({"role": "user", "content": Query})
-    
-    # STEP 6: Stream response generator
+    # Stream response generator
     async def generate_stream():
-        collected_response = ""
         try:
-            # Stream tokens from LLM
-            async for chunk in chain.astream({
-                "problem_title": problem_title,
-                "requirements": requirements,
-                "implemented": implemented,
-                "chat_history": str(chat_history[-10:]),  # Last 5 Q/A pairs
-                "Query": Query
-            }):
-                # Each chunk is a string token
-                if chunk:
-                    collected_response += chunk
-                    # Send as Server-Sent Event
-                    yield f"data: {chunk}\n\n"
-            
-            # After streaming completes, save to history
-            chat_history.append({"role": "assistant", "content": collected_response})
-            
-            # Keep only last 10 messages (5 Q/A pairs)
-            if len(chat_history) > 10:
-                chat_histories[session_id] = chat_history[-10:]
-                
+            async for chunk in stream_chat_reply(session_id, problem, request.diagram_data, request.message):
+                # Send as Server-Sent Event
+                yield f"data: {chunk}\n\n"
         except Exception as e:
             yield f"data: ERROR: {str(e)}\n\n"
     
@@ -140,4 +153,3 @@ async def chat_with_ai(
             "Connection": "keep-alive"
         }
     )
-    
\ No newline at end of file
@@ -4,14 +4,16 @@ Analyzes user's Excalidraw diagram against question requirements using LangChain
 """
 import os
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from dotenv import load_dotenv
 
-from .tools.excalidraw_extractor import extract_excalidraw_components, extract_component_list
+from .tools.excalidraw_extractor import describe_diagram
 from .tools.question_extractor import extract_question_requirements
+from .tools.requirement_precheck import PreCheck, precheck_requirements, precheck_outcomes
 from .prompts.checking_prompt import CHECKING_SYSTEM_PROMPT, CHECKING_USER_PROMPT_TEMPLATE
+from diagram_offload import run_diagram_op, estimate_diagram_size
 
 load_dotenv()
 
@@ -43,7 +45,9 @@ class CheckingAgent:
     async def check_solution(
         self,
         problem_data: Dict[str, Any],
-        diagram_data: Dict[str, Any]
+        diagram_data: Dict[str, Any],
+        diagram_hash: Optional[str] = None,
+        precheck: Optional[PreCheck] = None
     ) -> Dict[str, Any]:
         """
         Check user's solution and provide feedback.
@@ -51,6 +55,8 @@ class CheckingAgent:
         Args:
             problem_data: Question/problem data (title, description, requirements, etc.)
             diagram_data: User's Excalidraw diagram data
+            diagram_hash: Hash of diagram_data, to reuse its memoized graph
+            precheck: Requirement pre-check of the diagram (computed when not given)
             
         Returns:
             Structured feedback dict with keys: implemented, missing, next_steps
@@ -58,12 +64,20 @@ class CheckingAgent:
         try:
             # Extract data manually (simpler than using LangChain tools/agents)
             question_str = self._extract_question_data(problem_data)
-            diagram_str = self._extract_diagram_data(diagram_data)
+            diagram_str = await run_diagram_op(
+                "extract", estimate_diagram_size(diagram_data), self._extract_diagram_data, diagram_data, diagram_hash
+            )
+            if precheck is None:
+                precheck = await run_diagram_op(
+                    "precheck", estimate_diagram_size(diagram_data), precheck_requirements,
+                    problem_data, diagram_data, diagram_hash
+                )
             
             # Create input for LLM
             user_input = CHECKING_USER_PROMPT_TEMPLATE.format(
                 question_data=question_str,
-                diagram_data=diagram_str
+                diagram_data=diagram_str,
+                coverage_data=precheck.table()
             )
             
             # Create chain
@@ -122,79 +136,9 @@ class CheckingAgent:
         
         return "\n".join(output_lines)
     
-    def _extract_diagram_data(self, diagram_data: Dict[str, Any]) -> str:
+    def _extract_diagram_data(self, diagram_data: Dict[str, Any], diagram_hash: Optional[str] = None) -> str:
         """Extract and format Excalidraw diagram components"""
-        if not diagram_data or not isinstance(diagram_data, dict):
-            return "No diagram data provided"
-        
-        elements = diagram_data.get("elements", [])
-        
-        if not elements:
-            return "Empty diagram - no elements found"
-        
-        components = []
-        arrows = []
-        text_elements = []
-        
-        for elem in elements:
-            if not isinstance(elem, dict):
-                continue
-            
-            component = {
-                "id": elem.get("id", "unknown"),
-                "type": elem.get("type", "unknown"),
-                "text": elem.get("text", ""),
-                "groupIds": elem.get("groupIds", []),
-                "boundElements": elem.get("boundElements", []),
-            }
-            
-            if elem.get("type") == "arrow":
-                component["startBinding"] = elem.get("startBinding", {})
-                component["endBinding"] = elem.get("endBinding", {})
-                arrows.append(component)
-            elif elem.get("type") == "text":
-                text_elements.append(component)
-            else:
-                components.append(component)
-        
-        output_lines = []
-        output_lines.append(f"=== DIAGRAM SUMMARY ===")
-        output_lines.append(f"Total Elements: {len(elements)}")
-        output_lines.append(f"Components: {len(components)}")
-        output_lines.append(f"Arrows/Connections: {len(arrows)}")
-        output_lines.append(f"Text Labels: {len(text_elements)}")
-        output_lines.append("")
-        
-        if components:
-            output_lines.append("=== COMPONENTS ===")
-            for idx, comp in enumerate(components, 1):
-                output_lines.append(f"{idx}. {comp['type'].upper()} (ID: {comp['id'][:8]}...)")
-                if comp['text']:
-                    output_lines.append(f"   Label: \"{comp['text']}\"")
-                if comp['boundElements']:
-                    output_lines.append(f"   Connected to: {len(comp['boundElements'])} elements")
-                output_lines.append("")
-        
-        if arrows:
-            output_lines.append("=== CONNECTIONS ===")
-            for idx, arrow in enumerate(arrows, 1):
-                start = arrow.get('startBinding', {}).get('elementId', 'unknown')
-                end = arrow.get('endBinding', {}).get('elementId', 'unknown')
-                label = arrow.get('text', '')
-                
-                output_lines.append(f"{idx}. ARROW (ID: {arrow['id'][:8]}...)")
-                output_lines.append(f"   From: {start[:8]}... → To: {end[:8]}...")
-                if label:
-                    output_lines.append(f"   Label: \"{label}\"")
-                output_lines.append("")
-        
-        if text_elements:
-            output_lines.append("=== TEXT ANNOTATIONS ===")
-            for idx, text in enumerate(text_elements, 1):
-                output_lines.append(f"{idx}. \"{text.get('text', '')}\"")
-            output_lines.append("")
-        
-        return "\n".join(output_lines)
+        return describe_diagram(diagram_data, diagram_hash, include_groups=False, agent="check")
     
     def check_solution_sync(
         self,
@@ -214,12 +158,16 @@ class CheckingAgent:
         try:
             # Extract data
             question_str = self._extract_question_data(problem_data)
+            precheck = precheck_requirements(problem_data, diagram_data)
+            if precheck.conclusive:
+                return precheck.feedback()
             diagram_str = self._extract_diagram_data(diagram_data)
             
             # Create input for LLM
             user_input = CHECKING_USER_PROMPT_TEMPLATE.format(
                 question_data=question_str,
-                diagram_data=diagram_str
+                diagram_data=diagram_str,
+                coverage_data=precheck.table()
             )
             
             # Create chain
@@ -261,17 +209,29 @@ def get_checking_agent() -> CheckingAgent:
 
 async def analyze_user_solution(
     problem_data: Dict[str, Any],
-    diagram_data: Dict[str, Any]
+    diagram_data: Dict[str, Any],
+    diagram_hash: Optional[str] = None
 ) -> str:
     """
     Convenience function to analyze user solution.
+    Diagrams the requirement pre-check finds clearly incomplete are answered
+    by the pre-check alone, without the LLM.
     
     Args:
         problem_data: Question/problem data
         diagram_data: User's Excalidraw diagram data
+        diagram_hash: Hash of diagram_data, to reuse its memoized graph
         
     Returns:
         Feedback string
     """
+    precheck = await run_diagram_op(
+        "precheck", estimate_diagram_size(diagram_data), precheck_requirements, problem_data, diagram_data, diagram_hash
+    )
+    if precheck.conclusive:
+        precheck_outcomes.inc(labels={"stage": "check", "outcome": "short_circuit"})
+        return precheck.feedback()
+    precheck_outcomes.inc(labels={"stage": "check", "outcome": "llm"})
+    
     agent = get_checking_agent()
-    return await agent.check_solution(problem_data, diagram_data)
+    return await agent.check_solution(problem_data, diagram_data, diagram_hash, precheck)
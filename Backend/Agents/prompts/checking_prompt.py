@@ -42,6 +42,8 @@ Please analyze this system design solution:
 
 {diagram_data}
 
+{coverage_data}
+
 Analyze the student's diagram and provide feedback in the specified JSON format.
 
 Remember to:
@@ -50,6 +52,7 @@ Remember to:
 3. Be constructive about what's missing or needs improvement
 4. Provide actionable next steps
 5. Base every observation on the supplied question and diagram only. If information is missing, state that it is missing instead of guessing.
+6. Use the requirement coverage table (if any) as a starting point, but verify it against the diagram: keyword matching can miss synonyms or over-match.
 
 Return ONLY a valid JSON object with the three required arrays: implemented, missing, and next_steps.
 """
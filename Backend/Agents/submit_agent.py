@@ -6,82 +6,87 @@ Orchestrates the submission evaluation process:
 3. Fetches learning resources (YouTube videos + docs)
 4. Returns comprehensive submission result
 """
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 from .tools.scoring import score_solution
 from .tools.tips_generator import generate_tips
 from .tools.youtube_fetcher import fetch_youtube_videos
 from .tools.docs_fetcher import fetch_documentation
+from .tools.requirement_precheck import precheck_requirements, precheck_outcomes
+from .tools.token_budget import DIAGRAM_SECTION_SHARES, TOKEN_BUDGETS, pack_sections
+from diagram_offload import run_diagram_op, estimate_diagram_size
+from diagram_graph import diagram_graph
 
 
-def extract_diagram_summary(diagram_data: Dict[str, Any]) -> str:
-    """Extract and format diagram summary for analysis"""
+def extract_diagram_summary(diagram_data: Dict[str, Any], diagram_hash: Optional[str] = None, agent: str = "scoring") -> str:
+    """Extract and format diagram summary for analysis, within the agent's token budget"""
     if not diagram_data or not isinstance(diagram_data, dict):
         return "Empty diagram"
     
-    elements = diagram_data.get("elements", [])
-    
-    if not elements:
+    graph = diagram_graph(diagram_data, diagram_hash)
+    if not graph.total:
         return "No elements in diagram"
     
-    components = []
-    arrows = []
-    text_elements = []
-    
-    for elem in elements:
-        if not isinstance(elem, dict):
-            continue
-        
-        elem_type = elem.get("type", "")
-        elem_id = elem.get("id", "")[:8]
-        elem_text = elem.get("text", "")
-        
-        if elem_type == "arrow":
-            start = elem.get("startBinding", {}).get("elementId", "")[:8]
-            end = elem.get("endBinding", {}).get("elementId", "")[:8]
-            arrows.append(f"Arrow({elem_id}): {start} → {end}" + (f' "{elem_text}"' if elem_text else ''))
-        elif elem_type == "text":
-            text_elements.append(f'Text: "{elem_text}"')
-        else:
-            components.append(f"{elem_type.upper()}({elem_id})" + (f': "{elem_text}"' if elem_text else ''))
-    
-    lines = [
+    header = [
         f"=== DIAGRAM SUMMARY ===",
-        f"Total: {len(elements)} elements",
-        f"Components: {len(components)}",
-        f"Connections: {len(arrows)}",
-        "",
-        "=== COMPONENTS ===" if components else "",
-        *[f"- {c}" for c in components],
-        "",
-        "=== CONNECTIONS ===" if arrows else "",
-        *[f"- {a}" for a in arrows],
-        "",
-        "=== LABELS ===" if text_elements else "",
-        *[f"- {t}" for t in text_elements[:10]]
+        f"Total: {graph.total} elements",
+        f"Components: {len(graph.components)}",
+        f"Connections: {len(graph.connections)}",
     ]
-    
-    return "\n".join(line for line in lines if line)
+    # Most informative first: labeled components, named connections, free text, unlabeled shapes
+    sections = [
+        ("components", "=== COMPONENTS ===", [
+            f'- {comp.type.upper()}: "{comp.label}"' for comp in graph.components if comp.label
+        ]),
+        ("connections", "=== CONNECTIONS ===", [f"- {edge}" for edge in graph.edge_list()]),
+        ("labels", "=== LABELS ===", [f'- "{text.label}"' for text in graph.annotations]),
+        ("unlabeled shapes", "=== UNLABELED SHAPES ===", [
+            f"- {comp.type.upper()} ({comp.name})" for comp in graph.components if not comp.label
+        ]),
+    ]
+    return pack_sections(header, sections, TOKEN_BUDGETS[agent], agent, DIAGRAM_SECTION_SHARES).text
+
+
+def _prompt_summaries(diagram_data: Dict[str, Any], diagram_hash: Optional[str] = None) -> Tuple[str, str]:
+    """The diagram summaries of the scoring and tips prompts (one graph build)"""
+    return (
+        extract_diagram_summary(diagram_data, diagram_hash, agent="scoring"),
+        extract_diagram_summary(diagram_data, diagram_hash, agent="tips")
+    )
 
 
 async def evaluate_submission(
     problem_data: Dict[str, Any],
-    diagram_data: Dict[str, Any]
+    diagram_data: Dict[str, Any],
+    diagram_hash: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Main submission evaluation function.
+    Diagrams the requirement pre-check finds clearly incomplete are scored
+    by the pre-check alone (no scoring or tips LLM calls).
     
     Args:
         problem_data: Problem requirements and metadata
         diagram_data: User's Excalidraw diagram data
+        diagram_hash: Hash of diagram_data, to reuse its memoized graph
     
     Returns:
         Complete submission result with score, feedback, tips, and resources
     """
-    # Extract diagram summary
-    diagram_str = extract_diagram_summary(diagram_data)
+    precheck = await run_diagram_op(
+        "precheck", estimate_diagram_size(diagram_data), precheck_requirements, problem_data, diagram_data, diagram_hash
+    )
     
     # Step 1: Score the solution
-    scoring_result = await score_solution(problem_data, diagram_data, diagram_str)
+    if precheck.conclusive:
+        precheck_outcomes.inc(labels={"stage": "submit", "outcome": "short_circuit"})
+        scoring_result = precheck.scoring()
+    else:
+        precheck_outcomes.inc(labels={"stage": "submit", "outcome": "llm"})
+        # Diagram summaries within the scoring and tips token budgets
+        scoring_str, tips_str = await run_diagram_op(
+            "extract", estimate_diagram_size(diagram_data), _prompt_summaries, diagram_data, diagram_hash
+        )
+        scoring_result = await score_solution(problem_data, diagram_data, scoring_str, precheck.table())
     
     score = scoring_result.get("score", 0)
     max_score = scoring_result.get("max_score", 100)
@@ -90,7 +95,10 @@ async def evaluate_submission(
     missing = scoring_result.get("missing", [])
     
     # Step 2: Generate personalized tips
-    tips = await generate_tips(problem_data, scoring_result, diagram_str)
+    if precheck.conclusive:
+        tips = precheck.next_steps()
+    else:
+        tips = await generate_tips(problem_data, scoring_result, tips_str)
     
     # Step 3: Fetch learning resources
     # Run in parallel for speed
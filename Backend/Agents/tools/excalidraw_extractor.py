@@ -2,9 +2,77 @@
 Excalidraw Code Extractor Tool
 Extracts and formats Excalidraw diagram components for LLM analysis
 """
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from langchain.tools import tool
 
+from diagram_graph import DiagramGraph, diagram_graph
+from .token_budget import DIAGRAM_SECTION_SHARES, TOKEN_BUDGETS, PackedText, pack_sections
+
+
+def summarize_diagram(graph: DiagramGraph, budget: Optional[int] = None, agent: str = "chat", include_groups: bool = True) -> PackedText:
+    """
+    Format a diagram graph for LLM analysis within budget tokens (None: all of it).
+    Most informative first: labeled components, named connections, text
+    annotations, then unlabeled shapes.
+    """
+    if not graph.provided:
+        return pack_sections(["No diagram data provided"], [], budget, agent)
+    if not graph.total:
+        return pack_sections(["Empty diagram - no elements found"], [], budget, agent)
+    
+    components, arrows, annotations = graph.components, graph.connections, graph.annotations
+    labeled = [comp for comp in components if comp.label]
+    unlabeled = [comp for comp in components if not comp.label]
+    
+    # Summary
+    header = [
+        "=== DIAGRAM SUMMARY ===",
+        f"Total Elements: {graph.total}",
+        f"Components: {len(components)} ({len(labeled)} labeled)",
+        f"Arrows/Connections: {len(arrows)}",
+        f"Text Annotations: {len(annotations)}",
+    ]
+    
+    # Components, named by their (bound) label; groups numbered in order of appearance
+    groups: Dict[str, int] = {}
+    
+    def component_line(comp) -> str:
+        line = f"{(comp.type or 'unknown').upper()} " + (f"\"{comp.label}\"" if comp.label else comp.name)
+        degree = graph.degree(comp.id) if comp.id else 0
+        if degree:
+            line += f" - {degree} connection{'s' if degree != 1 else ''}"
+        if include_groups and comp.group_ids:
+            line += f" - group {groups.setdefault(comp.group_ids[0], len(groups) + 1)}"
+        return line
+    
+    sections = [
+        ("components", "=== COMPONENTS ===", [f"{idx}. {component_line(comp)}" for idx, comp in enumerate(labeled, 1)]),
+        # Connections as a named edge list
+        ("connections", "=== CONNECTIONS ===", [f"{idx}. {edge}" for idx, edge in enumerate(graph.edge_list(), 1)]),
+        # Text not attached to a shape or arrow
+        ("annotations", "=== TEXT ANNOTATIONS ===", [f"{idx}. \"{text.label}\"" for idx, text in enumerate(annotations, 1)]),
+        ("unlabeled shapes", "=== UNLABELED SHAPES ===", [f"{idx}. {component_line(comp)}" for idx, comp in enumerate(unlabeled, 1)]),
+    ]
+    return pack_sections(header, sections, budget, agent, DIAGRAM_SECTION_SHARES)
+
+
+def render_diagram(graph: DiagramGraph, include_groups: bool = True, budget: Optional[int] = None, agent: str = "chat") -> str:
+    """Format a diagram graph for LLM analysis (components, named connections, text)"""
+    return summarize_diagram(graph, budget, agent, include_groups).text
+
+
+def describe_diagram(
+    diagram_data: dict,
+    diagram_hash: Optional[str] = None,
+    include_groups: bool = True,
+    agent: str = "chat"
+) -> str:
+    """
+    render_diagram of the diagram's graph within the agent's token budget,
+    memoized by diagram_hash when given
+    """
+    return render_diagram(diagram_graph(diagram_data, diagram_hash), include_groups, TOKEN_BUDGETS[agent], agent)
+
 
 @tool
 def extract_excalidraw_components(diagram_data: dict) -> str:
@@ -20,91 +88,7 @@ def extract_excalidraw_components(diagram_data: dict) -> str:
     Returns:
         Formatted string with extracted components
     """
-    if not diagram_data or not isinstance(diagram_data, dict):
-        return "No diagram data provided"
-    
-    elements = diagram_data.get("elements", [])
-    
-    if not elements:
-        return "Empty diagram - no elements found"
-    
-    # Extract components
-    components = []
-    arrows = []
-    text_elements = []
-    
-    for elem in elements:
-        if not isinstance(elem, dict):
-            continue
-            
-        component = {
-            "id": elem.get("id", "unknown"),
-            "type": elem.get("type", "unknown"),
-            "text": elem.get("text", ""),
-            "groupIds": elem.get("groupIds", []),
-            "boundElements": elem.get("boundElements", []),
-        }
-        
-        # Add binding information for arrows
-        if elem.get("type") == "arrow":
-            component["startBinding"] = elem.get("startBinding", {})
-            component["endBinding"] = elem.get("endBinding", {})
-            arrows.append(component)
-        elif elem.get("type") == "text":
-            text_elements.append(component)
-        else:
-            # Shapes (rectangle, ellipse, diamond)
-            components.append(component)
-    
-    # Format output for LLM
-    output_lines = []
-    
-    # Summary
-    output_lines.append(f"=== DIAGRAM SUMMARY ===")
-    output_lines.append(f"Total Elements: {len(elements)}")
-    output_lines.append(f"Components: {len(components)}")
-    output_lines.append(f"Arrows/Connections: {len(arrows)}")
-    output_lines.append(f"Text Labels: {len(text_elements)}")
-    output_lines.append("")
-    
-    # Components
-    if components:
-        output_lines.append("=== COMPONENTS ===")
-        for idx, comp in enumerate(components, 1):
-            output_lines.append(f"{idx}. {comp['type'].upper()} (ID: {comp['id'][:8]}...)")
-            if comp['text']:
-                output_lines.append(f"   Label: \"{comp['text']}\"")
-            if comp['boundElements']:
-                connected = [b.get('id', '')[:8] for b in comp['boundElements']]
-                output_lines.append(f"   Connected to: {len(comp['boundElements'])} elements")
-            if comp['groupIds']:
-                output_lines.append(f"   Part of group: {comp['groupIds'][0][:8]}...")
-            output_lines.append("")
-    
-    # Connections
-    if arrows:
-        output_lines.append("=== CONNECTIONS ===")
-        for idx, arrow in enumerate(arrows, 1):
-            start_binding = arrow.get('startBinding') or {}
-            end_binding = arrow.get('endBinding') or {}
-            start = start_binding.get('elementId', 'unknown')
-            end = end_binding.get('elementId', 'unknown')
-            label = arrow.get('text', '')
-            
-            output_lines.append(f"{idx}. ARROW (ID: {arrow['id'][:8]}...)")
-            output_lines.append(f"   From: {start[:8] if start != 'unknown' else start}... → To: {end[:8] if end != 'unknown' else end}...")
-            if label:
-                output_lines.append(f"   Label: \"{label}\"")
-            output_lines.append("")
-    
-    # Standalone text
-    if text_elements:
-        output_lines.append("=== TEXT ANNOTATIONS ===")
-        for idx, text in enumerate(text_elements, 1):
-            output_lines.append(f"{idx}. \"{text.get('text', '')}\"")
-        output_lines.append("")
-    
-    return "\n".join(output_lines)
+    return describe_diagram(diagram_data)
 
 
 def extract_component_list(diagram_data: dict) -> List[Dict[str, Any]]:
@@ -114,29 +98,4 @@ def extract_component_list(diagram_data: dict) -> List[Dict[str, Any]]:
     
     Returns list of components with: id, type, text, groupIds, boundElements, startBinding, endBinding
     """
-    if not diagram_data or not isinstance(diagram_data, dict):
-        return []
-    
-    elements = diagram_data.get("elements", [])
-    extracted = []
-    
-    for elem in elements:
-        if not isinstance(elem, dict):
-            continue
-        
-        component = {
-            "id": elem.get("id", ""),
-            "type": elem.get("type", ""),
-            "text": elem.get("text", ""),
-            "groupIds": elem.get("groupIds", []),
-            "boundElements": elem.get("boundElements", []),
-        }
-        
-        # Add arrow bindings if applicable
-        if elem.get("type") == "arrow":
-            component["startBinding"] = elem.get("startBinding", {})
-            component["endBinding"] = elem.get("endBinding", {})
-        
-        extracted.append(component)
-    
-    return extracted
+    return [record.as_dict() for record in diagram_graph(diagram_data).records]
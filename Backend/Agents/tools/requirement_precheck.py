@@ -0,0 +1,313 @@
+"""
+Requirement Pre-Check Tool
+Matches the problem's requirements against the diagram's labels before any
+LLM call. Requirements and labels are normalized and scanned for known
+building blocks through a synonym dictionary (LB/load balancer,
+cache/Redis, queue/Kafka, ...); each requirement is then met, partially met,
+missing or unverified (it names no known building block: the LLM judges it).
+
+A diagram that is clearly incomplete (nothing drawn, hardly any labels, or
+a sketch of a few components covering few of the checkable requirements)
+gets its feedback and score from the pre-check alone. Larger diagrams go to
+the LLM however low their keyword coverage: their labels may simply be
+missing from the synonym dictionary. Otherwise the coverage table is handed to the LLM as a
+starting point.
+"""
+import os
+import re
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from diagram_graph import diagram_graph
+from metrics import REGISTRY
+
+
+# Answer clearly incomplete diagrams without the LLM
+PRECHECK_SHORT_CIRCUIT = os.getenv("PRECHECK_SHORT_CIRCUIT", "true").lower() == "true"
+# Fewer labeled components than this is clearly incomplete
+PRECHECK_MIN_LABELED = int(os.getenv("PRECHECK_MIN_LABELED", "2"))
+# Share of checkable requirements covered below which the diagram is clearly incomplete
+PRECHECK_MIN_COVERAGE = float(os.getenv("PRECHECK_MIN_COVERAGE", "0.34"))
+# ...but only for sketches with fewer labels than this, or fewer connections
+PRECHECK_SPARSE_LABELS = int(os.getenv("PRECHECK_SPARSE_LABELS", "4"))
+PRECHECK_SPARSE_CONNECTIONS = int(os.getenv("PRECHECK_SPARSE_CONNECTIONS", "2"))
+
+# A short-circuited diagram is "incomplete" (0-49) on the scoring scale
+PRECHECK_MAX_SCORE = 49
+
+precheck_outcomes = REGISTRY.counter("precheck_total", "Requirement pre-checks, by stage and outcome")
+
+# Building block -> how it is written on diagrams and in requirements
+SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    "load balancer": ("load balancer", "load balancing", "lb", "alb", "elb", "nlb", "haproxy", "nginx", "traffic manager"),
+    "api gateway": ("api gateway", "gateway", "kong", "apigee", "api management"),
+    "cache": ("cache", "caching", "cached", "redis", "memcached", "memcache", "elasticache", "varnish", "in memory store"),
+    "message queue": (
+        "message queue", "queue", "mq", "kafka", "rabbitmq", "sqs", "sns", "pub sub", "pubsub", "event bus",
+        "message broker", "broker", "kinesis", "nats", "activemq", "event stream"
+    ),
+    "database": (
+        "database", "db", "dbs", "datastore", "data store", "sql", "nosql", "postgres", "postgresql", "mysql",
+        "mariadb", "mongodb", "mongo", "dynamodb", "cassandra", "rds", "aurora", "spanner", "cockroachdb",
+        "key value store", "kv store", "persistent storage"
+    ),
+    "cdn": ("cdn", "content delivery network", "cloudfront", "akamai", "fastly", "edge cache", "edge server"),
+    "object storage": ("object storage", "object store", "blob storage", "blob store", "s3", "gcs", "bucket", "file storage"),
+    "search index": ("search index", "search engine", "search service", "elasticsearch", "opensearch", "solr", "lucene", "full text search"),
+    "worker": ("worker", "background worker", "background job", "job queue", "celery", "sidekiq", "async processing"),
+    "replication": ("replica", "replication", "replicated", "read replica", "standby", "failover"),
+    "sharding": ("shard", "sharding", "sharded", "partition", "partitioning", "partitioned", "consistent hashing", "hash ring"),
+    "rate limiter": ("rate limiter", "rate limiting", "rate limit", "throttle", "throttling", "token bucket"),
+    "dns": ("dns", "route 53", "route53", "domain name system"),
+    "monitoring": ("monitoring", "metrics", "prometheus", "grafana", "observability", "alerting", "logging", "log aggregation"),
+    "authentication": ("auth", "authentication", "auth service", "identity provider", "oauth", "jwt", "sso", "login"),
+    "notification service": ("notification", "notification service", "push notification", "email service", "sms", "fcm", "apns"),
+    "websocket": ("websocket", "web socket", "socket server", "real time gateway", "long polling", "sse", "server sent event"),
+    "id generator": ("id generator", "unique id", "snowflake", "ticket server", "key generation service", "kgs", "hash generator"),
+    "stream processing": ("stream processing", "stream processor", "flink", "spark streaming", "kafka streams"),
+    "data warehouse": ("data warehouse", "warehouse", "olap", "bigquery", "redshift", "snowflake db", "data lake"),
+    "scheduler": ("scheduler", "cron", "job scheduler"),
+}
+
+# Properties of a design rather than boxes on it
+CAPABILITIES = {"replication", "sharding", "monitoring", "authentication", "object storage", "stream processing"}
+
+
+def _add_step(concept: str) -> str:
+    if concept in CAPABILITIES:
+        return f"Show {concept} in the diagram and where it applies"
+    article = "an" if concept[0] in "aeiou" else "a"
+    return f"Add {article} {concept} and connect it to the components that use it"
+
+
+def _normalize(text: Any) -> List[str]:
+    """Lowercase alphanumeric tokens, with plural -s dropped ("Caches" == "cache")"""
+    if not isinstance(text, str):
+        return []
+    tokens = re.findall(r"[a-z0-9]+", text.lower())
+    return [token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token for token in tokens]
+
+
+# Normalized alias -> building block, looked up n-gram by n-gram
+_ALIASES: Dict[Tuple[str, ...], str] = {
+    tuple(_normalize(alias)): concept
+    for concept, aliases in SYNONYMS.items()
+    for alias in (concept, *aliases)
+}
+_MAX_ALIAS_TOKENS = max(len(alias) for alias in _ALIASES)
+
+
+def find_concepts(text: Any) -> List[str]:
+    """Building blocks named in text, in order of appearance (longest alias wins)"""
+    tokens = _normalize(text)
+    found: Dict[str, None] = {}
+    i = 0
+    while i < len(tokens):
+        for n in range(min(_MAX_ALIAS_TOKENS, len(tokens) - i), 0, -1):
+            concept = _ALIASES.get(tuple(tokens[i:i + n]))
+            if concept:
+                found.setdefault(concept)
+                i += n
+                break
+        else:
+            i += 1
+    return list(found)
+
+
+class RequirementCoverage(NamedTuple):
+    requirement: str
+    # Building blocks the requirement names
+    concepts: List[str]
+    # concept -> diagram elements providing it
+    matched: Dict[str, List[str]]
+
+    @property
+    def status(self) -> str:
+        if not self.concepts:
+            return "unverified"
+        if len(self.matched) == len(self.concepts):
+            return "met"
+        return "partial" if self.matched else "missing"
+
+    @property
+    def missing_concepts(self) -> List[str]:
+        return [concept for concept in self.concepts if concept not in self.matched]
+
+    def evidence(self) -> str:
+        return "; ".join(
+            f"{concept}: " + ", ".join(f'"{name}"' for name in names[:3])
+            for concept, names in self.matched.items()
+        )
+
+
+class PreCheck(NamedTuple):
+    coverage: List[RequirementCoverage]
+    components: int
+    labeled: int
+    connections: int
+    # Why the diagram is clearly incomplete; empty when the LLM should judge it
+    incomplete: str
+
+    @property
+    def checkable(self) -> List[RequirementCoverage]:
+        return [item for item in self.coverage if item.concepts]
+
+    @property
+    def ratio(self) -> float:
+        """Covered share of the checkable requirements (partial counts half)"""
+        checkable = self.checkable
+        if not checkable:
+            return 1.0
+        covered = sum(1.0 if item.status == "met" else 0.5 if item.status == "partial" else 0.0 for item in checkable)
+        return covered / len(checkable)
+
+    @property
+    def conclusive(self) -> bool:
+        """The pre-check is the whole answer (the LLM is skipped)"""
+        return PRECHECK_SHORT_CIRCUIT and bool(self.incomplete)
+
+    def table(self) -> str:
+        """Coverage table for the LLM prompts"""
+        if not self.coverage:
+            return ""
+        lines = ["=== REQUIREMENT COVERAGE (keyword pre-check) ==="]
+        for idx, item in enumerate(self.coverage, 1):
+            line = f"{idx}. [{item.status}] {item.requirement}"
+            if item.matched:
+                line += f" - found {item.evidence()}"
+            if item.status in ("partial", "missing"):
+                line += f" - no {', '.join(item.missing_concepts)} label found"
+            lines.append(line)
+        lines.append(
+            f"Labeled components: {self.labeled}/{self.components}, connections: {self.connections}. "
+            "Labels were matched by keyword and synonym: confirm each row against the diagram, "
+            "and judge [unverified] rows yourself."
+        )
+        return "\n".join(lines)
+
+    def implemented(self) -> List[str]:
+        items = [
+            f"{item.requirement} ({item.evidence()})"
+            for item in self.coverage if item.status in ("met", "partial")
+        ]
+        if not items and self.labeled:
+            items.append(f"Started the design with {self.labeled} labeled component{'s' if self.labeled != 1 else ''}")
+        return items[:5]
+
+    def missing(self) -> List[str]:
+        items = []
+        if not self.components:
+            items.append("No components drawn on canvas")
+        elif self.labeled < self.components:
+            items.append(f"{self.components - self.labeled} of {self.components} components have no label")
+        if self.components and not self.connections:
+            items.append("No connections between components")
+        items.extend(
+            f"{item.requirement} (no {', '.join(item.missing_concepts)} in the diagram)"
+            for item in self.coverage if item.status in ("partial", "missing")
+        )
+        return items[:5]
+
+    def next_steps(self) -> List[str]:
+        steps = []
+        if self.labeled < self.components or not self.components:
+            steps.append('Draw each component as a shape and label it with what it is (e.g. "API Gateway", "Redis Cache")')
+        missing = list(dict.fromkeys(
+            concept for item in self.coverage for concept in item.missing_concepts
+        ))
+        steps.extend(_add_step(concept) for concept in missing)
+        if self.components and not self.connections:
+            steps.append("Connect components with arrows to show how requests and data flow")
+        steps.append("Check again once the diagram covers the requirements for detailed AI feedback")
+        return steps[:5]
+
+    def feedback(self) -> Dict[str, List[str]]:
+        """Check feedback (implemented / missing / next_steps) from the pre-check alone"""
+        return {
+            "implemented": self.implemented(),
+            "missing": self.missing(),
+            "next_steps": self.next_steps()
+        }
+
+    def scoring(self) -> Dict[str, Any]:
+        """Scoring result (same shape as score_solution) from the pre-check alone"""
+        weight = 100 / len(self.coverage) if self.coverage else 0
+        breakdown = []
+        for item in self.coverage:
+            status = item.status
+            if status == "met":
+                points, note = weight, f"Pre-check: found {item.evidence()}"
+            elif status == "partial":
+                points, note = weight / 2, f"Pre-check: found {item.evidence()}; no {', '.join(item.missing_concepts)}"
+            elif status == "missing":
+                points, note = 0, f"Pre-check: no {', '.join(item.missing_concepts)} in the diagram"
+            else:
+                points, note = 0, "Not assessed: diagram incomplete"
+            breakdown.append({
+                "requirement": item.requirement,
+                "achieved": status == "met",
+                "points": round(points, 1),
+                "note": note
+            })
+        if not breakdown:
+            breakdown.append({
+                "requirement": "Any component",
+                "achieved": False,
+                "points": 0,
+                "note": self.incomplete
+            })
+        return {
+            "score": round(min(sum(item["points"] for item in breakdown), PRECHECK_MAX_SCORE), 1),
+            "max_score": 100,
+            "breakdown": breakdown,
+            "implemented": self.implemented(),
+            "missing": self.missing()
+        }
+
+
+def precheck_requirements(
+    problem_data: Dict[str, Any],
+    diagram_data: Dict[str, Any],
+    diagram_hash: Optional[str] = None
+) -> PreCheck:
+    """
+    Match problem_data's requirements against the labels of diagram_data
+    (components, connections and free text; memoized graph when diagram_hash
+    is given).
+    """
+    graph = diagram_graph(diagram_data, diagram_hash)
+
+    # Building block -> names of the elements providing it, one pass over the labels
+    provided: Dict[str, List[str]] = {}
+    for record in (*graph.components, *graph.connections, *graph.annotations):
+        for concept in find_concepts(record.label):
+            provided.setdefault(concept, []).append(record.label)
+
+    coverage = []
+    for requirement in problem_data.get("requirements") or []:
+        if not isinstance(requirement, str) or not requirement.strip():
+            continue
+        concepts = find_concepts(requirement)
+        coverage.append(RequirementCoverage(
+            requirement=requirement.strip(),
+            concepts=concepts,
+            matched={concept: provided[concept] for concept in concepts if concept in provided}
+        ))
+
+    components = len(graph.components)
+    labeled = sum(1 for comp in graph.components if comp.label)
+    precheck = PreCheck(coverage, components, labeled, len(graph.connections), "")
+
+    # Shapes are often named by free text next to them rather than bound text
+    labels = labeled + sum(1 for text in graph.annotations if text.label)
+    covered = bool(precheck.checkable) and precheck.ratio >= PRECHECK_MIN_COVERAGE
+
+    if not components:
+        incomplete = "Empty diagram"
+    elif labels < min(PRECHECK_MIN_LABELED, components) and not covered:
+        incomplete = "Components are not labeled"
+    elif (len(precheck.checkable) >= 2 and precheck.ratio < PRECHECK_MIN_COVERAGE
+          and (labels < PRECHECK_SPARSE_LABELS or precheck.connections < PRECHECK_SPARSE_CONNECTIONS)):
+        incomplete = f"Covers {precheck.ratio:.0%} of the checkable requirements"
+    else:
+        incomplete = ""
+    return precheck._replace(incomplete=incomplete)
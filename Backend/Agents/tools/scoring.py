@@ -9,11 +9,14 @@ from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 import os
 
+from .token_budget import TOKEN_BUDGETS, fit_text, pack_sections
+
 
 async def score_solution(
     problem_data: Dict[str, Any],
     diagram_data: Dict[str, Any],
-    diagram_str: str
+    diagram_str: str,
+    coverage_str: str = ""
 ) -> Dict[str, Any]:
     """
     Use gpt-4o-mini LLM to evaluate the system design solution.
@@ -21,7 +24,8 @@ async def score_solution(
     Args:
         problem_data: Problem requirements and info
         diagram_data: Raw Excalidraw data
-        diagram_str: Formatted diagram summary
+        diagram_str: Formatted diagram summary (already within the scoring token budget)
+        coverage_str: Requirement coverage table from the pre-check, if any
     
     Returns:
         Scoring result dict with score, breakdown, implemented, missing
@@ -63,6 +67,12 @@ async def score_solution(
         model_name = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
         llm = ChatOpenAI(model=model_name, temperature=0.3, api_key=api_key)
         
+        description = fit_text(problem_data.get('description') or 'No description', TOKEN_BUDGETS["description"])
+        requirements = pack_sections(
+            [], [("requirements", "", [f"{i+1}. {req}" for i, req in enumerate(problem_data.get('requirements') or ['No requirements'])])],
+            TOKEN_BUDGETS["requirements"], "requirements"
+        ).text
+        
         system_prompt = """You are a system design evaluator. Score the student's diagram (0-100) against requirements.
 
 Evaluate: components, connections, scalability, best practices, labels.
@@ -78,16 +88,20 @@ Be specific, reference actual component names, and tie every remark back to the
 
         user_prompt = f"""Problem: {problem_data.get('title', 'Unknown')}
 
-Description: {problem_data.get('description', 'No description')[:200]}
+Description: {description}
 
 Requirements:
-{chr(10).join(f"{i+1}. {req}" for i, req in enumerate(problem_data.get('requirements', ['No requirements'])[:7]))}
+{requirements}
 
 Student's Diagram:
-{diagram_str[:800]}
+{diagram_str}
+
+{coverage_str or "No requirement coverage pre-check."}
 
 Stats: {len(elements)} elements, {len([e for e in elements if e.get('type') in ['rectangle', 'ellipse', 'diamond']])} components, {len([e for e in elements if e.get('type') == 'arrow'])} arrows, {len([e for e in elements if e.get('type') == 'text'])} labels
 
+Use the coverage table as a starting point, but verify each row against the diagram.
+
 Deliver feedback that applies ONLY to this problem statement. If a requirement is unclear or absent in the diagram, flag it as missing rather than inventing new scope.
 
 Score and provide detailed feedback in JSON."""
@@ -21,7 +21,7 @@ async def generate_tips(
     Args:
         problem_data: Problem info with title, requirements, etc.
         scoring_result: Score, implemented, missing arrays
-        diagram_str: Formatted diagram summary
+        diagram_str: Formatted diagram summary (already within the tips token budget)
     
     Returns:
         List of 4-6 actionable tips, empty list if LLM unavailable
@@ -67,7 +67,8 @@ Did well: {', '.join(implemented[:3]) if implemented else 'Nothing identified'}
 
 Missing: {', '.join(missing[:3]) if missing else 'No gaps'}
 
-Diagram: {diagram_str[:400]}
+Diagram:
+{diagram_str}
 
 Generate 4-6 specific tips."""
 
@@ -0,0 +1,190 @@
+"""
+Token Budget Tool
+Counts prompt tokens offline and packs prompt sections into a token budget
+per agent, instead of cutting strings at a fixed character count.
+Sections are given in order of importance (labeled components, connections,
+annotations, ...), each with a guaranteed share of the budget, and taken line
+by line while they fit: a line is never cut, and a section that does not fit
+ends with "... N more <section>". Free text
+(a problem description) is cut at a sentence or word boundary.
+
+Tokens are counted with tiktoken for OPENAI_MODEL when its encoding can be
+loaded (it is fetched once, then read from TIKTOKEN_CACHE_DIR), otherwise
+estimated from the text length.
+"""
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from metrics import REGISTRY
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:  # optional dependency
+    tiktoken = None
+    TIKTOKEN_AVAILABLE = False
+
+
+# Tokens each agent may spend on a prompt section
+TOKEN_BUDGETS: Dict[str, int] = {
+    # Diagram summaries
+    "check": int(os.getenv("CHECK_DIAGRAM_TOKEN_BUDGET", "3000")),
+    "chat": int(os.getenv("CHAT_DIAGRAM_TOKEN_BUDGET", "2000")),
+    "scoring": int(os.getenv("SCORING_DIAGRAM_TOKEN_BUDGET", "600")),
+    "tips": int(os.getenv("TIPS_DIAGRAM_TOKEN_BUDGET", "300")),
+    # Question parts of the scoring prompt
+    "description": int(os.getenv("DESCRIPTION_TOKEN_BUDGET", "80")),
+    "requirements": int(os.getenv("REQUIREMENTS_TOKEN_BUDGET", "400")),
+}
+
+# Guaranteed budget shares of the diagram summary sections: labeled
+# components, connections, annotations, unlabeled shapes. Unused room goes to
+# the sections in that order.
+DIAGRAM_SECTION_SHARES = (0.45, 0.35, 0.15, 0.05)
+
+# Average for English and diagram labels when tiktoken is unavailable
+CHARS_PER_TOKEN = 4
+# Room kept for the "... N more <section>" line
+MORE_LINE_TOKENS = 8
+
+prompt_tokens = REGISTRY.histogram("prompt_section_tokens", "Tokens of a packed prompt section, by agent")
+prompt_lines_omitted = REGISTRY.counter(
+    "prompt_lines_omitted_total",
+    "Prompt lines left out to stay within a token budget, by agent and section"
+)
+
+# None: not loaded yet; False: unavailable (estimate from length)
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        encoding = False
+        if TIKTOKEN_AVAILABLE:
+            model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model)
+                except KeyError:  # a model tiktoken does not know yet
+                    encoding = tiktoken.get_encoding("o200k_base")
+            except Exception as e:  # encoding not cached and no network
+                print(f"WARNING: tiktoken encoding unavailable ({e.__class__.__name__}) - estimating token counts")
+                encoding = False
+        _encoding = encoding
+    return _encoding or None
+
+
+def load_token_encoding() -> bool:
+    """
+    Load the tokenizer ahead of the first prompt (on startup, off the event
+    loop: the first load may download it). False when token counts are estimated.
+    """
+    return _get_encoding() is not None
+
+
+def count_tokens(text: str) -> int:
+    """Tokens of text for OPENAI_MODEL (estimated when tiktoken is unavailable)"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode_ordinary(text))
+
+
+def fit_text(text: str, budget: int) -> str:
+    """text within budget tokens, cut after a sentence (or else a word)"""
+    if not text or count_tokens(text) <= budget:
+        return text or ""
+    encoding = _get_encoding()
+    if encoding is None:
+        cut = text[:max(0, budget - 1) * CHARS_PER_TOKEN]
+    else:
+        cut = encoding.decode(encoding.encode_ordinary(text)[:max(0, budget - 1)])
+    sentence = max(cut.rfind(". "), cut.rfind("! "), cut.rfind("? "), cut.rfind("\n"))
+    if sentence >= len(cut) // 2:
+        return cut[:sentence + 1].rstrip()
+    word = cut.rfind(" ")
+    return (cut[:word] if word > 0 else cut).rstrip() + "..."
+
+
+class PackedText(NamedTuple):
+    text: str
+    tokens: int
+    budget: int
+    # section -> lines left out
+    omitted: Dict[str, int]
+
+
+def _take(section: Sequence[str], start: int, room: int) -> Tuple[int, int]:
+    """How many lines of section from start fit in room tokens, and their tokens"""
+    taken, cost = 0, 0
+    for line in section[start:]:
+        line_cost = count_tokens(line) + 1
+        if cost + line_cost > room:
+            break
+        taken += 1
+        cost += line_cost
+    return taken, cost
+
+
+def pack_sections(
+    header: Sequence[str],
+    sections: Sequence[Tuple[str, str, Sequence[str]]],
+    budget: Optional[int],
+    agent: str,
+    shares: Optional[Sequence[float]] = None
+) -> PackedText:
+    """
+    header lines (always kept), then each (name, title, lines) section in
+    order, line by line while the total stays within budget tokens (None:
+    no limit). With shares, each section is first guaranteed its share of
+    the budget (so one long section cannot crowd out the next ones), and
+    what is left goes to the sections in order. Sections are separated by a
+    blank line; an empty title adds no title line.
+    """
+    present = [
+        (name, [title] if title else [], section, share)
+        for (name, title, section), share in zip(sections, shares or [0.0] * len(sections))
+        if section
+    ]
+    taken = [0] * len(present)
+    omitted: Dict[str, int] = {}
+
+    if budget is None:
+        taken = [len(section) for _, _, section, _ in present]
+    else:
+        # Header, then per section: spacer, title and room for its "... N more" line
+        overhead = sum(count_tokens(line) + 1 for line in header) + sum(
+            1 + sum(count_tokens(line) + 1 for line in title_lines) + MORE_LINE_TOKENS
+            for _, title_lines, _, _ in present
+        )
+        room = max(0, budget - overhead)
+        left = room
+        # Guaranteed shares first, then the rest in order of importance
+        for idx, (_, _, section, share) in enumerate(present):
+            if share:
+                taken[idx], cost = _take(section, 0, min(left, int(room * share)))
+                left -= cost
+        for idx, (_, _, section, _) in enumerate(present):
+            more, cost = _take(section, taken[idx], left)
+            taken[idx] += more
+            left -= cost
+
+    lines: List[str] = list(header)
+    for (name, title_lines, section, _), count in zip(present, taken):
+        if not count:
+            omitted[name] = len(section)
+            continue
+        lines.extend([*([""] if lines else []), *title_lines, *section[:count]])
+        if count < len(section):
+            omitted[name] = len(section) - count
+            lines.append(f"... {omitted[name]} more {name}")
+
+    text = "\n".join(lines)
+    tokens = count_tokens(text)
+    prompt_tokens.observe(tokens, labels={"agent": agent})
+    for name, count in omitted.items():
+        prompt_lines_omitted.inc(count, labels={"agent": agent, "section": name})
+    return PackedText(text, tokens, budget or 0, omitted)
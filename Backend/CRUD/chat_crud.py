@@ -0,0 +1,109 @@
+"""
+Session chat messages.
+Each message is its own document in `chat_messages`, indexed by
+(session_id, timestamp), so adding one never rewrites the session and reading
+the conversation is paginated. The session keeps only a `message_count`.
+Sessions written before the split still embed a `chat_messages` array until
+scripts/migrate_chat_messages.py moves it here.
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from database import db
+from CRUD.pagination import keyset_filter, keyset_sort
+
+chat_collection = db.get_collection("chat_messages")
+
+# Role used by /check to cache its JSON feedback per diagram hash
+CHECK_ROLE = "system_check"
+
+MESSAGE_PROJECTION = {"role": 1, "content": 1, "timestamp": 1, "diagram_hash": 1}
+
+
+def build_message(
+    session_id: str,
+    user_id: str,
+    role: str,
+    content: str,
+    diagram_hash: Optional[str] = None,
+    timestamp: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Chat message document (diagram_hash only when tagging check feedback)"""
+    message = {
+        "session_id": session_id,
+        "user_id": user_id,
+        "role": role,
+        "content": content,
+        "timestamp": timestamp or datetime.utcnow()
+    }
+    if diagram_hash is not None:
+        message["diagram_hash"] = diagram_hash
+    return message
+
+
+async def insert_message(message: Dict[str, Any]) -> Dict[str, Any]:
+    result = await chat_collection.insert_one(message)
+    message["_id"] = result.inserted_id
+    return message
+
+
+async def delete_message(message_id: Any) -> None:
+    await chat_collection.delete_one({"_id": message_id})
+
+
+async def get_messages(
+    session_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    One page of a session's messages, newest first, older pages via cursor.
+    Raises ValueError for a malformed cursor.
+    """
+    query = keyset_filter({"session_id": session_id}, "timestamp", cursor)
+    return await chat_collection.find(
+        query, MESSAGE_PROJECTION
+    ).sort(keyset_sort("timestamp")).limit(limit).to_list(length=limit)
+
+
+async def get_recent_messages(session_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """The latest messages of a session in chronological order"""
+    messages = await get_messages(session_id, limit)
+    messages.reverse()
+    return messages
+
+
+async def get_all_messages(session_id: str) -> List[Dict[str, Any]]:
+    """Whole conversation in chronological order (used when snapshotting into a submission)"""
+    cursor = chat_collection.find(
+        {"session_id": session_id}, MESSAGE_PROJECTION
+    ).sort([("timestamp", 1), ("_id", 1)])
+    return await cursor.to_list(length=None)
+
+
+async def find_check_feedback(session_id: str, diagram_hash: str) -> Optional[Dict[str, Any]]:
+    """Latest /check feedback message stored for this exact diagram, if any"""
+    return await chat_collection.find_one(
+        {"session_id": session_id, "role": CHECK_ROLE, "diagram_hash": diagram_hash},
+        {"content": 1},
+        sort=[("timestamp", -1)]
+    )
+
+
+async def get_latest_check_hash(session_id: str) -> Optional[str]:
+    """diagram_hash of the session's most recent /check, if any"""
+    message = await chat_collection.find_one(
+        {"session_id": session_id, "role": CHECK_ROLE},
+        {"diagram_hash": 1},
+        sort=[("timestamp", -1)]
+    )
+    return message.get("diagram_hash") if message else None
+
+
+async def delete_messages(session_ids: Iterable[str]) -> int:
+    """Delete every message of the given sessions"""
+    ids = list(session_ids)
+    if not ids:
+        return 0
+    result = await chat_collection.delete_many({"session_id": {"$in": ids}})
+    return result.deleted_count
@@ -0,0 +1,159 @@
+"""
+Content-addressed diagram store.
+Each distinct diagram is stored once in the `diagrams` collection, keyed by its
+diagram hash, with a reference count. Sessions and submissions keep only
+`diagram_hash` plus `diagram_stored: True`; documents written before the store
+existed still embed `diagram_data` and are read as-is.
+Stored diagrams are encoded by diagram_codec (compressed JSON bytes by default).
+"""
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+import os
+
+from pymongo import UpdateOne
+
+from database import db
+from cache import LRUTTLCache
+from diagram_codec import encode_diagram, decode_diagram
+from diagram_hashing import calculate_diagram_hash
+from diagram_offload import run_diagram_op, estimate_diagram_size
+
+diagrams_collection = db.get_collection("diagrams")
+
+# Fields to project when a write needs to know what the document referenced
+DIAGRAM_REF_PROJECTION = {"diagram_hash": 1, "diagram_stored": 1}
+
+# Everything a stored diagram record may carry, in any codec
+DIAGRAM_RECORD_PROJECTION = {"codec": 1, "blob": 1, "data": 1}
+
+# Decoded diagrams by hash. Content-addressed entries never go stale, so this
+# only needs a size bound; delta autosaves read their base diagram from here.
+diagram_cache = LRUTTLCache(
+    "diagrams",
+    maxsize=int(os.getenv("DIAGRAM_CACHE_SIZE", "256")),
+    ttl=None
+)
+
+
+def _record_size(record: Optional[Dict[str, Any]]) -> int:
+    if not record:
+        return 0
+    return record.get("raw_size") or estimate_diagram_size(record.get("data"))
+
+
+async def _decode(record: Optional[Dict[str, Any]]) -> Dict[Any, Any]:
+    return await run_diagram_op("decode", _record_size(record), decode_diagram, record, process_safe=True)
+
+
+async def hash_diagram_data(diagram_data: Dict[Any, Any]) -> str:
+    """calculate_diagram_hash (not memoized), off the event loop for large diagrams"""
+    return await run_diagram_op(
+        "hash", estimate_diagram_size(diagram_data), calculate_diagram_hash, diagram_data, process_safe=True
+    )
+
+
+def holds_reference(doc: Optional[Dict[str, Any]]) -> bool:
+    """True if the document's diagram_hash is a counted reference into the store"""
+    return bool(doc and doc.get("diagram_stored") and doc.get("diagram_hash"))
+
+
+async def retain_diagram(diagram_hash: str, diagram_data: Dict[Any, Any]) -> None:
+    """
+    Add one reference to a diagram, inserting it if this is the first.
+    Always carries the data so a concurrent release-to-zero can't leave a
+    reference pointing at nothing.
+    """
+    encoded = await run_diagram_op(
+        "encode", estimate_diagram_size(diagram_data), encode_diagram, diagram_data, process_safe=True
+    )
+    await diagrams_collection.update_one(
+        {"_id": diagram_hash},
+        {
+            "$setOnInsert": {**encoded, "created_at": datetime.utcnow()},
+            "$inc": {"refcount": 1}
+        },
+        upsert=True
+    )
+
+
+async def release_diagrams(diagram_hashes: Iterable[str]) -> None:
+    """Drop one reference per hash given (repeats allowed) and delete unreferenced diagrams"""
+    counts = Counter(h for h in diagram_hashes if h)
+    if not counts:
+        return
+
+    await diagrams_collection.bulk_write(
+        [UpdateOne({"_id": h}, {"$inc": {"refcount": -n}}) for h, n in counts.items()],
+        ordered=False
+    )
+    await diagrams_collection.delete_many({"_id": {"$in": list(counts)}, "refcount": {"$lte": 0}})
+
+
+async def release_diagram(diagram_hash: Optional[str]) -> None:
+    """Drop one reference to a diagram"""
+    if diagram_hash:
+        await release_diagrams([diagram_hash])
+
+
+async def get_diagram(diagram_hash: str) -> Optional[Dict[Any, Any]]:
+    """
+    Load and decode a stored diagram by hash, through the per-worker cache.
+    The result is shared: treat it as read-only.
+    """
+    diagram = diagram_cache.get(diagram_hash)
+    if diagram is not None:
+        return diagram
+
+    record = await diagrams_collection.find_one({"_id": diagram_hash}, DIAGRAM_RECORD_PROJECTION)
+    if not record:
+        return None
+    diagram = await _decode(record)
+    diagram_cache.set(diagram_hash, diagram)
+    return diagram
+
+
+async def _fetch_records(docs: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    hashes = list({d["diagram_hash"] for d in docs})
+    cursor = diagrams_collection.find({"_id": {"$in": hashes}}, DIAGRAM_RECORD_PROJECTION)
+    return {record["_id"]: record async for record in cursor}
+
+
+async def hydrate_diagrams(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Fill in diagram_data on session/submission documents that reference the
+    store, with a single query for the whole batch. Legacy documents that embed
+    their diagram are left untouched.
+    """
+    pending = [d for d in docs if d and "diagram_data" not in d and holds_reference(d)]
+    if not pending:
+        return docs
+
+    records = await _fetch_records(pending)
+    for doc in pending:
+        doc["diagram_data"] = await _decode(records.get(doc["diagram_hash"]))
+    return docs
+
+
+async def hydrate_diagram(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Single-document form of hydrate_diagrams"""
+    if doc:
+        await hydrate_diagrams([doc])
+    return doc
+
+
+async def attach_diagram_record(doc: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Set doc["diagram_record"] to the stored diagram without decoding it, for
+    handing to http_cache.diagram_response. Legacy embedded diagrams are
+    wrapped as a nested record.
+    """
+    if not doc:
+        return doc
+    if "diagram_data" in doc or not holds_reference(doc):
+        doc["diagram_record"] = {"data": doc.pop("diagram_data", {})}
+        return doc
+
+    records = await _fetch_records([doc])
+    doc["diagram_record"] = records.get(doc["diagram_hash"])
+    return doc
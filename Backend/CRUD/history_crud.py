@@ -0,0 +1,199 @@
+"""
+Diagram version history.
+Every saved change of a session's diagram appends an entry to
+`diagram_history`, keyed by the session version it produced (seq):
+  - a snapshot references the full diagram in the content-addressed store
+  - a delta holds only the element changes since the previous entry
+A worker writes a snapshot at least every DIAGRAM_HISTORY_SNAPSHOT_EVERY
+entries (and whenever it did not record the previous one), so any version is
+rebuilt from one snapshot plus fewer deltas than that, and storage grows with
+the changes rather than with diagram size x saves.
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from database import db
+from cache import LRUTTLCache
+from CRUD.pagination import keyset_filter, keyset_sort
+from CRUD.diagram_crud import retain_diagram, release_diagram, release_diagrams, get_diagram
+from diagram_delta import apply_element_delta, element_delta
+from diagram_offload import run_diagram_op, estimate_diagram_size
+
+history_collection = db.get_collection("diagram_history")
+
+DIAGRAM_HISTORY = os.getenv("DIAGRAM_HISTORY", "true").lower() in ("1", "true", "yes")
+DIAGRAM_HISTORY_SNAPSHOT_EVERY = max(1, int(os.getenv("DIAGRAM_HISTORY_SNAPSHOT_EVERY", "20")))
+
+ENTRY_SUMMARY_PROJECTION = {"seq": 1, "kind": 1, "diagram_hash": 1, "saved_at": 1, "changed": 1}
+
+# session_id -> (diagram_hash, diagram, deltas since its snapshot) of the last
+# entry this worker recorded; the next change is diffed against it
+_last_recorded = LRUTTLCache(
+    "diagram_history_states",
+    maxsize=int(os.getenv("DIAGRAM_HISTORY_STATE_CACHE_SIZE", "256")),
+    ttl=None
+)
+
+
+# ---------- Recording ----------
+
+async def record_change(
+    session_id: str,
+    user_id: str,
+    seq: int,
+    previous_hash: Optional[str],
+    diagram_hash: str,
+    diagram: Dict[str, Any]
+) -> None:
+    """
+    Append the session's new diagram (saved as version seq, replacing
+    previous_hash) to its history. Never raises: history is best effort and a
+    failed entry only makes the next one a snapshot.
+    """
+    if not DIAGRAM_HISTORY:
+        return
+
+    entry: Dict[str, Any] = {
+        "session_id": session_id,
+        "user_id": user_id,
+        "seq": seq,
+        "diagram_hash": diagram_hash,
+        "saved_at": datetime.utcnow()
+    }
+    last = _last_recorded.get(session_id)
+    delta = None
+    if last and last[0] == previous_hash and last[2] + 1 < DIAGRAM_HISTORY_SNAPSHOT_EVERY:
+        delta = await run_diagram_op("history_delta", estimate_diagram_size(diagram), element_delta, last[1], diagram)
+
+    try:
+        if delta is not None:
+            entry.update(delta)
+            entry.update({
+                "kind": "delta",
+                "base_hash": previous_hash,
+                "changed": len(delta["upserts"]) + len(delta["deletes"])
+            })
+            since_snapshot = last[2] + 1
+        else:
+            await retain_diagram(diagram_hash, diagram)
+            entry.update({"kind": "snapshot", "changed": len(diagram.get("elements") or [])})
+            since_snapshot = 0
+        try:
+            await history_collection.insert_one(entry)
+        except DuplicateKeyError:
+            # Version already recorded (e.g. a retried flush)
+            if entry["kind"] == "snapshot":
+                await release_diagram(diagram_hash)
+            return
+    except PyMongoError as e:
+        _last_recorded.invalidate(session_id)
+        print(f"WARNING: failed to record diagram history of session {session_id}: {e}")
+        return
+    _last_recorded.set(session_id, (diagram_hash, diagram, since_snapshot))
+
+
+def forget(session_id: str) -> None:
+    """Drop this worker's diff base of a session (e.g. when it ends)"""
+    _last_recorded.invalidate(session_id)
+
+
+# ---------- Reading ----------
+
+async def get_history(
+    session_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    One page of a session's history entries (summaries), newest first.
+    Raises ValueError for a malformed cursor.
+    """
+    query = keyset_filter({"session_id": session_id}, "saved_at", cursor)
+    return await history_collection.find(
+        query, ENTRY_SUMMARY_PROJECTION
+    ).sort(keyset_sort("saved_at")).limit(limit).to_list(length=limit)
+
+
+async def get_latest_entry(session_id: str) -> Optional[Dict[str, Any]]:
+    return await history_collection.find_one(
+        {"session_id": session_id}, ENTRY_SUMMARY_PROJECTION, sort=[("seq", DESCENDING)]
+    )
+
+
+async def get_entry_at_time(session_id: str, at: datetime) -> Optional[Dict[str, Any]]:
+    """The last entry saved at or before at ("restore to 10 minutes ago")"""
+    return await history_collection.find_one(
+        {"session_id": session_id, "saved_at": {"$lte": at}},
+        ENTRY_SUMMARY_PROJECTION,
+        sort=[("saved_at", DESCENDING), ("_id", DESCENDING)]
+    )
+
+
+async def get_entry_for_hash(session_id: str, diagram_hash: str) -> Optional[Dict[str, Any]]:
+    """The latest entry that produced this diagram (e.g. the one a /check ran on)"""
+    return await history_collection.find_one(
+        {"session_id": session_id, "diagram_hash": diagram_hash},
+        ENTRY_SUMMARY_PROJECTION,
+        sort=[("seq", DESCENDING)]
+    )
+
+
+async def get_diagram_at(session_id: str, seq: int) -> Optional[Tuple[Dict[str, Any], Dict[str, Any]]]:
+    """
+    (entry, diagram) of the session as of version seq: the last entry at or
+    before seq, rebuilt from the nearest snapshot plus the deltas after it.
+    None if there is no history that far back or the delta chain is broken.
+    """
+    snapshot = await history_collection.find_one(
+        {"session_id": session_id, "kind": "snapshot", "seq": {"$lte": seq}},
+        sort=[("seq", DESCENDING)]
+    )
+    if not snapshot:
+        return None
+    diagram = await get_diagram(snapshot["diagram_hash"])
+    if diagram is None:
+        return None
+
+    deltas = await history_collection.find(
+        {"session_id": session_id, "seq": {"$gt": snapshot["seq"], "$lte": seq}}
+    ).sort("seq", ASCENDING).to_list(length=None)
+
+    entry = snapshot
+    for delta in deltas:
+        if delta.get("base_hash") != entry["diagram_hash"]:
+            print(f"WARNING: broken diagram history chain for session {session_id} at seq {delta['seq']}")
+            return None
+        diagram = await run_diagram_op(
+            "apply_delta",
+            estimate_diagram_size(diagram),
+            apply_element_delta,
+            diagram,
+            delta.get("upserts") or [],
+            delta.get("deletes") or [],
+            delta.get("app_state"),
+            delta.get("files"),
+            delta.get("order")
+        )
+        entry = delta
+    return {k: entry.get(k) for k in ("_id", *ENTRY_SUMMARY_PROJECTION)}, diagram
+
+
+# ---------- Cleanup ----------
+
+async def delete_history(session_ids: Iterable[str]) -> int:
+    """Delete the history of the given sessions and release their snapshots"""
+    ids = list(session_ids)
+    if not ids:
+        return 0
+    snapshots = await history_collection.find(
+        {"session_id": {"$in": ids}, "kind": "snapshot"}, {"diagram_hash": 1}
+    ).to_list(length=None)
+    result = await history_collection.delete_many({"session_id": {"$in": ids}})
+    await release_diagrams(s["diagram_hash"] for s in snapshots)
+    for session_id in ids:
+        forget(session_id)
+    return result.deleted_count
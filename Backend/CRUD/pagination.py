@@ -0,0 +1,97 @@
+"""
+Keyset (cursor) pagination helpers.
+Pages are addressed by the (sort field, _id) of the last document seen, so
+fetching page N costs the same as page 1 when a matching
+(filter..., sort field, _id) index exists.
+"""
+import base64
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+
+
+COUNT_CACHE_TTL_SECONDS = 60
+COUNT_CACHE_MAX_ENTRIES = 10000
+
+# (collection name, filter repr) -> (expires_at, count)
+_count_cache: Dict[Tuple[str, str], Tuple[float, int]] = {}
+
+
+def encode_cursor(sort_value: datetime, doc_id: Any) -> str:
+    """Opaque cursor for the position right after (sort_value, doc_id)"""
+    payload = json.dumps({"v": sort_value.isoformat(), "id": str(doc_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Inverse of encode_cursor. Raises ValueError for anything malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        sort_value = datetime.fromisoformat(payload["v"])
+        doc_id = ObjectId(payload["id"])
+    except Exception:
+        raise ValueError("Invalid pagination cursor")
+    return sort_value, doc_id
+
+
+def keyset_filter(base_filter: Dict[str, Any], sort_field: str, cursor: Optional[str]) -> Dict[str, Any]:
+    """Restrict base_filter to documents after the cursor in (sort_field desc, _id desc) order"""
+    if not cursor:
+        return base_filter
+
+    sort_value, doc_id = decode_cursor(cursor)
+    after = {"$or": [
+        {sort_field: {"$lt": sort_value}},
+        {sort_field: sort_value, "_id": {"$lt": doc_id}},
+    ]}
+    if not base_filter:
+        return after
+    return {"$and": [base_filter, after]}
+
+
+def keyset_sort(sort_field: str) -> List[Tuple[str, int]]:
+    """Sort order matching keyset_filter (newest first, _id as tie-breaker)"""
+    return [(sort_field, -1), ("_id", -1)]
+
+
+def with_sort_field(projection: Optional[Dict[str, int]], sort_field: str) -> Optional[Dict[str, int]]:
+    """Make sure an inclusion projection still returns the field the cursor is built from"""
+    if projection and any(value == 1 for value in projection.values()):
+        return {**projection, sort_field: 1}
+    return projection
+
+
+def next_cursor(docs: List[Dict[str, Any]], sort_field: str, limit: int) -> Optional[str]:
+    """Cursor for the following page, or None when this page was the last one"""
+    if len(docs) < limit or not docs:
+        return None
+    last = docs[-1]
+    if not isinstance(last.get(sort_field), datetime):
+        return None
+    return encode_cursor(last[sort_field], last["_id"])
+
+
+async def cached_count(collection, query: Dict[str, Any]) -> int:
+    """
+    Total number of documents matching query, cached per worker for a short TTL.
+    An empty filter uses the collection metadata count, which is O(1).
+    """
+    key = (collection.name, repr(sorted(query.items())))
+    now = time.monotonic()
+    cached = _count_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    if query:
+        total = await collection.count_documents(query)
+    else:
+        total = await collection.estimated_document_count()
+
+    if len(_count_cache) >= COUNT_CACHE_MAX_ENTRIES:
+        _count_cache.clear()
+    _count_cache[key] = (now + COUNT_CACHE_TTL_SECONDS, total)
+    return total
@@ -1,7 +1,31 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from bson import ObjectId
+from pymongo import DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+import asyncio
+import copy
+import os
+import re
 from database import db
+from cache import LRUTTLCache
+from CRUD.pagination import keyset_filter, keyset_sort, cached_count
+
+
+# Problems almost never change, so every agent request reads them from here.
+# Writes through this module invalidate immediately; other workers converge via
+# the change stream watcher (when enabled) or the TTL.
+problem_cache = LRUTTLCache(
+    "problems",
+    maxsize=int(os.getenv("PROBLEM_CACHE_SIZE", "512")),
+    ttl=float(os.getenv("PROBLEM_CACHE_TTL_SECONDS", "300"))
+)
+PROBLEM_CACHE_CHANGE_STREAM = os.getenv("PROBLEM_CACHE_CHANGE_STREAM", "false").lower() in ("1", "true", "yes")
+# Restart delays of the change stream watcher after an error, in seconds
+WATCHER_BACKOFF_INITIAL = 1.0
+WATCHER_BACKOFF_MAX = 60.0
+# OperationFailure code: change streams are only supported on replica sets
+NOT_A_REPLICA_SET = 40573
 
 
 async def create_problem(
@@ -39,25 +63,35 @@ async def create_problem(
 
 async def get_problem_by_id(problem_id: str) -> Optional[dict]:
     """
-    Retrieve a problem by its ID.
+    Retrieve a problem by its ID (served from the in-process cache when possible).
     """
     if not ObjectId.is_valid(problem_id):
         return None
     
+    cached = problem_cache.get(problem_id)
+    if cached is not None:
+        # Deep copy: callers may mutate the nested lists (requirements, hints...)
+        return copy.deepcopy(cached)
+    
     problem = await db.problems.find_one({"_id": ObjectId(problem_id)})
     if not problem:
         return None
 
     problem["_id"] = str(problem["_id"])
+    problem_cache.set(problem_id, copy.deepcopy(problem))
     return problem
 
 
-async def get_all_problems(skip: int = 0, limit: int = 100) -> List[dict]:
+async def get_all_problems(skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[dict]:
     """
-    Retrieve all problems with pagination.
+    Retrieve all problems with pagination, newest first.
+    Pass the previous page's cursor for keyset pagination (skip is then ignored).
     """
-    cursor = db.problems.find().skip(skip).limit(limit).sort("created_at", -1)
-    problems = await cursor.to_list(length=limit)
+    query = keyset_filter({}, "created_at", cursor)
+    db_cursor = db.problems.find(query).sort(keyset_sort("created_at"))
+    if not cursor:
+        db_cursor = db_cursor.skip(skip)
+    problems = await db_cursor.limit(limit).to_list(length=limit)
     
     for problem in problems:
         problem["_id"] = str(problem["_id"])
@@ -65,12 +99,21 @@ async def get_all_problems(skip: int = 0, limit: int = 100) -> List[dict]:
     return problems
 
 
-async def get_problems_by_user(user_email: str, skip: int = 0, limit: int = 100) -> List[dict]:
+async def get_problems_by_user(
+    user_email: str,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[dict]:
     """
-    Retrieve all problems created by a specific user.
+    Retrieve all problems created by a specific user, newest first.
+    Pass the previous page's cursor for keyset pagination (skip is then ignored).
     """
-    cursor = db.problems.find({"created_by": user_email}).skip(skip).limit(limit).sort("created_at", -1)
-    problems = await cursor.to_list(length=limit)
+    query = keyset_filter({"created_by": user_email}, "created_at", cursor)
+    db_cursor = db.problems.find(query).sort(keyset_sort("created_at"))
+    if not cursor:
+        db_cursor = db_cursor.skip(skip)
+    problems = await db_cursor.limit(limit).to_list(length=limit)
     
     for problem in problems:
         problem["_id"] = str(problem["_id"])
@@ -78,6 +121,28 @@ async def get_problems_by_user(user_email: str, skip: int = 0, limit: int = 100)
     return problems
 
 
+async def count_problems(created_by: Optional[str] = None) -> int:
+    """
+    Total number of problems (optionally for one creator), cached briefly.
+    """
+    query = {"created_by": created_by} if created_by else {}
+    return await cached_count(db.problems, query)
+
+
+async def get_catalog_state() -> Tuple[int, Optional[datetime]]:
+    """
+    (problem count, latest updated_at): changes whenever a problem is created,
+    updated or deleted, so it validates any page of the catalog without
+    reading the page. The count is the collection metadata count, read on
+    every call: the per-worker cached count would keep a delete in another
+    worker unseen until its TTL.
+    """
+    latest = await db.problems.find_one(
+        {}, {"updated_at": 1, "_id": 0}, sort=[("updated_at", DESCENDING)]
+    )
+    return await db.problems.estimated_document_count(), latest.get("updated_at") if latest else None
+
+
 async def update_problem(
     problem_id: str,
     title: Optional[str] = None,
@@ -127,6 +192,7 @@ async def update_problem(
         {"_id": ObjectId(problem_id)},
         {"$set": update_data}
     )
+    problem_cache.invalidate(problem_id)
 
     if result.modified_count == 0:
         return None
@@ -151,22 +217,129 @@ async def delete_problem(problem_id: str, user_email: str) -> bool:
         return False
 
     result = await db.problems.delete_one({"_id": ObjectId(problem_id)})
+    problem_cache.invalidate(problem_id)
     return result.deleted_count > 0
 
 
-async def search_problems(query: str, skip: int = 0, limit: int = 100) -> List[dict]:
+async def watch_problem_changes() -> None:
+    """
+    Invalidate cached problems on any update/replace/delete seen on the
+    problems change stream, keeping every worker's cache coherent.
+    The stream is reopened with exponential backoff after an error (the
+    cache is cleared then, since changes may have been missed meanwhile).
+    Change streams need a replica set; without one this logs and returns,
+    leaving the TTL as the only cross-worker bound on staleness.
     """
-    Search problems by title or description.
+    pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+    backoff = WATCHER_BACKOFF_INITIAL
+    while True:
+        try:
+            async with db.problems.watch(pipeline) as stream:
+                backoff = WATCHER_BACKOFF_INITIAL
+                async for change in stream:
+                    problem_cache.invalidate(str(change["documentKey"]["_id"]))
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if e.code == NOT_A_REPLICA_SET:
+                print(f"WARNING: problem cache change stream unavailable: {e}")
+                return
+            print(f"WARNING: problem cache change stream failed, retrying in {backoff:.0f}s: {e}")
+        except PyMongoError as e:
+            print(f"WARNING: problem cache change stream failed, retrying in {backoff:.0f}s: {e}")
+        problem_cache.clear()
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, WATCHER_BACKOFF_MAX)
+
+
+def start_problem_cache_watcher() -> Optional[asyncio.Task]:
+    """Start the change stream watcher if PROBLEM_CACHE_CHANGE_STREAM is enabled"""
+    if not PROBLEM_CACHE_CHANGE_STREAM:
+        return None
+    return asyncio.create_task(watch_problem_changes())
+
+
+def _search_filters(difficulty: Optional[str], categories: Optional[List[str]]) -> dict:
+    filters = {}
+    if difficulty:
+        filters["difficulty"] = difficulty
+    if categories:
+        filters["categories"] = {"$in": categories}
+    return filters
+
+
+async def search_problems(
+    query: str,
+    skip: int = 0,
+    limit: int = 100,
+    difficulty: Optional[str] = None,
+    categories: Optional[List[str]] = None
+) -> List[dict]:
     """
-    search_filter = {
+    Full-text search over title, requirements and description (weighted in
+    that order by the problems text index), most relevant first.
+    Each result carries its relevance as "score".
+    """
+    search_filter = {"$text": {"$search": query}, **_search_filters(difficulty, categories)}
+    relevance = {"score": {"$meta": "textScore"}}
+
+    try:
+        db_cursor = db.problems.find(search_filter, relevance).sort(
+            [("score", {"$meta": "textScore"}), ("created_at", -1)]
+        ).skip(skip).limit(limit)
+        problems = await db_cursor.to_list(length=limit)
+    except OperationFailure as e:
+        # No text index yet (e.g. index bootstrap disabled): degrade to the scan
+        print(f"WARNING: text search unavailable, falling back to regex: {e}")
+        return await search_problems_regex(query, skip, limit, difficulty, categories)
+    
+    for problem in problems:
+        problem["_id"] = str(problem["_id"])
+    
+    return problems
+
+
+async def count_search_results(
+    query: str,
+    difficulty: Optional[str] = None,
+    categories: Optional[List[str]] = None
+) -> int:
+    """
+    Number of problems matching a search, cached briefly.
+    """
+    search_filter = {"$text": {"$search": query}, **_search_filters(difficulty, categories)}
+    try:
+        return await cached_count(db.problems, search_filter)
+    except OperationFailure:
+        # Same fallback as search_problems, so the total matches the rows
+        return await cached_count(db.problems, _regex_filter(query, difficulty, categories))
+
+
+def _regex_filter(query: str, difficulty: Optional[str], categories: Optional[List[str]]) -> dict:
+    pattern = re.escape(query)
+    return {
         "$or": [
-            {"title": {"$regex": query, "$options": "i"}},
-            {"description": {"$regex": query, "$options": "i"}}
-        ]
+            {"title": {"$regex": pattern, "$options": "i"}},
+            {"description": {"$regex": pattern, "$options": "i"}}
+        ],
+        **_search_filters(difficulty, categories)
     }
-    
-    cursor = db.problems.find(search_filter).skip(skip).limit(limit).sort("created_at", -1)
-    problems = await cursor.to_list(length=limit)
+
+
+async def search_problems_regex(
+    query: str,
+    skip: int = 0,
+    limit: int = 100,
+    difficulty: Optional[str] = None,
+    categories: Optional[List[str]] = None
+) -> List[dict]:
+    """
+    Unindexed substring search on title or description, newest first.
+    Kept as a fallback and as the baseline for benchmarks/bench_problem_search.py.
+    """
+    search_filter = _regex_filter(query, difficulty, categories)
+    db_cursor = db.problems.find(search_filter).sort(keyset_sort("created_at")).skip(skip).limit(limit)
+    problems = await db_cursor.to_list(length=limit)
     
     for problem in problems:
         problem["_id"] = str(problem["_id"])
@@ -0,0 +1,71 @@
+"""
+Projection helpers shared by the list endpoints.
+Heavy fields (full diagrams, chat logs) are left out of list queries at the
+database, and `fields=` sparse fieldsets are turned into inclusion projections.
+"""
+from typing import Dict, Optional
+
+
+# Fields that make documents large; summaries never load them.
+# (Session chat now lives in chat_messages; the field remains for unmigrated sessions.)
+SESSION_HEAVY_FIELDS = ("diagram_data", "chat_messages")
+SUBMISSION_HEAVY_FIELDS = ("diagram_data", "chat_messages")
+
+SESSION_SUMMARY_PROJECTION = {field: 0 for field in SESSION_HEAVY_FIELDS}
+SUBMISSION_SUMMARY_PROJECTION = {field: 0 for field in SUBMISSION_HEAVY_FIELDS}
+
+# API field name -> document field name
+SESSION_FIELDS: Dict[str, str] = {
+    "id": "_id",
+    "user_id": "user_id",
+    "problem_id": "problem_id",
+    "diagram_data": "diagram_data",
+    "diagram_hash": "diagram_hash",
+    "time_spent": "time_spent",
+    "status": "status",
+    "chat_messages": "chat_messages",
+    "message_count": "message_count",
+    "last_saved_at": "last_saved_at",
+    "started_at": "started_at",
+    "ended_at": "ended_at",
+    "created_at": "created_at",
+    "updated_at": "updated_at",
+}
+
+PROBLEM_SUBMISSION_FIELDS: Dict[str, str] = {
+    "submission_id": "_id",
+    "session_id": "session_id",
+    "score": "score",
+    "max_score": "max_score",
+    "diagram_data": "diagram_data",
+    "submitted_at": "submitted_at",
+    "time_spent": "time_spent",
+}
+
+
+def parse_fields(fields: Optional[str], allowed: Dict[str, str]) -> Optional[list]:
+    """
+    Parse a comma-separated `fields=` value into a list of API field names.
+
+    Returns None when no sparse fieldset was requested.
+    Raises ValueError naming the first unknown field.
+    """
+    if not fields:
+        return None
+
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    for name in requested:
+        if name not in allowed:
+            raise ValueError(f"Unknown field '{name}'. Allowed: {', '.join(allowed)}")
+    return requested
+
+
+def fields_projection(requested: list, allowed: Dict[str, str]) -> Dict[str, int]:
+    """Inclusion projection for a parsed sparse fieldset (_id is always returned)"""
+    projection = {allowed[name]: 1 for name in requested}
+    projection["_id"] = 1
+    if "diagram_data" in projection:
+        # Needed to load diagrams that live in the content-addressed store
+        projection["diagram_hash"] = 1
+        projection["diagram_stored"] = 1
+    return projection
@@ -1,29 +1,87 @@
 from bson import ObjectId
 from datetime import datetime
-from typing import Optional, Dict, Any, List
-import hashlib
-import json
+from typing import Optional, Dict, Any, List, Tuple
+from pymongo import ReturnDocument, UpdateOne
+import os
 from database import db
+from cache import LRUTTLCache
+from write_behind import WriteBehindBuffer
+from CRUD.pagination import keyset_filter, keyset_sort, with_sort_field, cached_count
+from CRUD.diagram_crud import (
+    DIAGRAM_REF_PROJECTION,
+    calculate_diagram_hash,
+    hash_diagram,
+    holds_reference,
+    retain_diagram,
+    release_diagram,
+    release_diagrams,
+    hydrate_diagram,
+    hydrate_diagrams,
+    attach_diagram_record,
+    get_diagram,
+    diagram_cache
+)
+from diagram_delta import apply_element_delta, reconcile_diagrams
+from diagram_hashing import apply_delta_hash, forget as forget_diagram_hash
+from diagram_offload import run_diagram_op, estimate_diagram_size
+import CRUD.chat_crud as chat_crud
+import CRUD.history_crud as history_crud
 
 sessions_collection = db.get_collection("sessions")
 
-def calculate_diagram_hash(diagram_data: Dict[Any, Any]) -> str:
-    """Calculate hash of diagram data for change detection"""
-    diagram_str = json.dumps(diagram_data, sort_keys=True)
-    return hashlib.md5(diagram_str.encode()).hexdigest()
+# Sessions in these states can still be edited, paused, resumed, submitted or abandoned
+EDITABLE_STATUSES = ["active", "paused"]
+
+# Messages returned inline with a full session; older ones are paged via chat_crud
+CHAT_PREVIEW_SIZE = 50
+
+# What a compact acknowledgement reads back: no diagram, no chat. version is
+# bumped by every autosave and status change.
+SESSION_ACK_PROJECTION = {
+    "user_id": 1,
+    "status": 1,
+    "time_spent": 1,
+    "last_saved_at": 1,
+    "version": 1,
+    **DIAGRAM_REF_PROJECTION
+}
+
+
+class DiagramConflict(Exception):
+    """The session's diagram is no longer the one a change was based on"""
+
+    def __init__(self, current_hash: str):
+        super().__init__(f"Diagram changed (current hash {current_hash})")
+        self.current_hash = current_hash
+
+
+# Optional write-behind autosave: autosaves for a session this worker has
+# already written through are acknowledged from memory and flushed in batches.
+# Pause/submit/abandon and shutdown flush synchronously; other workers may see
+# data up to one flush interval old.
+AUTOSAVE_WRITE_BEHIND = os.getenv("AUTOSAVE_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+AUTOSAVE_FLUSH_INTERVAL_SECONDS = float(os.getenv("AUTOSAVE_FLUSH_INTERVAL_SECONDS", "5"))
+AUTOSAVE_BUFFER_MAX_BYTES = int(os.getenv("AUTOSAVE_BUFFER_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Versioned autosaves that lose the compare-and-swap are merged with the stored
+# diagram and retried this many times before answering with a conflict
+AUTOSAVE_MERGE_ATTEMPTS = int(os.getenv("AUTOSAVE_MERGE_ATTEMPTS", "3"))
 
 async def create_session(user_id: str, problem_id: str) -> Dict[str, Any]:
     """Create a new practice session"""
     now = datetime.utcnow()
+    empty_hash = calculate_diagram_hash({})
+    await retain_diagram(empty_hash, {})
     
     session = {
         "user_id": user_id,
         "problem_id": problem_id,
-        "diagram_data": {},
-        "diagram_hash": calculate_diagram_hash({}),
+        "diagram_hash": empty_hash,
+        "diagram_stored": True,
         "time_spent": 0,
         "status": "active",
-        "chat_messages": [],
+        "message_count": 0,
+        "version": 0,
         "last_saved_at": now,
         "started_at": now,
         "ended_at": None,
@@ -33,17 +91,55 @@ async def create_session(user_id: str, problem_id: str) -> Dict[str, Any]:
     
     result = await sessions_collection.insert_one(session)
     session["_id"] = result.inserted_id
+    session["diagram_data"] = {}
+    session["chat_messages"] = []
+    
+    return session
+
+def _overlay_pending_autosave(session: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Apply this worker's not-yet-flushed autosave so reads see their own writes"""
+    if not session or not AUTOSAVE_WRITE_BEHIND:
+        return session
     
+    pending = autosave_buffer.get(str(session["_id"]))
+    if pending and pending["user_id"] == session.get("user_id") and session.get("status") in EDITABLE_STATUSES:
+        session.update({
+            "time_spent": pending["time_spent"],
+            "last_saved_at": pending["saved_at"],
+            "updated_at": pending["saved_at"],
+            "diagram_hash": pending["diagram_hash"],
+            "diagram_data": pending["diagram_data"],
+            "version": pending["version"]
+        })
     return session
 
-async def get_session_by_id(session_id: str) -> Optional[Dict[str, Any]]:
-    """Get session by ID"""
+async def get_session_by_id(session_id: str, with_diagram: bool = True) -> Optional[Dict[str, Any]]:
+    """Get session by ID (with_diagram=False skips loading the diagram from the store)"""
     if not ObjectId.is_valid(session_id):
         return None
     
-    session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
+    session = _overlay_pending_autosave(await sessions_collection.find_one({"_id": ObjectId(session_id)}))
+    if with_diagram:
+        await hydrate_diagram(session)
     return session
 
+async def get_session_diagram(session_id: str, decode: bool = True) -> Optional[Dict[str, Any]]:
+    """
+    Get only the diagram (plus owner and hash) of a session.
+    decode=False attaches the stored record as diagram_record instead of diagram_data.
+    """
+    if not ObjectId.is_valid(session_id):
+        return None
+    
+    session = await sessions_collection.find_one(
+        {"_id": ObjectId(session_id)},
+        {"user_id": 1, "status": 1, "diagram_data": 1, **DIAGRAM_REF_PROJECTION}
+    )
+    _overlay_pending_autosave(session)
+    if not decode:
+        return await attach_diagram_record(session)
+    return await hydrate_diagram(session)
+
 async def get_active_session_for_problem(user_id: str, problem_id: str) -> Optional[Dict[str, Any]]:
     """Get user's active session for a specific problem"""
     session = await sessions_collection.find_one({
@@ -51,175 +147,659 @@ async def get_active_session_for_problem(user_id: str, problem_id: str) -> Optio
         "problem_id": problem_id,
         "status": {"$in": ["active", "paused"]}
     })
-    return session
+    return await hydrate_diagram(_overlay_pending_autosave(session))
 
-async def get_sessions_by_user(user_id: str, skip: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-    """Get all sessions for a user"""
-    cursor = sessions_collection.find({"user_id": user_id}).sort("created_at", -1).skip(skip).limit(limit)
-    sessions = await cursor.to_list(length=limit)
+async def get_sessions_by_user(
+    user_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    projection: Optional[Dict[str, int]] = None,
+    cursor: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Get all sessions for a user, newest first.
+    Pass a projection to leave heavy fields out, and the previous page's cursor
+    for constant-cost keyset pagination (skip is ignored when a cursor is given).
+    Diagrams are loaded from the store in one batch unless projected out.
+    """
+    query = keyset_filter({"user_id": user_id}, "created_at", cursor)
+    db_cursor = sessions_collection.find(query, with_sort_field(projection, "created_at")).sort(keyset_sort("created_at"))
+    if not cursor:
+        db_cursor = db_cursor.skip(skip)
+    sessions = await db_cursor.limit(limit).to_list(length=limit)
+    if projection is None or projection.get("diagram_data") == 1:
+        await hydrate_diagrams(sessions)
     return sessions
 
+async def count_sessions_by_user(user_id: str) -> int:
+    """Total sessions for a user (cached briefly)"""
+    return await cached_count(sessions_collection, {"user_id": user_id})
+
+def _version_filter(version: int) -> Dict[str, Any]:
+    """Match a session version (sessions created before versioning have none, i.e. 0)"""
+    return {"version": version} if version else {"version": {"$in": [0, None]}}
+
+def _owned_session_filter(session_id: str, user_id: str, statuses: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Filter matching the session only if the user owns it (and it is in an allowed status)"""
+    query: Dict[str, Any] = {"_id": ObjectId(session_id), "user_id": user_id}
+    if statuses is not None:
+        query["status"] = {"$in": statuses}
+    return query
+
+def _progress_update(progress: Dict[str, Any], **extra_set: Any) -> Dict[str, Any]:
+    """$set of a save's progress, with time_spent under $max like heartbeats so it never goes back"""
+    fields = {k: v for k, v in progress.items() if k != "time_spent"}
+    update = {"$set": {**fields, **extra_set}}
+    if "time_spent" in progress:
+        update["$max"] = {"time_spent": progress["time_spent"]}
+    return update
+
+async def _swap_session_diagram(
+    query: Dict[str, Any],
+    progress: Dict[str, Any],
+    new_hash: str,
+    diagram_data: Dict[Any, Any],
+    versions: int = 1,
+    projection: Optional[Dict[str, int]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Point the session matching query at a new diagram. The diagram is stored
+    first so the session never references a missing one, then the reference is
+    swapped and the previous one released. versions is added to the session's
+    version. Returns the pre-image (limited to projection, which must include
+    the diagram reference), or None if nothing matched.
+    """
+    await retain_diagram(new_hash, diagram_data)
+    previous = await sessions_collection.find_one_and_update(
+        query,
+        {
+            **_progress_update(progress, diagram_hash=new_hash, diagram_stored=True),
+            "$unset": {"diagram_data": ""},
+            "$inc": {"version": versions}
+        },
+        projection=projection,
+        return_document=ReturnDocument.BEFORE
+    )
+    if not previous:
+        await release_diagram(new_hash)
+        return None
+    
+    if holds_reference(previous):
+        await release_diagram(previous["diagram_hash"])
+    return previous
+
 async def autosave_session(
     session_id: str, 
     diagram_data: Dict[Any, Any], 
     time_spent: int,
-    user_id: str
+    user_id: str,
+    expected_hash: Optional[str] = None,
+    hashed: Optional[Tuple[str, int]] = None,
+    full: bool = True,
+    expected_version: Optional[int] = None
 ) -> Optional[Dict[str, Any]]:
-    """Auto-save session data (called every 10 seconds)"""
+    """
+    Auto-save session data (called every 10 seconds).
+    With expected_hash the save only applies if the session's diagram still has
+    that hash; otherwise DiagramConflict is raised. hashed passes an already
+    computed (hash, size) of diagram_data. full=False returns only the
+    SESSION_ACK_PROJECTION fields, without the diagram.
+    
+    With expected_version (the version of the client's last acknowledgement)
+    a changed diagram is written with a compare-and-swap on the version. If
+    another tab saved in between, the two diagrams are reconciled per element
+    and the merge is saved instead; the result then carries merged=True.
+    """
     if not ObjectId.is_valid(session_id):
         return None
     
-    # Get current session to verify ownership
-    session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    if not session or session["user_id"] != user_id:
-        return None
+    now = datetime.utcnow()
+    # Memoized per session, so the next element delta hashes only what it changes
+    new_hash, diagram_size = hashed or await run_diagram_op(
+        "hash", estimate_diagram_size(diagram_data), hash_diagram, diagram_data, session_id
+    )
+    progress = {
+        "time_spent": time_spent,
+        "last_saved_at": now,
+        "updated_at": now
+    }
     
-    # Calculate new hash
-    new_hash = calculate_diagram_hash(diagram_data)
-    old_hash = session.get("diagram_hash", "")
+    if AUTOSAVE_WRITE_BEHIND:
+        buffered = _buffer_autosave(
+            session_id, user_id, diagram_data, new_hash, diagram_size, progress,
+            expected_hash, full, expected_version
+        )
+        if buffered:
+            return buffered
+        if expected_version is not None:
+            # The compare-and-swap must see this worker's acknowledged saves
+            await flush_session_autosave(session_id)
     
-    # Only update if diagram actually changed
-    if new_hash != old_hash:
-        update_data = {
-            "diagram_data": diagram_data,
-            "diagram_hash": new_hash,
-            "time_spent": time_spent,
-            "last_saved_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }
+    owned = _owned_session_filter(session_id, user_id, EDITABLE_STATUSES)
+    swap_filter = {**owned, "diagram_hash": expected_hash} if expected_hash else owned
+    if expected_version is not None:
+        swap_filter = {**swap_filter, **_version_filter(expected_version)}
+    projection = None if full else SESSION_ACK_PROJECTION
+    
+    # Unchanged diagram: one round trip, no diagram write at all
+    updated_session = await sessions_collection.find_one_and_update(
+        {**owned, "diagram_hash": new_hash, "diagram_stored": True},
+        {**_progress_update(progress), "$inc": {"version": 1}},
+        projection=projection,
+        return_document=ReturnDocument.AFTER
+    )
+    if updated_session:
+        _remember_editable(updated_session)
+        if full:
+            updated_session["diagram_data"] = diagram_data
+        return updated_session
+    
+    # Changed diagram
+    previous = await _swap_session_diagram(
+        swap_filter, progress, new_hash, diagram_data, projection=projection
+    )
+    merged = False
+    if not previous and expected_version is not None and not expected_hash:
+        previous, new_hash, diagram_data = await _merge_concurrent_autosave(
+            session_id, owned, progress, diagram_data, projection, expected_version
+        )
+        merged = True
+    if not previous:
+        if expected_hash:
+            # Failure path only: tell a hash conflict apart from a missing session
+            current = await sessions_collection.find_one(owned, {"diagram_hash": 1})
+            if current:
+                raise DiagramConflict(current.get("diagram_hash", ""))
+        return None
+    
+    # The update is deterministic, so the post-image is the pre-image plus it
+    previous_hash = previous.get("diagram_hash")
+    previous.update(progress, time_spent=max(previous.get("time_spent", 0), time_spent))
+    previous.update({
+        "diagram_hash": new_hash,
+        "diagram_stored": True,
+        "version": previous.get("version", 0) + 1
+    })
+    _remember_editable(previous)
+    await history_crud.record_change(
+        session_id, user_id, previous["version"], previous_hash, new_hash, diagram_data
+    )
+    if full:
+        previous["diagram_data"] = diagram_data
+    if merged:
+        previous["merged"] = True
+    return previous
+
+async def _merge_concurrent_autosave(
+    session_id: str,
+    owned: Dict[str, Any],
+    progress: Dict[str, Any],
+    incoming: Dict[str, Any],
+    projection: Optional[Dict[str, int]],
+    base_version: int
+) -> Tuple[Optional[Dict[str, Any]], str, Dict[str, Any]]:
+    """
+    Reconcile incoming with the session's current diagram and swap the merge
+    in, with a compare-and-swap on the version just read. The diagram of
+    base_version (the client's base, rebuilt from the history) tells deleted
+    elements from added ones; without history the merge keeps both.
+    Returns (pre-image, merged hash, merged diagram); the pre-image is None
+    if the session is gone. Raises DiagramConflict if every attempt raced
+    with yet another save.
+    """
+    # A buffered save of the other tab must be part of what we merge with
+    await flush_session_autosave(session_id)
+    rebuilt = await history_crud.get_diagram_at(session_id, base_version)
+    base = rebuilt[1] if rebuilt else None
+    current_hash = ""
+    for _ in range(AUTOSAVE_MERGE_ATTEMPTS):
+        current = await sessions_collection.find_one(owned, {"version": 1, "diagram_data": 1, **DIAGRAM_REF_PROJECTION})
+        if not current:
+            return None, "", incoming
+        current_hash = current.get("diagram_hash", "")
+        if holds_reference(current):
+            current_diagram = await get_diagram(current_hash) or {}
+        else:
+            current_diagram = current.get("diagram_data") or {}
         
-        await sessions_collection.update_one(
-            {"_id": ObjectId(session_id)},
-            {"$set": update_data}
+        size = estimate_diagram_size(incoming)
+        merged = await run_diagram_op("merge", size, reconcile_diagrams, current_diagram, incoming, base)
+        merged_hash, _ = await run_diagram_op("hash", size, hash_diagram, merged, session_id)
+        previous = await _swap_session_diagram(
+            {**owned, **_version_filter(current.get("version", 0))},
+            progress, merged_hash, merged, projection=projection
         )
+        if previous:
+            return previous, merged_hash, merged
+    raise DiagramConflict(current_hash)
+
+async def delta_autosave_session(
+    session_id: str,
+    user_id: str,
+    base_hash: str,
+    time_spent: int,
+    upserts: List[Dict[str, Any]],
+    deletes: List[str],
+    app_state: Optional[Dict[str, Any]] = None,
+    files: Optional[Dict[str, Any]] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Auto-save only the elements changed since base_hash.
+    The base diagram comes from this worker's buffer or the diagram cache, the
+    delta is applied and the result saved with a compare-and-set on base_hash.
+    Raises DiagramConflict when the client's base is stale (it must resync with
+    a full autosave) and ValueError for a malformed delta. Returns a compact
+    acknowledgement (SESSION_ACK_PROJECTION fields).
+    """
+    if not ObjectId.is_valid(session_id):
+        return None
+    
+    pending = autosave_buffer.get(session_id) if AUTOSAVE_WRITE_BEHIND else None
+    if pending and pending["user_id"] == user_id:
+        current_hash, base = pending["diagram_hash"], pending["diagram_data"]
     else:
-        # Even if diagram didn't change, update time_spent
-        await sessions_collection.update_one(
-            {"_id": ObjectId(session_id)},
-            {"$set": {
-                "time_spent": time_spent,
-                "last_saved_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow()
-            }}
+        session = await sessions_collection.find_one(
+            _owned_session_filter(session_id, user_id, EDITABLE_STATUSES),
+            {"diagram_data": 1, **DIAGRAM_REF_PROJECTION}
         )
+        if not session:
+            return None
+        current_hash = session.get("diagram_hash", "")
+        if current_hash != base_hash:
+            raise DiagramConflict(current_hash)
+        if holds_reference(session):
+            base = await get_diagram(current_hash) or {}
+        else:
+            base = session.get("diagram_data") or {}
     
-    # Return updated session
-    updated_session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    return updated_session
+    if current_hash != base_hash:
+        raise DiagramConflict(current_hash)
+    
+    size = estimate_diagram_size(base)
+    diagram_data = await run_diagram_op(
+        "apply_delta", size, apply_element_delta, base, upserts, deletes, app_state, files
+    )
+    # O(changed) on the memoized state, so always inline
+    hashed = (
+        apply_delta_hash(session_id, base_hash, diagram_data, upserts, deletes, files)
+        or await run_diagram_op("hash", size, hash_diagram, diagram_data, session_id)
+    )
+    saved = await autosave_session(
+        session_id, diagram_data, time_spent, user_id,
+        expected_hash=base_hash, hashed=hashed, full=False
+    )
+    if saved:
+        # The client's next delta will be based on this diagram
+        diagram_cache.set(saved["diagram_hash"], diagram_data)
+    return saved
 
-async def pause_session(session_id: str, user_id: str, time_spent: int) -> Optional[Dict[str, Any]]:
-    """Pause a session (user navigates away)"""
+async def restore_session_version(
+    session_id: str,
+    user_id: str,
+    seq: Optional[int] = None,
+    at: Optional[datetime] = None,
+    full: bool = True
+) -> Optional[Dict[str, Any]]:
+    """
+    Make a past version of the session's diagram current again: version seq,
+    or the last one saved at or before at. It is saved like any autosave, so
+    the restore is itself a new version in the history.
+    Returns None if the session or the version does not exist.
+    """
     if not ObjectId.is_valid(session_id):
         return None
     
-    session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    if not session or session["user_id"] != user_id:
+    session = _overlay_pending_autosave(await sessions_collection.find_one(
+        _owned_session_filter(session_id, user_id, EDITABLE_STATUSES),
+        {"user_id": 1, "status": 1, "time_spent": 1}
+    ))
+    if not session:
         return None
+    if seq is None:
+        entry = await history_crud.get_entry_at_time(session_id, at or datetime.utcnow())
+        if not entry:
+            return None
+        seq = entry["seq"]
     
-    await sessions_collection.update_one(
-        {"_id": ObjectId(session_id)},
-        {"$set": {
-            "status": "paused",
-            "time_spent": time_spent,
-            "updated_at": datetime.utcnow()
-        }}
-    )
+    rebuilt = await history_crud.get_diagram_at(session_id, seq)
+    if not rebuilt:
+        return None
+    return await autosave_session(session_id, rebuilt[1], session.get("time_spent", 0), user_id, full=full)
+
+# ---------- Write-behind autosave ----------
+
+# session_id -> last known session fields (no diagram, no chat) for sessions
+# this worker has verified as owned and editable; diagram_hash is the persisted
+# one, version the last acknowledged one. The TTL bounds how long an
+# ownership/status change made elsewhere can go unnoticed before a write-through.
+editable_sessions = LRUTTLCache(
+    "autosave_sessions",
+    maxsize=10000,
+    ttl=max(AUTOSAVE_FLUSH_INTERVAL_SECONDS * 6, 30)
+)
+
+def _remember_editable(session: Dict[str, Any]) -> None:
+    if AUTOSAVE_WRITE_BEHIND:
+        session_id = str(session["_id"])
+        # Merged, so a compact write-through keeps fields a full one read earlier
+        snapshot = dict(editable_sessions.get(session_id) or {})
+        snapshot.update((k, v) for k, v in session.items() if k not in ("diagram_data", "chat_messages"))
+        editable_sessions.set(session_id, snapshot)
+
+def _buffer_autosave(
+    session_id: str,
+    user_id: str,
+    diagram_data: Dict[Any, Any],
+    diagram_hash: str,
+    diagram_size: int,
+    progress: Dict[str, Any],
+    expected_hash: Optional[str] = None,
+    full: bool = True,
+    expected_version: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """Queue an autosave for a known session; None means write through instead"""
+    snapshot = editable_sessions.get(session_id)
+    if not snapshot or snapshot.get("user_id") != user_id:
+        return None
+    if expected_version is not None and snapshot.get("version", 0) != expected_version:
+        return None  # someone else saved since the client's base: merge on write-through
+    if full and "problem_id" not in snapshot:
+        return None  # only compact acks seen so far: read the full document once
     
-    updated_session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    return updated_session
+    # Newest unflushed save (possibly being flushed right now)
+    pending = autosave_buffer.get(session_id)
+    if expected_hash:
+        if pending:
+            # The buffered diagram is the newest one; check against it (no await
+            # between this check and the put, so it is atomic on this worker)
+            if pending["diagram_hash"] != expected_hash:
+                raise DiagramConflict(pending["diagram_hash"])
+        elif snapshot.get("diagram_hash") != expected_hash:
+            return None  # let the write-through compare with the database
+    
+    version = snapshot.get("version", 0) + 1
+    queued = autosave_buffer.get_pending(session_id)
+    entry = {
+        "user_id": user_id,
+        "time_spent": progress["time_spent"],
+        "saved_at": progress["last_saved_at"],
+        "diagram_hash": diagram_hash,
+        "diagram_data": diagram_data,
+        "version": version,
+        # Saves coalesced into this entry; the flush adds them to version
+        # (an entry being flushed counts its own)
+        "saves": (queued["saves"] if queued else 0) + 1
+    }
+    if not autosave_buffer.put(session_id, entry, diagram_size):
+        return None
+    
+    editable_sessions.set(session_id, {**snapshot, "version": version})
+    ack = {**snapshot, **progress, "diagram_hash": diagram_hash, "version": version}
+    if full:
+        ack["diagram_data"] = diagram_data
+    return ack
 
-async def resume_session(session_id: str, user_id: str) -> Optional[Dict[str, Any]]:
-    """Resume a paused session"""
+def _pending_write(session_id: str, entry: Dict[str, Any]):
+    """Filter and $set for one buffered autosave (only applies over an older save)"""
+    query = {
+        **_owned_session_filter(session_id, entry["user_id"], EDITABLE_STATUSES),
+        "last_saved_at": {"$lt": entry["saved_at"]}
+    }
+    progress = {
+        "time_spent": entry["time_spent"],
+        "last_saved_at": entry["saved_at"],
+        "updated_at": entry["saved_at"]
+    }
+    return query, progress
+
+async def _flush_autosaves(pending: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Write buffered autosaves. Sessions whose diagram is unchanged go out in a
+    single bulk_write; changed diagrams (and any bulk op that missed because
+    the stored hash moved) take the reference-swapping path. Every write only
+    applies over an older last_saved_at, so a late flush never overwrites a
+    newer save from another worker or a write-through.
+    """
+    flush_token = ObjectId()
+    bulk_ids = []
+    operations = []
+    swap_ids = []
+    
+    for session_id, entry in pending.items():
+        snapshot = editable_sessions.get(session_id)
+        if snapshot and snapshot.get("diagram_hash") == entry["diagram_hash"]:
+            query, progress = _pending_write(session_id, entry)
+            bulk_ids.append(session_id)
+            operations.append(UpdateOne(
+                {**query, "diagram_hash": entry["diagram_hash"], "diagram_stored": True},
+                {**_progress_update(progress, flush_token=flush_token), "$inc": {"version": entry["saves"]}}
+            ))
+        else:
+            swap_ids.append(session_id)
+    
+    applied = set()
+    if operations:
+        result = await sessions_collection.bulk_write(operations, ordered=False)
+        if result.matched_count == len(operations):
+            applied.update(bulk_ids)
+        else:
+            # Find out exactly which ops landed (they carry this flush's token)
+            landed = await sessions_collection.find(
+                {"_id": {"$in": [ObjectId(i) for i in bulk_ids]}, "flush_token": flush_token},
+                {"_id": 1}
+            ).to_list(length=None)
+            applied.update(str(doc["_id"]) for doc in landed)
+            swap_ids.extend(i for i in bulk_ids if i not in applied)
+    
+    for session_id in swap_ids:
+        entry = pending[session_id]
+        query, progress = _pending_write(session_id, entry)
+        previous = await _swap_session_diagram(
+            query, progress, entry["diagram_hash"], entry["diagram_data"],
+            versions=entry["saves"], projection={"version": 1, **DIAGRAM_REF_PROJECTION}
+        )
+        if previous:
+            applied.add(session_id)
+            await history_crud.record_change(
+                session_id, entry["user_id"], previous.get("version", 0) + entry["saves"],
+                previous.get("diagram_hash"), entry["diagram_hash"], entry["diagram_data"]
+            )
+    
+    for session_id, entry in pending.items():
+        snapshot = editable_sessions.get(session_id)
+        if session_id not in applied:
+            # Stale or no longer editable: make the next autosave re-verify
+            editable_sessions.invalidate(session_id)
+        elif snapshot:
+            editable_sessions.set(session_id, {**snapshot, "diagram_hash": entry["diagram_hash"]})
+    return len(applied)
+
+autosave_buffer = WriteBehindBuffer(
+    "autosave",
+    flush_fn=_flush_autosaves,
+    flush_interval=AUTOSAVE_FLUSH_INTERVAL_SECONDS,
+    max_bytes=AUTOSAVE_BUFFER_MAX_BYTES
+)
+
+async def flush_session_autosave(session_id: str) -> None:
+    """Persist any buffered autosave of a session before it changes state"""
+    if AUTOSAVE_WRITE_BEHIND:
+        await autosave_buffer.flush_key(session_id)
+        editable_sessions.invalidate(session_id)
+
+def start_autosave_buffer() -> None:
+    if AUTOSAVE_WRITE_BEHIND:
+        autosave_buffer.start()
+
+async def stop_autosave_buffer() -> None:
+    if AUTOSAVE_WRITE_BEHIND:
+        await autosave_buffer.stop()
+
+async def pause_session(
+    session_id: str,
+    user_id: str,
+    time_spent: int,
+    full: bool = True
+) -> Optional[Dict[str, Any]]:
+    """Pause a session (user navigates away). full=False returns a compact acknowledgement."""
     if not ObjectId.is_valid(session_id):
         return None
     
-    session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    if not session or session["user_id"] != user_id:
+    await flush_session_autosave(session_id)
+    updated_session = await sessions_collection.find_one_and_update(
+        _owned_session_filter(session_id, user_id, EDITABLE_STATUSES),
+        {
+            "$set": {
+                "status": "paused",
+                "updated_at": datetime.utcnow()
+            },
+            "$max": {"time_spent": time_spent},
+            "$inc": {"version": 1}
+        },
+        projection=None if full else SESSION_ACK_PROJECTION,
+        return_document=ReturnDocument.AFTER
+    )
+    if not full:
+        return updated_session
+    return await hydrate_diagram(updated_session)
+
+async def resume_session(session_id: str, user_id: str, full: bool = True) -> Optional[Dict[str, Any]]:
+    """Resume a paused session. full=False returns a compact acknowledgement."""
+    if not ObjectId.is_valid(session_id):
         return None
     
-    await sessions_collection.update_one(
-        {"_id": ObjectId(session_id)},
-        {"$set": {
-            "status": "active",
-            "updated_at": datetime.utcnow()
-        }}
+    updated_session = await sessions_collection.find_one_and_update(
+        _owned_session_filter(session_id, user_id, EDITABLE_STATUSES),
+        {
+            "$set": {
+                "status": "active",
+                "updated_at": datetime.utcnow()
+            },
+            "$inc": {"version": 1}
+        },
+        projection=None if full else SESSION_ACK_PROJECTION,
+        return_document=ReturnDocument.AFTER
     )
+    if not full:
+        return updated_session
+    return await hydrate_diagram(updated_session)
+
+async def record_heartbeat(session_id: str, user_id: str, time_spent: int) -> Optional[Dict[str, Any]]:
+    """
+    Advance only time_spent (live channel heartbeat). Saves and pauses also
+    write it with $max, so it stays monotonic when they race; no diagram is
+    read or written.
+    """
+    if not ObjectId.is_valid(session_id):
+        return None
     
-    updated_session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    return updated_session
+    return await sessions_collection.find_one_and_update(
+        _owned_session_filter(session_id, user_id, EDITABLE_STATUSES),
+        {"$max": {"time_spent": time_spent}, "$set": {"updated_at": datetime.utcnow()}},
+        projection={"time_spent": 1, "status": 1},
+        return_document=ReturnDocument.AFTER
+    )
 
 async def add_chat_message_to_session(
     session_id: str,
     user_id: str,
     role: str,
-    content: str
+    content: str,
+    diagram_hash: Optional[str] = None,
+    with_diagram: bool = True
 ) -> Optional[Dict[str, Any]]:
-    """Add a chat message to session"""
+    """
+    Add a chat message to session.
+    The message goes to the chat collection; the session only gets its
+    message_count bumped. When diagram_hash is given it is stored on the
+    message (used to find cached check feedback).
+    """
     if not ObjectId.is_valid(session_id):
         return None
     
-    session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    if not session or session["user_id"] != user_id:
-        return None
-    
-    message = {
-        "role": role,
-        "content": content,
-        "timestamp": datetime.utcnow()
-    }
-    
-    await sessions_collection.update_one(
-        {"_id": ObjectId(session_id)},
+    # Count only a message that was stored; the owner-filtered bump is also
+    # the ownership check, so the message is taken back when it matches nothing
+    message = await chat_crud.insert_message(chat_crud.build_message(
+        session_id, user_id, role, content, diagram_hash=diagram_hash
+    ))
+    updated_session = await sessions_collection.find_one_and_update(
+        _owned_session_filter(session_id, user_id),
         {
-            "$push": {"chat_messages": message},
+            "$inc": {"message_count": 1},
             "$set": {"updated_at": datetime.utcnow()}
-        }
+        },
+        return_document=ReturnDocument.AFTER
     )
+    if not updated_session:
+        await chat_crud.delete_message(message["_id"])
+        return None
     
-    updated_session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
+    if with_diagram:
+        await hydrate_diagram(updated_session)
     return updated_session
 
+async def attach_recent_messages(
+    session: Optional[Dict[str, Any]],
+    limit: int = CHAT_PREVIEW_SIZE
+) -> Optional[Dict[str, Any]]:
+    """
+    Set session["chat_messages"] to its latest messages in chronological order.
+    Messages still embedded in a not-yet-migrated session come first.
+    """
+    if not session:
+        return session
+    
+    recent = await chat_crud.get_recent_messages(str(session["_id"]), limit)
+    embedded = session.get("chat_messages") or []
+    session["chat_messages"] = (embedded + recent)[-limit:]
+    return session
+
 async def mark_session_submitted(session_id: str, user_id: str) -> Optional[Dict[str, Any]]:
     """Mark session as submitted (when converting to submission)"""
     if not ObjectId.is_valid(session_id):
         return None
     
-    session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    if not session or session["user_id"] != user_id:
-        return None
-    
-    await sessions_collection.update_one(
-        {"_id": ObjectId(session_id)},
-        {"$set": {
-            "status": "submitted",
-            "ended_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }}
+    await flush_session_autosave(session_id)
+    forget_diagram_hash(session_id)
+    history_crud.forget(session_id)
+    now = datetime.utcnow()
+    updated_session = await sessions_collection.find_one_and_update(
+        _owned_session_filter(session_id, user_id, EDITABLE_STATUSES),
+        {
+            "$set": {
+                "status": "submitted",
+                "ended_at": now,
+                "updated_at": now
+            },
+            "$inc": {"version": 1}
+        },
+        return_document=ReturnDocument.AFTER
     )
-    
-    updated_session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    return updated_session
+    return await hydrate_diagram(updated_session)
 
 async def abandon_session(session_id: str, user_id: str) -> bool:
     """Abandon/delete a session"""
     if not ObjectId.is_valid(session_id):
         return False
     
-    session = await sessions_collection.find_one({"_id": ObjectId(session_id)})
-    if not session or session["user_id"] != user_id:
-        return False
-    
+    await flush_session_autosave(session_id)
+    forget_diagram_hash(session_id)
+    history_crud.forget(session_id)
     # Mark as abandoned instead of deleting (for analytics)
-    await sessions_collection.update_one(
-        {"_id": ObjectId(session_id)},
-        {"$set": {
-            "status": "abandoned",
-            "ended_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow()
-        }}
+    now = datetime.utcnow()
+    result = await sessions_collection.update_one(
+        _owned_session_filter(session_id, user_id, EDITABLE_STATUSES),
+        {
+            "$set": {
+                "status": "abandoned",
+                "ended_at": now,
+                "updated_at": now
+            },
+            "$inc": {"version": 1}
+        }
     )
     
-    return True
+    return result.matched_count > 0
 
 async def cleanup_old_sessions(days: int = 7) -> int:
     """Clean up abandoned sessions older than X days"""
@@ -228,9 +808,15 @@ async def cleanup_old_sessions(days: int = 7) -> int:
     from datetime import timedelta
     cutoff_date = cutoff_date - timedelta(days=days)
     
-    result = await sessions_collection.delete_many({
+    query = {
         "status": "abandoned",
         "updated_at": {"$lt": cutoff_date}
-    })
+    }
+    expired = await sessions_collection.find(query, DIAGRAM_REF_PROJECTION).to_list(length=None)
+    
+    result = await sessions_collection.delete_many({"_id": {"$in": [s["_id"] for s in expired]}})
+    await release_diagrams(s["diagram_hash"] for s in expired if holds_reference(s))
+    await chat_crud.delete_messages(str(s["_id"]) for s in expired)
+    await history_crud.delete_history(str(s["_id"]) for s in expired)
     
     return result.deleted_count
@@ -1,25 +1,61 @@
 from datetime import datetime
 from typing import Optional, List
 from bson import ObjectId
+from pymongo import ReturnDocument
 from database import db
+from CRUD.projections import SUBMISSION_SUMMARY_PROJECTION
+from CRUD.pagination import keyset_filter, keyset_sort, cached_count
+from CRUD.diagram_crud import (
+    DIAGRAM_REF_PROJECTION,
+    hash_diagram_data,
+    holds_reference,
+    retain_diagram,
+    release_diagram,
+    hydrate_diagram,
+    hydrate_diagrams,
+    attach_diagram_record
+)
+
+
+async def _missing_or_unauthorized(submission_id: str) -> Optional[dict]:
+    """
+    Explain why an owner-filtered write matched nothing.
+    Only runs on the failure path, so successful writes stay one round trip.
+    """
+    exists = await db.submissions.find_one({"_id": ObjectId(submission_id)}, {"_id": 1})
+    if not exists:
+        return None
+    return {"error": "Unauthorized"}
 
 
 async def create_submission(
     user_id: str,
     problem_id: str,
     diagram_data: dict,
-    status: str = "in-progress"
+    status: str = "in-progress",
+    time_spent: int = 0,
+    chat_messages: Optional[List[dict]] = None,
+    diagram_hash: Optional[str] = None,
+    session_id: Optional[str] = None
 ) -> Optional[dict]:
     """
     Create a new submission in the database.
+    The diagram goes to the content-addressed store; pass diagram_hash when the
+    caller already knows it (e.g. copying from a session) to skip rehashing.
+    session_id records the session it was made from (see get_session_submission).
     """
+    diagram_hash = diagram_hash or await hash_diagram_data(diagram_data)
+    await retain_diagram(diagram_hash, diagram_data)
+
     submission = {
         "user_id": user_id,
         "problem_id": problem_id,
-        "diagram_data": diagram_data,
+        "session_id": session_id,
+        "diagram_hash": diagram_hash,
+        "diagram_stored": True,
         "score": 0,
         "max_score": 100,
-        "time_spent": 0,
+        "time_spent": time_spent,
         "status": status,
         "feedback": {
             "implemented": [],
@@ -33,19 +69,25 @@ async def create_submission(
             "videos": [],
             "documents": []
         },
-        "chat_messages": [],
+        "chat_messages": chat_messages or [],
         "submitted_at": datetime.utcnow(),
         "updated_at": datetime.utcnow()
     }
 
-    result = await db.submissions.insert_one(submission)
+    try:
+        result = await db.submissions.insert_one(submission)
+    except Exception:
+        # Don't leak the reference taken above
+        await release_diagram(diagram_hash)
+        raise
     submission["_id"] = str(result.inserted_id)
+    submission["diagram_data"] = diagram_data
     return submission
 
 
-async def get_submission_by_id(submission_id: str) -> Optional[dict]:
+async def get_submission_by_id(submission_id: str, with_diagram: bool = True) -> Optional[dict]:
     """
-    Retrieve a submission by its ID.
+    Retrieve a submission by its ID (with_diagram=False skips loading the diagram from the store).
     """
     if not ObjectId.is_valid(submission_id):
         return None
@@ -55,15 +97,47 @@ async def get_submission_by_id(submission_id: str) -> Optional[dict]:
         return None
 
     submission["_id"] = str(submission["_id"])
+    if with_diagram:
+        await hydrate_diagram(submission)
     return submission
 
 
-async def get_submissions_by_user(user_id: str, skip: int = 0, limit: int = 100) -> List[dict]:
+async def get_submission_diagram(submission_id: str, decode: bool = True) -> Optional[dict]:
+    """
+    Retrieve only the diagram (and owner) of a submission.
+    decode=False attaches the stored record as diagram_record instead of diagram_data.
+    """
+    if not ObjectId.is_valid(submission_id):
+        return None
+
+    submission = await db.submissions.find_one(
+        {"_id": ObjectId(submission_id)},
+        {"user_id": 1, "problem_id": 1, "diagram_data": 1, **DIAGRAM_REF_PROJECTION}
+    )
+    if not submission:
+        return None
+
+    submission["_id"] = str(submission["_id"])
+    if not decode:
+        return await attach_diagram_record(submission)
+    return await hydrate_diagram(submission)
+
+
+async def get_submissions_by_user(
+    user_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[dict]:
     """
-    Retrieve all submissions by a specific user.
+    Retrieve all submissions by a specific user (summary fields only), newest first.
+    Pass the previous page's cursor for keyset pagination (skip is then ignored).
     """
-    cursor = db.submissions.find({"user_id": user_id}).skip(skip).limit(limit).sort("submitted_at", -1)
-    submissions = await cursor.to_list(length=limit)
+    query = keyset_filter({"user_id": user_id}, "submitted_at", cursor)
+    db_cursor = db.submissions.find(query, SUBMISSION_SUMMARY_PROJECTION).sort(keyset_sort("submitted_at"))
+    if not cursor:
+        db_cursor = db_cursor.skip(skip)
+    submissions = await db_cursor.limit(limit).to_list(length=limit)
     
     for submission in submissions:
         submission["_id"] = str(submission["_id"])
@@ -71,12 +145,21 @@ async def get_submissions_by_user(user_id: str, skip: int = 0, limit: int = 100)
     return submissions
 
 
-async def get_submissions_by_problem(problem_id: str, skip: int = 0, limit: int = 100) -> List[dict]:
+async def get_submissions_by_problem(
+    problem_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    cursor: Optional[str] = None
+) -> List[dict]:
     """
-    Retrieve all submissions for a specific problem.
+    Retrieve all submissions for a specific problem (summary fields only), newest first.
+    Pass the previous page's cursor for keyset pagination (skip is then ignored).
     """
-    cursor = db.submissions.find({"problem_id": problem_id}).skip(skip).limit(limit).sort("submitted_at", -1)
-    submissions = await cursor.to_list(length=limit)
+    query = keyset_filter({"problem_id": problem_id}, "submitted_at", cursor)
+    db_cursor = db.submissions.find(query, SUBMISSION_SUMMARY_PROJECTION).sort(keyset_sort("submitted_at"))
+    if not cursor:
+        db_cursor = db_cursor.skip(skip)
+    submissions = await db_cursor.limit(limit).to_list(length=limit)
     
     for submission in submissions:
         submission["_id"] = str(submission["_id"])
@@ -84,6 +167,31 @@ async def get_submissions_by_problem(problem_id: str, skip: int = 0, limit: int
     return submissions
 
 
+async def count_submissions_by_user(user_id: str) -> int:
+    """
+    Total submissions by a user (cached briefly).
+    """
+    return await cached_count(db.submissions, {"user_id": user_id})
+
+
+async def get_user_problem_submissions(
+    user_id: str,
+    problem_id: str,
+    projection: Optional[dict] = None
+) -> List[dict]:
+    """
+    Retrieve all of a user's submissions for one problem, most recent first.
+    """
+    cursor = db.submissions.find(
+        {"user_id": user_id, "problem_id": problem_id},
+        projection
+    ).sort(keyset_sort("submitted_at"))
+    submissions = await cursor.to_list(length=None)
+    if projection is None or projection.get("diagram_data") == 1:
+        await hydrate_diagrams(submissions)
+    return submissions
+
+
 async def get_user_submission_for_problem(user_id: str, problem_id: str) -> Optional[dict]:
     """
     Get a specific user's submission for a specific problem.
@@ -97,7 +205,22 @@ async def get_user_submission_for_problem(user_id: str, problem_id: str) -> Opti
         return None
     
     submission["_id"] = str(submission["_id"])
-    return submission
+    return await hydrate_diagram(submission)
+
+
+async def get_session_submission(user_id: str, problem_id: str, session_id: str) -> Optional[dict]:
+    """
+    The latest submission made from a session.
+    """
+    submission = await db.submissions.find_one(
+        {"user_id": user_id, "problem_id": problem_id, "session_id": session_id},
+        sort=keyset_sort("submitted_at")
+    )
+    if not submission:
+        return None
+
+    submission["_id"] = str(submission["_id"])
+    return await hydrate_diagram(submission)
 
 
 async def update_submission(
@@ -115,18 +238,8 @@ async def update_submission(
     if not ObjectId.is_valid(submission_id):
         return None
 
-    # Check if submission exists and user is the owner
-    existing_submission = await db.submissions.find_one({"_id": ObjectId(submission_id)})
-    if not existing_submission:
-        return None
-    
-    if existing_submission.get("user_id") != user_id:
-        return {"error": "Unauthorized"}
-
     update_data = {"updated_at": datetime.utcnow()}
     
-    if diagram_data is not None:
-        update_data["diagram_data"] = diagram_data
     if score is not None:
         update_data["score"] = score
     if time_spent is not None:
@@ -136,16 +249,42 @@ async def update_submission(
     if feedback is not None:
         update_data["feedback"] = feedback
 
-    result = await db.submissions.update_one(
-        {"_id": ObjectId(submission_id)},
-        {"$set": update_data}
+    owned = {"_id": ObjectId(submission_id), "user_id": user_id}
+
+    if diagram_data is None:
+        # Ownership is part of the filter; the post-image comes back in the same call
+        updated_submission = await db.submissions.find_one_and_update(
+            owned,
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
+        )
+        if not updated_submission:
+            return await _missing_or_unauthorized(submission_id)
+
+        updated_submission["_id"] = str(updated_submission["_id"])
+        return await hydrate_diagram(updated_submission)
+
+    # New diagram: store it, swap the reference, release the previous one
+    new_hash = await hash_diagram_data(diagram_data)
+    await retain_diagram(new_hash, diagram_data)
+    update_data.update({"diagram_hash": new_hash, "diagram_stored": True})
+
+    previous = await db.submissions.find_one_and_update(
+        owned,
+        {"$set": update_data, "$unset": {"diagram_data": ""}},
+        return_document=ReturnDocument.BEFORE
     )
+    if not previous:
+        await release_diagram(new_hash)
+        return await _missing_or_unauthorized(submission_id)
 
-    if result.modified_count == 0:
-        return None
+    if holds_reference(previous):
+        await release_diagram(previous["diagram_hash"])
 
-    updated_submission = await get_submission_by_id(submission_id)
-    return updated_submission
+    previous.update(update_data)
+    previous["diagram_data"] = diagram_data
+    previous["_id"] = str(previous["_id"])
+    return previous
 
 
 async def add_chat_message(
@@ -160,33 +299,26 @@ async def add_chat_message(
     if not ObjectId.is_valid(submission_id):
         return None
 
-    # Check if submission exists and user is the owner
-    existing_submission = await db.submissions.find_one({"_id": ObjectId(submission_id)})
-    if not existing_submission:
-        return None
-    
-    if existing_submission.get("user_id") != user_id:
-        return {"error": "Unauthorized"}
-
     message = {
         "role": role,
         "content": content,
         "timestamp": datetime.utcnow()
     }
 
-    result = await db.submissions.update_one(
-        {"_id": ObjectId(submission_id)},
+    updated_submission = await db.submissions.find_one_and_update(
+        {"_id": ObjectId(submission_id), "user_id": user_id},
         {
             "$push": {"chat_messages": message},
             "$set": {"updated_at": datetime.utcnow()}
-        }
+        },
+        return_document=ReturnDocument.AFTER
     )
 
-    if result.modified_count == 0:
-        return None
+    if not updated_submission:
+        return await _missing_or_unauthorized(submission_id)
 
-    updated_submission = await get_submission_by_id(submission_id)
-    return updated_submission
+    updated_submission["_id"] = str(updated_submission["_id"])
+    return await hydrate_diagram(updated_submission)
 
 
 async def delete_submission(submission_id: str, user_id: str) -> bool:
@@ -196,13 +328,13 @@ async def delete_submission(submission_id: str, user_id: str) -> bool:
     if not ObjectId.is_valid(submission_id):
         return False
 
-    # Check if submission exists and user is the owner
-    existing_submission = await db.submissions.find_one({"_id": ObjectId(submission_id)})
-    if not existing_submission:
-        return False
-    
-    if existing_submission.get("user_id") != user_id:
+    deleted = await db.submissions.find_one_and_delete(
+        {"_id": ObjectId(submission_id), "user_id": user_id},
+        projection=DIAGRAM_REF_PROJECTION
+    )
+    if not deleted:
         return False
 
-    result = await db.submissions.delete_one({"_id": ObjectId(submission_id)})
-    return result.deleted_count > 0
+    if holds_reference(deleted):
+        await release_diagram(deleted["diagram_hash"])
+    return True
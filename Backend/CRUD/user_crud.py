@@ -2,6 +2,7 @@ from datetime import datetime
 from typing import Optional
 from passlib.context import CryptContext
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 from database import db
 import bcrypt
 
@@ -44,7 +45,11 @@ async def create_user(first_name: str, last_name: str, email: str, password: str
         "created_at": datetime.utcnow(),
     }
 
-    result = await db.users.insert_one(user)
+    try:
+        result = await db.users.insert_one(user)
+    except DuplicateKeyError:
+        # Concurrent signup with the same email lost the race on email_unique
+        return None
     user["_id"] = str(result.inserted_id)
     user.pop("password_hash", None)
     return user
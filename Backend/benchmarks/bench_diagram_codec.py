@@ -0,0 +1,132 @@
+"""
+Diagram codec benchmark: nested BSON vs. compressed JSON bytes.
+
+Builds a synthetic Excalidraw diagram and measures, per read, the BSON decode
+plus response serialization time and the peak Python memory of each storage
+layout. Runs offline (no MongoDB needed).
+
+Usage (from Backend/):
+    python -m benchmarks.bench_diagram_codec --elements 5000 --runs 20
+"""
+import argparse
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Any, Dict
+
+import bson
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from diagram_codec import ZSTD_AVAILABLE, encode_diagram, decode_diagram
+from http_cache import diagram_response
+
+
+class DiagramEnvelope(BaseModel):
+    session_id: str
+    diagram_hash: str
+    diagram_data: Dict[Any, Any]
+
+
+def synthetic_element(i: int) -> dict:
+    kind = random.choice(["rectangle", "ellipse", "diamond", "arrow", "text"])
+    element = {
+        "id": f"el-{i:06d}",
+        "type": kind,
+        "x": random.uniform(0, 5000),
+        "y": random.uniform(0, 5000),
+        "width": random.uniform(20, 300),
+        "height": random.uniform(20, 200),
+        "angle": 0,
+        "strokeColor": "#1e1e1e",
+        "backgroundColor": "transparent",
+        "fillStyle": "solid",
+        "strokeWidth": 2,
+        "roughness": 1,
+        "opacity": 100,
+        "groupIds": [],
+        "seed": random.randint(1, 2**31),
+        "version": random.randint(1, 50),
+        "versionNonce": random.randint(1, 2**31),
+        "isDeleted": False,
+        "boundElements": [],
+        "updated": 1700000000000 + i,
+        "locked": False,
+    }
+    if kind == "text":
+        element.update({"text": f"Service {i}", "fontSize": 20, "fontFamily": 1, "containerId": None})
+    if kind == "arrow":
+        element["points"] = [[0, 0], [random.uniform(10, 400), random.uniform(10, 400)]]
+    return element
+
+
+def synthetic_diagram(elements: int) -> dict:
+    return {
+        "type": "excalidraw",
+        "version": 2,
+        "elements": [synthetic_element(i) for i in range(elements)],
+        "appState": {"viewBackgroundColor": "#ffffff", "gridSize": None},
+        "files": {},
+    }
+
+
+def nested_read(raw: bytes) -> bytes:
+    """What a read cost before: decode nested BSON, validate, re-serialize"""
+    record = bson.decode(raw)
+    model = DiagramEnvelope(session_id="s", diagram_hash="h", diagram_data=record["data"])
+    return json.dumps(jsonable_encoder(model)).encode()
+
+
+def encoded_read(raw: bytes, accept_encoding: str = "") -> bytes:
+    """Decode the record (one bytes object) and splice it into the response"""
+    record = bson.decode(raw)
+    return diagram_response({"session_id": "s", "diagram_hash": "h"}, record, accept_encoding).body
+
+
+def measure(name: str, fn, runs: int) -> None:
+    fn()
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<24} p50={statistics.median(samples):8.2f} ms  max={max(samples):8.2f} ms  peak={peak / 1024 / 1024:7.2f} MiB")
+
+
+def main(elements: int, runs: int) -> None:
+    random.seed(7)
+    diagram = synthetic_diagram(elements)
+
+    layouts = {"nested": bson.encode({"_id": "h", "data": diagram})}
+    codecs = ["zlib"] + (["zstd"] if ZSTD_AVAILABLE else [])
+    for codec in codecs:
+        layouts[codec] = bson.encode({"_id": "h", **encode_diagram(diagram, codec)})
+
+    print(f"{elements} elements")
+    for name, raw in layouts.items():
+        print(f"  stored size {name:<7} {len(raw) / 1024:10.1f} KiB")
+    print()
+
+    measure("nested read+serialize", lambda: nested_read(layouts["nested"]), runs)
+    for codec in codecs:
+        measure(f"{codec} read+splice", lambda c=codec: encoded_read(layouts[c]), runs)
+    if ZSTD_AVAILABLE:
+        measure("zstd passthrough", lambda: encoded_read(layouts["zstd"], "zstd"), runs)
+    for codec in codecs:
+        measure(f"{codec} decode (agents)", lambda c=codec: decode_diagram(bson.decode(layouts[c])), runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--elements", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    main(args.elements, args.runs)
@@ -0,0 +1,116 @@
+"""
+Diagram diff benchmark: structural diff of two versions of a diagram.
+
+For each diagram size, edits a synthetic diagram the way a user between two
+checks would (relabels some shapes, deletes some, redraws some with new
+element ids, re-points some arrows, adds new shapes), checks that the diff
+reports exactly those edits, and times diff_diagrams with cold graphs (built
+from the two diagrams) and memoized graphs (both versions already checked).
+Runs offline (no MongoDB or OpenAI needed).
+
+Usage (from Backend/):
+    python -m benchmarks.bench_diagram_diff --sizes 10,100,1000,10000 --runs 20
+"""
+import argparse
+import copy
+import itertools
+import random
+
+from benchmarks.bench_diagram_graph import synthetic_diagram, timed
+from diagram_diff import diff_diagrams
+from diagram_graph import diagram_graph
+
+
+def edit(diagram: dict, rate: float) -> tuple:
+    """A copy of diagram with about rate of its shapes and arrows edited, and the expected counts"""
+    after = copy.deepcopy(diagram)
+    elements = after["elements"]
+    by_id = {element["id"]: element for element in elements}
+    labels = {}
+    for element in elements:
+        if element["type"] == "text" and element.get("containerId") in by_id:
+            labels[element["containerId"]] = element
+    labeled = [by_id[shape_id] for shape_id in labels if by_id[shape_id]["type"] != "arrow"]
+    arrows = [element for element in elements if element["type"] == "arrow"]
+    count = max(1, int(len(labeled) * rate))
+    relabel, redraw, remove = (labeled[i::3][:count] for i in range(3))
+    rewire = arrows[:max(1, int(len(arrows) * rate))] if arrows else []
+
+    removed = {shape["id"] for shape in remove} | {labels[shape["id"]]["id"] for shape in remove}
+    for shape in relabel:
+        labels[shape["id"]]["text"] += " v2"
+    redrawn = {}
+    for shape in redraw:
+        # Deleted and drawn again (arrows reconnected): new ids, same label
+        redrawn[shape["id"]] = new_id = shape["id"] + "-redrawn"
+        labels[shape["id"]]["containerId"] = new_id
+        shape["id"] = new_id
+    for arrow in arrows:
+        for binding in ("startBinding", "endBinding"):
+            if (arrow.get(binding) or {}).get("elementId") in redrawn:
+                arrow[binding] = {**arrow[binding], "elementId": redrawn[arrow[binding]["elementId"]]}
+    kept_ids = [shape["id"] for shape in relabel]
+    for arrow in rewire:
+        # Between relabeled shapes, which keep their ids
+        arrow["endBinding"] = {"elementId": kept_ids[0], "focus": 0, "gap": 4}
+        arrow["startBinding"] = {"elementId": kept_ids[-1], "focus": 0, "gap": 4}
+        if kept_ids[0] == kept_ids[-1]:
+            arrow["startArrowhead"] = "arrow"
+    # Arrows bound to a removed shape are left dangling, which counts as rewired too
+    rewired = {id(arrow) for arrow in rewire}
+    for arrow in arrows:
+        for binding in ("startBinding", "endBinding"):
+            if (arrow.get(binding) or {}).get("elementId") in removed:
+                arrow[binding] = None
+                rewired.add(id(arrow))
+    expected = {"relabeled": len(relabel), "removed": len(remove), "added": count, "rewired": len(rewired)}
+    elements[:] = [element for element in elements if element["id"] not in removed]
+    for i in range(count):
+        elements.append({"id": f"new-{i}", "type": "rectangle", "groupIds": [], "boundElements": [], "version": 1})
+    return after, expected
+
+
+def bench(size: int, runs: int, rate: float) -> None:
+    before = synthetic_diagram(size)
+    after, expected = edit(before, rate)
+
+    changes = diff_diagrams(before, after)
+    counts = {
+        "relabeled": len(changes["components"]["relabeled"]),
+        "removed": len(changes["components"]["removed"]),
+        "added": len(changes["components"]["added"]),
+        "rewired": len(changes["connections"]["rewired"]),
+    }
+    # Rewired arrows may happen to join the same ends as before
+    assert counts["rewired"] <= expected["rewired"], (counts, expected)
+    expected["rewired"] = counts["rewired"]
+    assert counts == expected, f"diff reports {counts}, expected {expected}"
+
+    fresh = itertools.count()
+    # Fresh hashes per run: both graphs are built, then diffed
+    cold = timed(
+        lambda: diff_diagrams(before, after, f"bench-cold-{size}-{next(fresh)}", f"bench-cold-{size}-{next(fresh)}"),
+        runs
+    )
+    diagram_graph(before, f"bench-a-{size}")
+    diagram_graph(after, f"bench-b-{size}")
+    memo = timed(lambda: diff_diagrams(before, after, f"bench-a-{size}", f"bench-b-{size}"), runs)
+    build = timed(lambda: (diagram_graph(before), diagram_graph(after)), runs)
+
+    print(f"{size:>6} elements  two graph builds={build:8.2f} ms  diff cold={cold:8.2f} ms  "
+          f"diff memoized={memo:7.2f} ms  ({', '.join(f'{k}={v}' for k, v in counts.items())})")
+
+
+def main(sizes: list, runs: int, rate: float) -> None:
+    random.seed(7)
+    for size in sizes:
+        bench(size, runs, rate)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=0.05, help="Share of shapes and arrows edited")
+    args = parser.parse_args()
+    main([int(s) for s in args.sizes.split(",")], args.runs, args.rate)
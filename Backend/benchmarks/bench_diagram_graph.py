@@ -0,0 +1,247 @@
+"""
+Diagram graph benchmark: four per-agent element walks vs. one memoized DiagramGraph.
+
+For each diagram size, times the extractors as they were before DiagramGraph
+(chat tool, check agent, submit summary, /extract categorization, each
+walking the raw elements), then one graph build plus the four renders, then
+the four renders from a memoized graph (a repeat check/chat/submit of the
+same diagram_hash). The /extract categorization of both paths is compared
+first, and the size of the check/chat/submit prompt text is reported: the
+legacy walks name connections by 8-character id prefixes, the graph by the
+bound-text labels of their endpoints. Runs offline (no MongoDB or OpenAI needed).
+
+Usage (from Backend/):
+    python -m benchmarks.bench_diagram_graph --sizes 10,100,1000,10000 --runs 20
+"""
+import argparse
+import itertools
+import random
+import statistics
+import time
+
+from Agents.submit_agent import extract_diagram_summary
+from Agents.tools.excalidraw_extractor import describe_diagram
+from Agents.tools.token_budget import TOKEN_BUDGETS
+from diagram_graph import diagram_graph
+
+
+def synthetic_diagram(size: int) -> dict:
+    """
+    Shapes (most labeled by bound text, like Excalidraw draws them), free
+    text and arrows bound between random shapes
+    """
+    elements = []
+    shape_ids = []
+    while len(elements) < size:
+        i = len(elements)
+        roll = random.random()
+        element = {
+            "id": f"el-{i:06d}-{random.getrandbits(32):08x}",
+            "groupIds": [f"group-{i // 8:05d}"] if roll < 0.2 else [],
+            "boundElements": [],
+            "version": 1,
+        }
+        elements.append(element)
+        if roll < 0.3 and len(shape_ids) >= 2:
+            start, end = random.sample(shape_ids, 2)
+            element.update({
+                "type": "arrow",
+                "startBinding": {"elementId": start, "focus": 0, "gap": 4},
+                "endBinding": {"elementId": end, "focus": 0, "gap": 4},
+            })
+        elif roll < 0.4:
+            element.update({"type": "text", "text": f"note {i}"})
+        else:
+            element.update({"type": random.choice(["rectangle", "ellipse", "diamond"])})
+            shape_ids.append(element["id"])
+            if roll < 0.9:
+                label_id = f"label-{i:06d}"
+                element["boundElements"].append({"id": label_id, "type": "text"})
+                elements.append({
+                    "id": label_id, "type": "text", "text": f"Service {i}", "containerId": element["id"],
+                    "groupIds": element["groupIds"], "boundElements": [], "version": 1,
+                })
+    return {"type": "excalidraw", "elements": elements[:size], "appState": {}, "files": {}}
+
+
+# ---------- The extractors before DiagramGraph ----------
+
+def legacy_tool(diagram_data: dict, include_groups: bool = True) -> str:
+    elements = diagram_data.get("elements", [])
+    components, arrows, text_elements = [], [], []
+    for elem in elements:
+        if not isinstance(elem, dict):
+            continue
+        component = {
+            "id": elem.get("id", "unknown"),
+            "type": elem.get("type", "unknown"),
+            "text": elem.get("text", ""),
+            "groupIds": elem.get("groupIds", []),
+            "boundElements": elem.get("boundElements", []),
+        }
+        if elem.get("type") == "arrow":
+            component["startBinding"] = elem.get("startBinding", {})
+            component["endBinding"] = elem.get("endBinding", {})
+            arrows.append(component)
+        elif elem.get("type") == "text":
+            text_elements.append(component)
+        else:
+            components.append(component)
+
+    output_lines = [
+        "=== DIAGRAM SUMMARY ===",
+        f"Total Elements: {len(elements)}",
+        f"Components: {len(components)}",
+        f"Arrows/Connections: {len(arrows)}",
+        f"Text Labels: {len(text_elements)}",
+        "",
+    ]
+    if components:
+        output_lines.append("=== COMPONENTS ===")
+        for idx, comp in enumerate(components, 1):
+            output_lines.append(f"{idx}. {comp['type'].upper()} (ID: {comp['id'][:8]}...)")
+            if comp['text']:
+                output_lines.append(f"   Label: \"{comp['text']}\"")
+            if comp['boundElements']:
+                output_lines.append(f"   Connected to: {len(comp['boundElements'])} elements")
+            if include_groups and comp['groupIds']:
+                output_lines.append(f"   Part of group: {comp['groupIds'][0][:8]}...")
+            output_lines.append("")
+    if arrows:
+        output_lines.append("=== CONNECTIONS ===")
+        for idx, arrow in enumerate(arrows, 1):
+            start = (arrow.get('startBinding') or {}).get('elementId', 'unknown')
+            end = (arrow.get('endBinding') or {}).get('elementId', 'unknown')
+            output_lines.append(f"{idx}. ARROW (ID: {arrow['id'][:8]}...)")
+            output_lines.append(f"   From: {start[:8]}... → To: {end[:8]}...")
+            if arrow.get('text', ''):
+                output_lines.append(f"   Label: \"{arrow['text']}\"")
+            output_lines.append("")
+    if text_elements:
+        output_lines.append("=== TEXT ANNOTATIONS ===")
+        for idx, text in enumerate(text_elements, 1):
+            output_lines.append(f"{idx}. \"{text.get('text', '')}\"")
+        output_lines.append("")
+    return "\n".join(output_lines)
+
+
+def legacy_submit(diagram_data: dict) -> str:
+    elements = diagram_data.get("elements", [])
+    components, arrows, text_elements = [], [], []
+    for elem in elements:
+        if not isinstance(elem, dict):
+            continue
+        elem_type = elem.get("type", "")
+        elem_id = elem.get("id", "")[:8]
+        elem_text = elem.get("text", "")
+        if elem_type == "arrow":
+            start = elem.get("startBinding", {}).get("elementId", "")[:8]
+            end = elem.get("endBinding", {}).get("elementId", "")[:8]
+            arrows.append(f"Arrow({elem_id}): {start} → {end}" + (f' "{elem_text}"' if elem_text else ''))
+        elif elem_type == "text":
+            text_elements.append(f'Text: "{elem_text}"')
+        else:
+            components.append(f"{elem_type.upper()}({elem_id})" + (f': "{elem_text}"' if elem_text else ''))
+    lines = [
+        "=== DIAGRAM SUMMARY ===",
+        f"Total: {len(elements)} elements",
+        f"Components: {len(components)}",
+        f"Connections: {len(arrows)}",
+        "",
+        "=== COMPONENTS ===" if components else "",
+        *[f"- {c}" for c in components],
+        "",
+        "=== CONNECTIONS ===" if arrows else "",
+        *[f"- {a}" for a in arrows],
+        "",
+        "=== LABELS ===" if text_elements else "",
+        *[f"- {t}" for t in text_elements[:10]]
+    ]
+    return "\n".join(line for line in lines if line)
+
+
+def legacy_extract_route(diagram_data: dict) -> dict:
+    components, arrows, text_elements = [], [], []
+    for elem in diagram_data.get("elements", []):
+        if not isinstance(elem, dict):
+            continue
+        extracted = {
+            "id": elem.get("id", ""),
+            "type": elem.get("type", ""),
+            "text": elem.get("text", ""),
+            "groupIds": elem.get("groupIds", []),
+            "boundElements": elem.get("boundElements", [])
+        }
+        if elem.get("type", "") == "arrow":
+            extracted["startBinding"] = elem.get("startBinding", {})
+            extracted["endBinding"] = elem.get("endBinding", {})
+            arrows.append(extracted)
+        elif elem.get("type", "") == "text":
+            text_elements.append(extracted)
+        else:
+            components.append(extracted)
+    return {"components": components, "arrows": arrows, "text_elements": text_elements}
+
+
+def legacy_all(diagram: dict) -> tuple:
+    return (
+        legacy_tool(diagram),
+        legacy_tool(diagram, include_groups=False),
+        legacy_submit(diagram),
+        legacy_extract_route(diagram),
+    )
+
+
+def graph_all(diagram: dict, diagram_hash=None) -> tuple:
+    return (
+        describe_diagram(diagram, diagram_hash),
+        describe_diagram(diagram, diagram_hash, include_groups=False),
+        extract_diagram_summary(diagram, diagram_hash),
+        diagram_graph(diagram, diagram_hash).as_dicts(),
+    )
+
+
+def timed(fn, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def bench(size: int, runs: int) -> None:
+    diagram = synthetic_diagram(size)
+    legacy_out, graph_out = legacy_all(diagram), graph_all(diagram)
+    assert legacy_out[3] == graph_out[3], "graph categorization differs from the legacy /extract route"
+    legacy_chars = sum(len(prompt) for prompt in legacy_out[:3])
+    graph_chars = sum(len(prompt) for prompt in graph_out[:3])
+
+    legacy = timed(lambda: legacy_all(diagram), runs)
+    # A fresh hash per run: the graph is built once and shared by the four renders
+    fresh = itertools.count()
+    cold = timed(lambda: graph_all(diagram, f"bench-cold-{size}-{next(fresh)}"), runs)
+    graph_all(diagram, f"bench-{size}")
+    memo = timed(lambda: graph_all(diagram, f"bench-{size}"), runs)
+    build = timed(lambda: diagram_graph(diagram), runs)
+
+    print(f"{size:>6} elements  4 legacy walks={legacy:8.2f} ms  graph build={build:7.2f} ms  "
+          f"build+4 renders={cold:8.2f} ms  memoized 4 renders={memo:8.2f} ms")
+    print(f"{'':>6}           prompt text legacy={legacy_chars:,} chars  named topology={graph_chars:,} chars "
+          f"({graph_chars / legacy_chars:.2f}x)")
+
+
+def main(sizes: list, runs: int) -> None:
+    random.seed(7)
+    # Whole prompts on both sides: no token budgets (see bench_prompt_budget)
+    TOKEN_BUDGETS.update(dict.fromkeys(TOKEN_BUDGETS))
+    for size in sizes:
+        bench(size, runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    main([int(s) for s in args.sizes.split(",")], args.runs)
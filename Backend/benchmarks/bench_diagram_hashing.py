@@ -0,0 +1,134 @@
+"""
+Diagram hashing benchmark: whole-diagram MD5 vs. incremental per-element hashing.
+
+For each diagram size, times the legacy hash, a cold hash, a full autosave
+re-hash where 1% of the elements changed (the others reuse their memoized
+digests), an element delta of 10 changes (only those are serialized), and
+the same delta on the diagram with --images embedded images of 2 MB (their
+digests are memoized too). Runs offline (no MongoDB needed).
+
+Usage (from Backend/):
+    python -m benchmarks.bench_diagram_hashing --sizes 100,1000,5000,20000 --runs 10
+"""
+import argparse
+import random
+import statistics
+import time
+
+from diagram_delta import apply_element_delta
+from diagram_hashing import apply_delta_hash, hash_diagram, legacy_diagram_hash
+
+
+def synthetic_element(i: int, version: int = 1) -> dict:
+    return {
+        "id": f"el-{i:06d}",
+        "type": random.choice(["rectangle", "ellipse", "diamond", "arrow", "text"]),
+        "x": random.uniform(0, 5000),
+        "y": random.uniform(0, 5000),
+        "width": random.uniform(20, 300),
+        "height": random.uniform(20, 200),
+        "strokeColor": "#1e1e1e",
+        "backgroundColor": "transparent",
+        "groupIds": [],
+        "boundElements": [],
+        "seed": random.randint(1, 2**31),
+        "version": version,
+        "versionNonce": random.randint(1, 2**31),
+        "isDeleted": False,
+    }
+
+
+def synthetic_diagram(elements: int, images: int = 0) -> dict:
+    return {
+        "type": "excalidraw",
+        "version": 2,
+        "elements": [synthetic_element(i) for i in range(elements)],
+        "appState": {"viewBackgroundColor": "#ffffff"},
+        "files": {
+            f"file-{i}": {
+                "id": f"file-{i}",
+                "mimeType": "image/png",
+                "dataURL": "data:image/png;base64," + "A" * (2 * 1024 * 1024),
+                "created": 1700000000000 + i,
+            }
+            for i in range(images)
+        },
+    }
+
+
+def changed(diagram: dict, count: int) -> list:
+    """count bumped copies of random existing elements"""
+    picked = random.sample(range(len(diagram["elements"])), min(count, len(diagram["elements"])))
+    return [synthetic_element(i, version=2 + random.randint(0, 1000)) for i in picked]
+
+
+def timed(fn, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def bench(size: int, runs: int, images: int) -> None:
+    diagram = synthetic_diagram(size)
+
+    legacy = timed(lambda: legacy_diagram_hash(diagram), runs)
+    cold = timed(lambda: hash_diagram(diagram), runs)
+
+    # Full autosave with 1% of the elements bumped, memoized on the previous save
+    upserts = changed(diagram, max(1, size // 100))
+    edited = apply_element_delta(diagram, upserts)
+
+    def memoized():
+        hash_diagram(diagram, memo_key="bench")
+        started = time.perf_counter()
+        hash_diagram(edited, memo_key="bench")
+        return time.perf_counter() - started
+
+    memo = statistics.median(memoized() * 1000 for _ in range(runs))
+
+    # Element delta of 10 changes
+    delta_upserts = changed(diagram, 10)
+    delta_diagram = apply_element_delta(diagram, delta_upserts)
+
+    def delta():
+        base_hash, _ = hash_diagram(diagram, memo_key="bench")
+        started = time.perf_counter()
+        apply_delta_hash("bench", base_hash, delta_diagram, delta_upserts, [])
+        return time.perf_counter() - started
+
+    delta_ms = statistics.median(delta() * 1000 for _ in range(runs))
+
+    # The same delta on a diagram with embedded images
+    with_images = synthetic_diagram(0, images)
+    with_images["elements"] = diagram["elements"]
+    images_diagram = apply_element_delta(with_images, delta_upserts)
+
+    def delta_images():
+        base_hash, _ = hash_diagram(with_images, memo_key="bench")
+        started = time.perf_counter()
+        apply_delta_hash("bench", base_hash, images_diagram, delta_upserts, [])
+        return time.perf_counter() - started
+
+    images_ms = statistics.median(delta_images() * 1000 for _ in range(runs))
+
+    print(f"{size:>6} elements  legacy md5={legacy:8.2f} ms  cold={cold:8.2f} ms  "
+          f"1% changed={memo:8.2f} ms  delta(10)={delta_ms:7.3f} ms  "
+          f"delta(10) with {images} images={images_ms:7.3f} ms")
+
+
+def main(sizes: list, runs: int, images: int) -> None:
+    random.seed(7)
+    for size in sizes:
+        bench(size, runs, images)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="100,1000,5000,20000")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--images", type=int, default=10, help="2 MB images for the delta with images")
+    args = parser.parse_args()
+    main([int(s) for s in args.sizes.split(",")], args.runs, args.images)
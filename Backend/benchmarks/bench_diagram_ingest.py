@@ -0,0 +1,107 @@
+"""
+Diagram ingestion benchmark: Pydantic body parameter vs. buffered vs. streaming (ijson).
+
+Builds a synthetic autosave body of --size-mb (elements plus embedded images),
+feeds it to each ingestion path in 64 KiB chunks like an ASGI server would,
+and reports wall time and peak traced memory (tracemalloc) per path. Runs
+offline (no server or MongoDB needed).
+
+Usage (from Backend/):
+    python -m benchmarks.bench_diagram_ingest --size-mb 50 --runs 3
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Any, Dict, Optional
+
+from pydantic import BaseModel
+
+import diagram_ingest
+from benchmarks.bench_diagram_hashing import synthetic_element
+
+
+CHUNK_BYTES = 64 * 1024
+
+
+class AutosaveBody(BaseModel):
+    """Same shape as routes.session_routes.SessionAutosave"""
+    diagram_data: Dict[Any, Any]
+    time_spent: int
+    base_version: Optional[int] = None
+
+
+def synthetic_body(size_mb: float) -> bytes:
+    """About size_mb of JSON: up to half elements (within the element limit), the rest base64 images"""
+    target = int(size_mb * 1024 * 1024)
+    count = max(1, min(target // 2 // 330, diagram_ingest.DIAGRAM_MAX_ELEMENTS))
+    elements = [synthetic_element(i) for i in range(count)]
+    files = {}
+    image_bytes = 512 * 1024
+    for i in range(max(1, (target - count * 330) // (image_bytes * 4 // 3))):
+        payload = base64.b64encode(os.urandom(image_bytes)).decode()
+        files[f"file-{i}"] = {"id": f"file-{i}", "mimeType": "image/png", "dataURL": "data:image/png;base64," + payload}
+    diagram = {"type": "excalidraw", "version": 2, "elements": elements, "appState": {}, "files": files}
+    return json.dumps({"time_spent": 120, "base_version": 7, "diagram_data": diagram}).encode()
+
+
+async def chunks(body: bytes):
+    for start in range(0, len(body), CHUNK_BYTES):
+        yield body[start:start + CHUNK_BYTES]
+        await asyncio.sleep(0)
+
+
+async def pydantic_body(body: bytes) -> Any:
+    """What a Pydantic body parameter costs: whole body, json.loads, validated copy"""
+    raw = b"".join([chunk async for chunk in chunks(body)])
+    return AutosaveBody(**json.loads(raw))
+
+
+async def buffered(body: bytes) -> Any:
+    return await diagram_ingest.parse_buffered(chunks(body))
+
+
+async def streaming(body: bytes) -> Any:
+    return await diagram_ingest.parse_streaming(chunks(body))
+
+
+def measure(parse, body: bytes, runs: int) -> tuple:
+    times, peaks = [], []
+    for _ in range(runs):
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = asyncio.run(parse(body))
+        elapsed = time.perf_counter() - started
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del result
+        times.append(elapsed)
+    return statistics.median(times), max(peaks)
+
+
+def main(size_mb: float, runs: int) -> None:
+    random.seed(7)
+    body = synthetic_body(size_mb)
+    print(f"body: {len(body) / 1024 / 1024:.1f} MiB, chunks of {CHUNK_BYTES // 1024} KiB, "
+          f"ijson backend: {diagram_ingest.ijson.backend if diagram_ingest.IJSON_AVAILABLE else 'not installed'}")
+
+    paths = [("pydantic body", pydantic_body), ("buffered", buffered)]
+    if diagram_ingest.IJSON_AVAILABLE:
+        paths.append(("streaming (ijson)", streaming))
+    for name, parse in paths:
+        elapsed, peak = measure(parse, body, runs)
+        print(f"  {name:<18} {elapsed * 1000:9.1f} ms  peak {peak / 1024 / 1024:8.1f} MiB "
+              f"({peak / len(body):.2f}x body)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--size-mb", type=float, default=50)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    main(args.size_mb, args.runs)
@@ -0,0 +1,103 @@
+"""
+Problem search benchmark: indexed $text search vs. the unanchored $regex scan.
+
+Seeds a throwaway database with synthetic problems, then times both search
+paths for a fixed set of queries.
+
+Usage (from Backend/, needs a reachable MONGO_URL):
+    python -m benchmarks.bench_problem_search --problems 10000 --runs 20
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+# Point the app's db module at a scratch database before it is imported
+os.environ["DATABASE_NAME"] = os.getenv("BENCH_DATABASE_NAME", "system_design_bench")
+
+from database import db, client  # noqa: E402
+from indexes import ensure_indexes  # noqa: E402
+from CRUD.problem_crud import search_problems, search_problems_regex  # noqa: E402
+
+
+TOPICS = [
+    "URL shortener", "chat service", "news feed", "rate limiter", "video streaming",
+    "ride sharing", "payment gateway", "search autocomplete", "notification system",
+    "file storage", "metrics pipeline", "web crawler", "ticket booking", "leaderboard",
+]
+COMPONENTS = [
+    "load balancer", "cache", "message queue", "CDN", "sharded database", "API gateway",
+    "object storage", "search index", "replica set", "websocket gateway", "worker pool",
+]
+QUERIES = ["cache", "rate limiter", "video streaming CDN", "queue", "sharded database", "leaderboard"]
+
+
+def synthetic_problem(i: int) -> dict:
+    topic = random.choice(TOPICS)
+    components = random.sample(COMPONENTS, 4)
+    created_at = datetime.utcnow() - timedelta(minutes=i)
+    return {
+        "title": f"Design a {topic} #{i}",
+        "description": f"Build a {topic} that scales to millions of users. " * 8
+                       + f"Consider {', '.join(components)}.",
+        "difficulty": random.choice(["easy", "medium", "hard"]),
+        "categories": random.sample(["Web Services", "Databases", "Messaging", "Storage"], 2),
+        "estimated_time": "45 mins",
+        "requirements": [f"Use a {c}" for c in components],
+        "constraints": ["99.9% availability"],
+        "hints": [],
+        "created_by": "bench@example.com",
+        "created_at": created_at,
+        "updated_at": created_at,
+    }
+
+
+async def seed(count: int) -> None:
+    await db.problems.delete_many({})
+    batch = [synthetic_problem(i) for i in range(count)]
+    for start in range(0, count, 1000):
+        await db.problems.insert_many(batch[start:start + 1000])
+    await ensure_indexes(db)
+
+
+async def time_path(search, runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        for query in QUERIES:
+            started = time.perf_counter()
+            await search(query, limit=20)
+            samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(name: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{name:<8} p50={statistics.median(samples):8.2f} ms  p95={p95:8.2f} ms  mean={statistics.mean(samples):8.2f} ms")
+
+
+async def main(problems: int, runs: int) -> None:
+    random.seed(7)
+    print(f"Seeding {problems} problems into '{db.name}'...")
+    await seed(problems)
+
+    # Warm both paths once so the comparison isn't dominated by cold caches
+    await time_path(search_problems, 1)
+    await time_path(search_problems_regex, 1)
+
+    report("$text", await time_path(search_problems, runs))
+    report("$regex", await time_path(search_problems_regex, runs))
+
+    await client.drop_database(db.name)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--problems", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.problems, args.runs))
@@ -0,0 +1,68 @@
+"""
+Prompt budget benchmark: fixed character cuts vs. token-budget packing.
+
+For each diagram size, builds the scoring and tips diagram summaries the old
+way (the whole summary cut at 800 / 400 characters) and packed into the
+scoring / tips token budgets, and reports their tokens, how many labeled
+components and connections each carries, whether a line was cut in half,
+and the packing time. Runs offline (no MongoDB or OpenAI needed); tokens are
+estimated when the tiktoken encoding is not available.
+
+Usage (from Backend/):
+    python -m benchmarks.bench_prompt_budget --sizes 10,100,1000,10000 --runs 20
+"""
+import argparse
+import random
+import statistics
+import time
+
+from Agents.submit_agent import extract_diagram_summary
+from Agents.tools.token_budget import TOKEN_BUDGETS, count_tokens, load_token_encoding
+from benchmarks.bench_diagram_graph import synthetic_diagram
+
+
+LEGACY_CUTS = {"scoring": 800, "tips": 400}
+
+
+def carried(summary: str, full_lines: set) -> str:
+    lines = summary.splitlines()
+    components = sum(1 for line in lines if line.startswith("- ") and '": "' not in line and ": \"" in line)
+    connections = sum(1 for line in lines if " -> " in line or " <-> " in line or " -- " in line)
+    cut = "yes" if lines and lines[-1] not in full_lines and not lines[-1].startswith("... ") else "no"
+    return f"{components:>3} components {connections:>3} connections  cut mid-line={cut}"
+
+
+def bench(size: int, runs: int) -> None:
+    diagram = synthetic_diagram(size)
+    budgets = dict(TOKEN_BUDGETS)
+    TOKEN_BUDGETS["scoring"] = None
+    full = extract_diagram_summary(diagram, agent="scoring")
+    TOKEN_BUDGETS.update(budgets)
+    full_lines = set(full.splitlines())
+
+    print(f"{size:>6} elements  whole summary={count_tokens(full):,} tokens")
+    for agent, chars in LEGACY_CUTS.items():
+        legacy = full[:chars]
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            packed = extract_diagram_summary(diagram, agent=agent)
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"  {agent:<8} [:{chars}]  {count_tokens(legacy):>5} tokens  {carried(legacy, full_lines)}")
+        print(f"  {agent:<8} budget {TOKEN_BUDGETS[agent]:<4} {count_tokens(packed):>5} tokens  "
+              f"{carried(packed, full_lines)}  pack={statistics.median(samples):7.2f} ms")
+
+
+def main(sizes: list, runs: int) -> None:
+    random.seed(7)
+    print(f"token counts: {'tiktoken' if load_token_encoding() else 'estimated (tiktoken encoding unavailable)'}")
+    for size in sizes:
+        bench(size, runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    main([int(s) for s in args.sizes.split(",")], args.runs)
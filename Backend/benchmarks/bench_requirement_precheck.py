@@ -0,0 +1,69 @@
+"""
+Requirement pre-check benchmark: cost of the keyword pre-check per diagram size.
+
+Runs precheck_requirements over synthetic diagrams (shapes labeled by bound
+text, some of them with building-block names) against a typical requirement
+list, and reports its latency next to the LLM round trip it can replace,
+plus whether the diagram would short-circuit. Runs offline (no MongoDB or
+OpenAI needed).
+
+Usage (from Backend/):
+    python -m benchmarks.bench_requirement_precheck --sizes 10,100,1000,10000 --runs 20
+"""
+import argparse
+import random
+import statistics
+import time
+
+from Agents.tools.requirement_precheck import precheck_requirements
+from benchmarks.bench_diagram_graph import synthetic_diagram
+
+
+PROBLEM = {
+    "title": "URL Shortener",
+    "requirements": [
+        "Use a load balancer in front of the application servers",
+        "Cache popular short URLs",
+        "Persist URL mappings in a replicated database",
+        "Generate unique IDs for short links",
+        "Record click analytics asynchronously through a message queue",
+        "Handle 10k redirects per second",
+    ],
+}
+LABELS = ["Nginx LB", "Redis", "Postgres read replica", "Snowflake ID generator", "Kafka"]
+
+
+def labeled_diagram(size: int, building_blocks: int) -> dict:
+    """synthetic_diagram with the first building_blocks labels renamed after LABELS"""
+    diagram = synthetic_diagram(size)
+    labels = [elem for elem in diagram["elements"] if elem.get("containerId")]
+    for elem, label in zip(labels, LABELS[:building_blocks]):
+        elem["text"] = label
+    return diagram
+
+
+def bench(size: int, runs: int) -> None:
+    for building_blocks in (1, len(LABELS)):
+        diagram = labeled_diagram(size, building_blocks)
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            precheck = precheck_requirements(PROBLEM, diagram)
+            samples.append((time.perf_counter() - started) * 1000)
+        outcome = f"short-circuit ({precheck.incomplete})" if precheck.conclusive else "LLM with coverage table"
+        print(f"{size:>6} elements  {building_blocks} building block(s) labeled  "
+              f"pre-check={statistics.median(samples):8.2f} ms  coverage={precheck.ratio:4.0%}  -> {outcome}")
+
+
+def main(sizes: list, runs: int) -> None:
+    random.seed(7)
+    for size in sizes:
+        bench(size, runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    main([int(s) for s in args.sizes.split(",")], args.runs)
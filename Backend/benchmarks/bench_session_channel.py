@@ -0,0 +1,125 @@
+"""
+Session channel benchmark: WebSocket frames vs. one HTTP request per save.
+
+Opens --connections sockets (spread round-robin over --session-ids, so
+several tabs share a session and see each other's fan-out) and sends
+--messages heartbeat or delta-autosave frames on each, waiting for every ack.
+With --mode http the same calls go through the REST routes instead.
+Reports connect time, throughput, ack latency and fan-out deliveries.
+
+Usage (from Backend/, against a running server and existing sessions):
+    python -m benchmarks.bench_session_channel --token $TOKEN --session-ids ID1,ID2 \\
+        --connections 50 --messages 200 --kind heartbeat --mode ws
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import requests
+import websockets
+
+
+def frame_for(kind: str, i: int) -> dict:
+    if kind == "heartbeat":
+        return {"type": "heartbeat", "id": i, "time_spent": i}
+    # An empty delta on the latest hash: what an idle autosave tick sends
+    return {"type": "autosave", "id": i, "time_spent": i, "upserts": [], "deletes": []}
+
+
+async def ws_client(url: str, token: str, session_id: str, kind: str, messages: int, stats: dict) -> None:
+    started = time.perf_counter()
+    async with websockets.connect(f"{url}/sessions/{session_id}/ws?token={token}") as ws:
+        stats["connect"].append(time.perf_counter() - started)
+        base_hash = None
+        for i in range(messages):
+            frame = frame_for(kind, i)
+            if kind == "autosave":
+                frame["base_hash"] = base_hash or stats["hashes"][session_id]
+            sent = time.perf_counter()
+            await ws.send(json.dumps(frame))
+            while True:
+                reply = json.loads(await ws.recv())
+                if reply.get("id") == i and reply["type"] in ("ack", "error"):
+                    break
+                stats["fanout"] += 1  # another tab's frame
+            stats["latency"].append(time.perf_counter() - sent)
+            if reply["type"] == "error":
+                stats["errors"] += 1
+            else:
+                base_hash = reply.get("diagram_hash", base_hash)
+
+
+async def http_client(url: str, token: str, session_id: str, kind: str, messages: int, stats: dict) -> None:
+    headers = {"Authorization": f"Bearer {token}"}
+    http = requests.Session()
+    base_hash = stats["hashes"][session_id]
+    for i in range(messages):
+        sent = time.perf_counter()
+        # The REST API has no heartbeat; the page sends an empty delta autosave for both
+        body = {"base_hash": base_hash, "time_spent": i, "upserts": [], "deletes": []}
+        response = await asyncio.to_thread(
+            http.put, f"{url}/sessions/{session_id}/autosave/delta", json=body, headers=headers
+        )
+        stats["latency"].append(time.perf_counter() - sent)
+        if response.status_code != 200:
+            stats["errors"] += 1
+        else:
+            base_hash = response.json().get("diagram_hash", base_hash)
+
+
+def current_hashes(url: str, token: str, session_ids: list) -> dict:
+    headers = {"Authorization": f"Bearer {token}"}
+    hashes = {}
+    for session_id in session_ids:
+        response = requests.get(f"{url}/sessions/{session_id}", headers=headers)
+        response.raise_for_status()
+        hashes[session_id] = response.json().get("diagram_hash")
+    return hashes
+
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def main(args) -> None:
+    session_ids = args.session_ids.split(",")
+    stats = {
+        "connect": [], "latency": [], "fanout": 0, "errors": 0,
+        "hashes": current_hashes(args.url, args.token, session_ids),
+    }
+    client = ws_client if args.mode == "ws" else http_client
+    ws_url = args.url.replace("http", "ws", 1)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        client(ws_url if args.mode == "ws" else args.url, args.token,
+               session_ids[c % len(session_ids)], args.kind, args.messages, stats)
+        for c in range(args.connections)
+    ))
+    elapsed = time.perf_counter() - started
+
+    total = args.connections * args.messages
+    print(f"mode={args.mode} kind={args.kind} connections={args.connections} messages={total}")
+    if stats["connect"]:
+        print(f"  connect    median={statistics.median(stats['connect']) * 1000:8.2f} ms  "
+              f"max={max(stats['connect']) * 1000:8.2f} ms")
+    print(f"  throughput {total / elapsed:10.1f} msg/s  ({elapsed:.2f} s, {stats['errors']} errors)")
+    print(f"  ack        p50={percentile(stats['latency'], 0.5) * 1000:8.2f} ms  "
+          f"p99={percentile(stats['latency'], 0.99) * 1000:8.2f} ms")
+    if args.mode == "ws":
+        print(f"  fan-out    {stats['fanout']} frames delivered to other tabs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True)
+    parser.add_argument("--session-ids", required=True, help="comma-separated, owned by the token's user")
+    parser.add_argument("--connections", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--kind", choices=["heartbeat", "autosave"], default="heartbeat")
+    parser.add_argument("--mode", choices=["ws", "http"], default="ws")
+    asyncio.run(main(parser.parse_args()))
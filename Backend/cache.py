@@ -0,0 +1,77 @@
+"""
+In-process LRU cache with per-entry TTL.
+Each worker keeps its own copy; hits, misses and evictions are exported
+through the metrics registry labelled by cache name. Safe to share with the
+diagram executor threads.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import REGISTRY
+
+
+cache_hits = REGISTRY.counter("cache_hits_total", "In-process cache hits")
+cache_misses = REGISTRY.counter("cache_misses_total", "In-process cache misses (absent or expired)")
+cache_evictions = REGISTRY.counter("cache_evictions_total", "Entries evicted by LRU pressure")
+cache_invalidations = REGISTRY.counter("cache_invalidations_total", "Entries dropped by explicit invalidation")
+
+
+class LRUTTLCache:
+    """Least-recently-used cache whose entries also expire after ttl seconds"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: Optional[float] = 300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._labels = {"cache": name}
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                cache_misses.inc(labels=self._labels)
+                return None
+
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                cache_misses.inc(labels=self._labels)
+                return None
+
+            self._entries.move_to_end(key)
+            cache_hits.inc(labels=self._labels)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                cache_evictions.inc(labels=self._labels)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+        if removed:
+            cache_invalidations.inc(labels=self._labels)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": cache_hits.value(self._labels),
+            "misses": cache_misses.value(self._labels),
+        }
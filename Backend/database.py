@@ -1,34 +1,180 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+import asyncio
 import os
+import threading
+import time
+
+from metrics import REGISTRY
+from indexes import ensure_indexes
 
 
 load_dotenv()
 
 
-####... Production setup...####
-#from contextlib import asynccontextmanager
-# async def startup_db_client(app):
-#     app.mongodb_client = AsyncIOMotorClient(
-#         os.getenv("MONGO_URL"))
-#     app.mongodb = app.mongodb_client.get_database(os.getenv("DATABASE_NAME"))
-#     print("MongoDB connected.")
+# ---------- Connection pool settings ----------
+
+MONGO_URL = os.getenv("MONGO_URL")
+DATABASE_NAME = os.getenv("DATABASE_NAME")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000"))
+# Compression matters for the large diagram_data payloads. pymongo skips (with a
+# warning) any compressor whose module (zstandard / python-snappy) is missing.
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+MONGO_APP_NAME = os.getenv("MONGO_APP_NAME", "systemdesign-io-api")
+
+
+# ---------- Pool metrics ----------
+
+pool_checkout_wait = REGISTRY.histogram(
+    "mongo_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the Motor pool",
+)
+pool_checkout_failures = REGISTRY.counter(
+    "mongo_pool_checkout_failures_total",
+    "Connection checkouts that failed (timeout, pool closed, connection error)",
+)
+pool_connections_open = REGISTRY.gauge(
+    "mongo_pool_connections_open",
+    "Connections currently open in the pool",
+)
+pool_connections_in_use = REGISTRY.gauge(
+    "mongo_pool_connections_in_use",
+    "Connections currently checked out of the pool",
+)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Feeds pymongo connection pool events into the metrics registry"""
+
+    def __init__(self):
+        # Motor runs pymongo on executor threads; checkout start and finish
+        # happen on the same thread so a thread-local is enough to pair them.
+        self._local = threading.local()
+        # (address, connection_id) of the connections checked out; a cleared
+        # pool closes them, so their later check-ins must not count again
+        self._checked_out = set()
+        self._checked_out_lock = threading.Lock()
+
+    def _observe_wait(self, event) -> None:
+        duration = getattr(event, "duration", None)
+        if duration is None:
+            started = getattr(self._local, "started", None)
+            if started is None:
+                return
+            duration = time.perf_counter() - started
+        self._local.started = None
+        pool_checkout_wait.observe(duration)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        self._observe_wait(event)
+        with self._checked_out_lock:
+            self._checked_out.add((event.address, event.connection_id))
+        pool_connections_in_use.inc()
+
+    def connection_check_out_failed(self, event):
+        self._observe_wait(event)
+        pool_checkout_failures.inc(labels={"reason": str(event.reason)})
+
+    def connection_checked_in(self, event):
+        with self._checked_out_lock:
+            if (event.address, event.connection_id) not in self._checked_out:
+                return
+            self._checked_out.discard((event.address, event.connection_id))
+        pool_connections_in_use.dec()
+
+    def connection_created(self, event):
+        pool_connections_open.inc()
+
+    def connection_closed(self, event):
+        pool_connections_open.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        # Connections of the cleared pool are discarded instead of reused
+        with self._checked_out_lock:
+            self._checked_out = {key for key in self._checked_out if key[0] != event.address}
+            in_use = len(self._checked_out)
+        pool_connections_in_use.set(in_use)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+
+def create_client() -> AsyncIOMotorClient:
+    """
+    Build the tuned Motor client.
+    connect=False keeps pymongo from opening sockets or monitor threads at import
+    time, so forking workers (gunicorn --preload, uvicorn --workers) is safe: each
+    worker connects on its own when the lifespan warmup runs.
+    """
+    return AsyncIOMotorClient(
+        MONGO_URL,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        compressors=MONGO_COMPRESSORS,
+        appname=MONGO_APP_NAME,
+        event_listeners=[PoolMetricsListener()],
+        connect=False,
+    )
+
+
+client = create_client()
+db = client.get_database(DATABASE_NAME)
+
+
+def _reset_after_fork() -> None:
+    # A forked child must not report the parent's pool counts as its own
+    REGISTRY.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
 
+# ---------- Lifespan ----------
 
-# async def shutdown_db_client(app):
-#     app.mongodb_client.close()
-#     print("Database disconnected.")
+async def startup_db_client(app) -> None:
+    """Ping MongoDB, pre-fill the pool and ensure indexes before the worker reports ready"""
+    await client.admin.command("ping")
+    # Each concurrent ping needs its own connection, so this opens minPoolSize
+    # sockets up front instead of making the first requests pay for handshakes.
+    if MONGO_MIN_POOL_SIZE > 1:
+        await asyncio.gather(*[
+            client.admin.command("ping") for _ in range(MONGO_MIN_POOL_SIZE)
+        ])
+    await ensure_indexes(db)
+    app.state.mongodb_client = client
+    app.state.mongodb = db
+    app.state.db_ready = True
+    print(f"MongoDB connected (pid={os.getpid()}, minPoolSize={MONGO_MIN_POOL_SIZE}, maxPoolSize={MONGO_MAX_POOL_SIZE}).")
 
 
-# @asynccontextmanager
-# async def lifespan(app):
-#     # Start the database connection
-#     await startup_db_client(app)
-#     yield
-#     # Close the database connection
-#     await shutdown_db_client(app)
+async def shutdown_db_client(app) -> None:
+    app.state.db_ready = False
+    client.close()
+    print("Database disconnected.")
 
-####... Development setup...####
 
-client = AsyncIOMotorClient(os.getenv("MONGO_URL"))
-db = client.get_database(os.getenv("DATABASE_NAME"))
\ No newline at end of file
+@asynccontextmanager
+async def lifespan(app):
+    await startup_db_client(app)
+    yield
+    await shutdown_db_client(app)
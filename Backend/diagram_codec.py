@@ -0,0 +1,97 @@
+"""
+Diagram storage codec.
+Diagrams are kept in the store as compressed canonical JSON bytes (a BSON
+Binary) instead of nested BSON, so reading one costs a single bytes object
+rather than thousands of dicts. The bytes are spliced straight into HTTP
+responses (http_cache.diagram_response); only code that needs structure
+(the agents, diff/merge) decodes.
+"""
+import json
+import os
+import zlib
+from typing import Any, Dict, Optional
+
+from bson.binary import Binary
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+
+# "zstd" | "zlib" | "none" (nested BSON, the pre-codec layout)
+DIAGRAM_CODEC = os.getenv("DIAGRAM_CODEC", "zstd" if ZSTD_AVAILABLE else "zlib")
+DIAGRAM_COMPRESSION_LEVEL = int(os.getenv("DIAGRAM_COMPRESSION_LEVEL", "3"))
+
+if DIAGRAM_CODEC == "zstd" and not ZSTD_AVAILABLE:
+    print("WARNING: DIAGRAM_CODEC=zstd but zstandard is not installed; using zlib")
+    DIAGRAM_CODEC = "zlib"
+
+
+def canonical_json(diagram_data: Dict[Any, Any]) -> bytes:
+    """Compact, key-sorted JSON encoding of a diagram"""
+    return json.dumps(diagram_data, sort_keys=True, separators=(",", ":")).encode()
+
+
+def _compress(codec: str, raw: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=DIAGRAM_COMPRESSION_LEVEL).compress(raw)
+    return zlib.compress(raw, DIAGRAM_COMPRESSION_LEVEL)
+
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Diagram stored with zstd but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return zlib.decompress(blob)
+
+
+def encode_diagram(diagram_data: Dict[Any, Any], codec: Optional[str] = None) -> Dict[str, Any]:
+    """Fields to store for a diagram under the configured (or given) codec"""
+    codec = codec or DIAGRAM_CODEC
+    if codec == "none":
+        return {"data": diagram_data}
+
+    raw = canonical_json(diagram_data)
+    return {
+        "codec": codec,
+        "blob": Binary(_compress(codec, raw)),
+        "raw_size": len(raw),
+    }
+
+
+def is_encoded(record: Optional[Dict[str, Any]]) -> bool:
+    """True if a stored diagram record holds compressed bytes"""
+    return bool(record and record.get("codec") and record.get("blob") is not None)
+
+
+def decode_diagram(record: Optional[Dict[str, Any]]) -> Dict[Any, Any]:
+    """Materialize a stored diagram record (compressed or nested) as a dict"""
+    if not record:
+        return {}
+    if is_encoded(record):
+        return json.loads(_decompress(record["codec"], bytes(record["blob"])))
+    return record.get("data") or {}
+
+
+def diagram_json_bytes(record: Optional[Dict[str, Any]]) -> bytes:
+    """JSON bytes of a stored diagram record, without building Python objects when compressed"""
+    if not record:
+        return b"{}"
+    if is_encoded(record):
+        return _decompress(record["codec"], bytes(record["blob"]))
+    return canonical_json(record.get("data") or {})
+
+
+def zstd_spliced(prefix: bytes, record: Optional[Dict[str, Any]], suffix: bytes) -> Optional[bytes]:
+    """
+    zstd stream of prefix + the diagram's JSON + suffix with the stored zstd
+    blob passed through untouched (concatenated zstd frames decode to the
+    concatenated JSON), or None unless the record is zstd-encoded
+    """
+    if not (ZSTD_AVAILABLE and is_encoded(record) and record["codec"] == "zstd"):
+        return None
+    compressor = zstandard.ZstdCompressor(level=1)
+    return compressor.compress(prefix) + bytes(record["blob"]) + compressor.compress(suffix)
@@ -0,0 +1,188 @@
+"""
+Element-level diagram deltas.
+Excalidraw elements carry a stable `id`, so a change between two saves can be
+described as the elements added or changed (upserts) plus the ids removed
+(deletes), instead of the whole diagram. Two concurrently edited copies of a
+diagram are reconciled per element the same way.
+"""
+from typing import Any, Dict, Iterable, List, Optional
+
+
+def apply_element_delta(
+    diagram: Dict[str, Any],
+    upserts: Iterable[Dict[str, Any]] = (),
+    deletes: Iterable[str] = (),
+    app_state: Optional[Dict[str, Any]] = None,
+    files: Optional[Dict[str, Any]] = None,
+    order: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    New diagram with the delta applied; the input diagram is not modified.
+    Changed elements keep their position (z-order), new ones are appended,
+    unless order (every element id in z-order) is given.
+    Raises ValueError for an upsert without an id.
+    """
+    elements: List[Dict[str, Any]] = list(diagram.get("elements") or [])
+    positions = {element.get("id"): i for i, element in enumerate(elements)}
+
+    for element in upserts:
+        element_id = element.get("id") if isinstance(element, dict) else None
+        if not isinstance(element_id, str) or not element_id:
+            raise ValueError("Every upserted element needs a string id")
+        position = positions.get(element_id)
+        if position is None:
+            positions[element_id] = len(elements)
+            elements.append(element)
+        else:
+            elements[position] = element
+
+    removed = set(deletes)
+    if removed:
+        elements = [element for element in elements if element.get("id") not in removed]
+    if order is not None:
+        by_id = {element.get("id"): element for element in elements}
+        elements = [by_id[element_id] for element_id in order if element_id in by_id]
+
+    result = dict(diagram)
+    result["elements"] = elements
+    if app_state is not None:
+        result["appState"] = app_state
+    if files:
+        result["files"] = {**(diagram.get("files") or {}), **files}
+    return result
+
+
+def _unchanged(before: Dict[str, Any], after: Dict[str, Any]) -> bool:
+    # By content: a client can change an element without bumping its version
+    return before is after or before == after
+
+
+def element_delta(base: Dict[str, Any], diagram: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    The delta that turns base into diagram, for apply_element_delta:
+    {upserts, deletes, app_state, files, order} with unchanged parts left out.
+    Returns None when the change cannot be expressed as one (elements without
+    a unique id, removed files, other top-level keys changed).
+    """
+    if {k: v for k, v in base.items() if k not in ("elements", "appState", "files")} != \
+            {k: v for k, v in diagram.items() if k not in ("elements", "appState", "files")}:
+        return None
+    base_files, files = base.get("files") or {}, diagram.get("files") or {}
+    if any(file_id not in files for file_id in base_files):
+        return None
+
+    base_elements: Dict[str, Dict[str, Any]] = {}
+    for element in base.get("elements") or []:
+        element_id = element.get("id") if isinstance(element, dict) else None
+        if not isinstance(element_id, str) or not element_id or element_id in base_elements:
+            return None
+        base_elements[element_id] = element
+
+    upserts: List[Dict[str, Any]] = []
+    order: List[str] = []
+    for element in diagram.get("elements") or []:
+        element_id = element.get("id") if isinstance(element, dict) else None
+        if not isinstance(element_id, str) or not element_id or element_id in order:
+            return None
+        order.append(element_id)
+        before = base_elements.get(element_id)
+        if before is None or not _unchanged(before, element):
+            upserts.append(element)
+
+    present = set(order)
+    deletes = [element_id for element_id in base_elements if element_id not in present]
+    delta: Dict[str, Any] = {"upserts": upserts, "deletes": deletes}
+
+    # apply_element_delta keeps survivors in place and appends new elements
+    gone = set(deletes)
+    expected = [element_id for element_id in base_elements if element_id not in gone]
+    expected += [element_id for element_id in order if element_id not in base_elements]
+    if expected != order:
+        delta["order"] = order
+    if diagram.get("appState") != base.get("appState") and "appState" in diagram:
+        delta["app_state"] = diagram["appState"]
+    changed_files = {k: v for k, v in files.items() if base_files.get(k) != v}
+    if changed_files:
+        delta["files"] = changed_files
+    return delta
+
+
+def element_changes(base: Dict[str, Any], diagram: Dict[str, Any]) -> Dict[str, List[str]]:
+    """Ids of the elements added, removed and changed from base to diagram (id-less elements are ignored)"""
+    def by_id(d: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+        return {
+            element["id"]: element
+            for element in d.get("elements") or []
+            if isinstance(element, dict) and isinstance(element.get("id"), str)
+        }
+
+    before, after = by_id(base), by_id(diagram)
+    return {
+        "added": [element_id for element_id in after if element_id not in before],
+        "removed": [element_id for element_id in before if element_id not in after],
+        "changed": [
+            element_id for element_id, element in after.items()
+            if element_id in before and not _unchanged(before[element_id], element)
+        ]
+    }
+
+
+def _wins(incoming: Dict[str, Any], current: Dict[str, Any]) -> bool:
+    """Excalidraw's rule: the higher version wins, a tie goes to the lower versionNonce"""
+    incoming_version, current_version = incoming.get("version") or 0, current.get("version") or 0
+    if incoming_version != current_version:
+        return incoming_version > current_version
+    return (incoming.get("versionNonce") or 0) <= (current.get("versionNonce") or 0)
+
+
+def _element_ids(diagram: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    return {
+        element["id"]: element
+        for element in diagram.get("elements") or []
+        if isinstance(element, dict) and element.get("id")
+    }
+
+
+def reconcile_diagrams(
+    current: Dict[str, Any],
+    incoming: Dict[str, Any],
+    base: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Three-way merge of two diagrams edited concurrently from base.
+    Elements present in both are resolved by _wins (isDeleted tombstones
+    included). An element present in only one was either added there (kept)
+    or, when it is in base, deleted by the other side (dropped; Excalidraw
+    scenes carry no tombstones for deleted elements). Without base every
+    one-sided element is kept. The result follows the incoming z-order with
+    elements only in current appended. appState comes from incoming; files
+    are merged by id.
+    """
+    current_elements = _element_ids(current)
+    incoming_ids = _element_ids(incoming)
+    base_ids = _element_ids(base) if base else {}
+    elements: List[Dict[str, Any]] = []
+    seen = set()
+    for element in incoming.get("elements") or []:
+        element_id = element.get("id") if isinstance(element, dict) else None
+        if element_id in seen:
+            continue
+        if element_id:
+            seen.add(element_id)
+        other = current_elements.get(element_id)
+        if other is None:
+            if element_id not in base_ids:
+                elements.append(element)
+        else:
+            elements.append(element if _wins(element, other) else other)
+    elements.extend(
+        element for element_id, element in current_elements.items()
+        if element_id not in incoming_ids and element_id not in base_ids
+    )
+
+    result = {**current, **incoming}
+    result["elements"] = elements
+    files = {**(current.get("files") or {}), **(incoming.get("files") or {})}
+    if files:
+        result["files"] = files
+    return result
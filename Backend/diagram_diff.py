@@ -0,0 +1,175 @@
+"""
+Structural diagram diff.
+Compares two versions of a diagram as graphs rather than as element JSON
+(see diagram_delta.element_changes for that): which components and
+connections were added, removed or relabeled, which connections now join
+other components, and which free text changed.
+
+Components are matched by element id first (Excalidraw ids survive edits),
+the rest by label, so a shape deleted and redrawn with the same label is not
+reported as removed plus added. Connections are matched by arrow id, the
+rest by the components at their ends. Everything is dict lookups over the
+two memoized graphs: O(n) in the elements of both versions.
+"""
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from diagram_graph import DiagramEdge, DiagramElement, DiagramGraph, diagram_graph
+
+
+def _label_key(label: str) -> str:
+    return label.casefold()
+
+
+def _match_components(before: DiagramGraph, after: DiagramGraph) -> Dict[DiagramElement, DiagramElement]:
+    """before component -> the after component it became"""
+    after_components = {comp.id: comp for comp in after.components if comp.id}
+    matched: Dict[DiagramElement, DiagramElement] = {}
+    for comp in before.components:
+        counterpart = after_components.get(comp.id) if comp.id else None
+        if counterpart is not None:
+            matched[comp] = counterpart
+
+    # Label fallback, first come first matched; lists reversed to pop in order
+    taken = {id(comp) for comp in matched.values()}
+    by_label: Dict[str, List[DiagramElement]] = {}
+    for comp in reversed(after.components):
+        if comp.label and id(comp) not in taken:
+            by_label.setdefault(_label_key(comp.label), []).append(comp)
+    for comp in before.components:
+        if comp.label and comp not in matched:
+            candidates = by_label.get(_label_key(comp.label))
+            if candidates:
+                matched[comp] = candidates.pop()
+    return matched
+
+
+def _order(end: Any) -> str:
+    return end.id if isinstance(end, DiagramElement) else repr(end)
+
+
+def _connection_key(arrow: DiagramEdge, ends: Tuple[Any, Any]) -> Tuple[Any, Any, str]:
+    """(from, to, kind) following the arrowheads; undirected ends in a fixed order"""
+    start, end = ends
+    if arrow.start_head and not arrow.end_head:
+        return end, start, "->"
+    if arrow.end_head and not arrow.start_head:
+        return start, end, "->"
+    kind = "<->" if arrow.start_head else "--"
+    return (start, end, kind) if _order(start) <= _order(end) else (end, start, kind)
+
+
+def _ends(graph: DiagramGraph, arrow: DiagramEdge, resolve: Callable[[DiagramElement], Any]) -> Tuple[Any, Any]:
+    """What the arrow's ends are bound to, in terms of the after version (see resolve)"""
+    def end(element_id: str) -> Any:
+        if not element_id:
+            return None
+        record = graph.by_id.get(element_id)
+        return resolve(record) if record is not None else ("missing", element_id)
+    return end(arrow.start_id), end(arrow.end_id)
+
+
+def _component(comp: DiagramElement) -> Dict[str, Any]:
+    return {"id": comp.id, "type": comp.type, "label": comp.name}
+
+
+def diff_graphs(before: DiagramGraph, after: DiagramGraph) -> Dict[str, Any]:
+    """Structural changes from before to after"""
+    matched = _match_components(before, after)
+    counterparts = {id(comp) for comp in matched.values()}
+
+    components = {
+        "added": [_component(comp) for comp in after.components if id(comp) not in counterparts],
+        "removed": [_component(comp) for comp in before.components if comp not in matched],
+        "relabeled": [
+            {"id": new.id, "type": new.type, "before": old.name, "after": new.name}
+            for old, new in matched.items() if old.label != new.label
+        ]
+    }
+
+    # Connections: by arrow id, then by the (matched) elements they join.
+    # A before-version element maps to its counterpart (matched components,
+    # else the element with its id); one without stands for itself, so it
+    # never equals an after-version end.
+    def resolve(record: DiagramElement) -> Any:
+        counterpart = matched.get(record)
+        if counterpart is None and record.id:
+            counterpart = after.by_id.get(record.id)
+        return counterpart if counterpart is not None else record
+
+    def same(record: DiagramElement) -> DiagramElement:
+        return record
+
+    after_arrows = {arrow.id: arrow for arrow in after.connections if arrow.id}
+    after_keys = {
+        id(arrow): _connection_key(arrow, _ends(after, arrow, same))
+        for arrow in after.connections
+    }
+    before_keys = {
+        id(arrow): _connection_key(arrow, _ends(before, arrow, resolve))
+        for arrow in before.connections
+    }
+    pairs: List[Tuple[DiagramEdge, DiagramEdge]] = []
+    unmatched_before: List[DiagramEdge] = []
+    for arrow in before.connections:
+        counterpart = after_arrows.get(arrow.id) if arrow.id else None
+        if counterpart is not None:
+            pairs.append((arrow, counterpart))
+        else:
+            unmatched_before.append(arrow)
+
+    paired = {id(new) for _, new in pairs}
+    by_key: Dict[Tuple[Any, Any, str], List[DiagramEdge]] = {}
+    for arrow in reversed(after.connections):
+        if id(arrow) not in paired:
+            by_key.setdefault(after_keys[id(arrow)], []).append(arrow)
+    removed_arrows = []
+    for arrow in unmatched_before:
+        candidates = by_key.get(before_keys[id(arrow)])
+        if candidates:
+            new = candidates.pop()
+            pairs.append((arrow, new))
+            paired.add(id(new))
+        else:
+            removed_arrows.append(arrow)
+
+    rewired, relabeled = [], []
+    for old, new in pairs:
+        if before_keys[id(old)] != after_keys[id(new)]:
+            rewired.append({"id": new.id, "before": before.edge(old), "after": after.edge(new)})
+        elif old.label != new.label:
+            relabeled.append({"id": new.id, "before": old.label, "after": new.label, "edge": after.edge(new)})
+
+    connections = {
+        "added": [after.edge(arrow) for arrow in after.connections if id(arrow) not in paired],
+        "removed": [before.edge(arrow) for arrow in removed_arrows],
+        "rewired": rewired,
+        "relabeled": relabeled
+    }
+
+    # Free text, as a multiset of labels
+    before_text = Counter(text.label for text in before.annotations if text.label)
+    after_text = Counter(text.label for text in after.annotations if text.label)
+    annotations = {
+        "added": list((after_text - before_text).elements()),
+        "removed": list((before_text - after_text).elements())
+    }
+
+    return {
+        "unchanged": not any(
+            changes for section in (components, connections, annotations) for changes in section.values()
+        ),
+        "components": components,
+        "connections": connections,
+        "annotations": annotations
+    }
+
+
+def diff_diagrams(
+    before: Optional[Dict[str, Any]],
+    after: Optional[Dict[str, Any]],
+    before_hash: Optional[str] = None,
+    after_hash: Optional[str] = None
+) -> Dict[str, Any]:
+    """diff_graphs of two diagrams (their graphs memoized when the hashes are given)"""
+    return diff_graphs(diagram_graph(before, before_hash), diagram_graph(after, after_hash))
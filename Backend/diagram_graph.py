@@ -0,0 +1,197 @@
+"""
+Typed diagram graph.
+One pass over an Excalidraw diagram builds compact element records
+(__slots__) sorted into components, connections (arrows) and text, with an id
+index and arrow adjacency. Labels are resolved like Excalidraw draws them:
+a shape's label is a separate text element whose containerId points at the
+shape, so bound text is attached to its container, and arrow endpoints are
+named after the labeled components they are bound to ("API Gateway -> Auth
+Service") instead of element ids. The prompt extractors of check, submit and chat
+and the /extract route all render from it instead of walking the raw
+elements themselves. Graphs are memoized by diagram_hash, so a diagram that
+is checked, chatted about and submitted is walked once per worker.
+"""
+import os
+from typing import Any, Dict, List, Optional
+
+from cache import LRUTTLCache
+
+
+# diagram_hash -> DiagramGraph; content-addressed, so entries never go stale
+_graphs = LRUTTLCache(
+    "diagram_graphs",
+    maxsize=int(os.getenv("DIAGRAM_GRAPH_CACHE_SIZE", "256")),
+    ttl=None
+)
+
+
+def _clean_label(text: Any) -> str:
+    """One line of text: wrapped and multi-line labels joined by single spaces"""
+    return " ".join(text.split()) if isinstance(text, str) else ""
+
+
+class DiagramElement:
+    """What the extractors read of one element"""
+
+    __slots__ = ("id", "type", "text", "group_ids", "bound_elements", "container_id", "label")
+
+    def __init__(self, element: Dict[str, Any]):
+        self.id = element.get("id") or ""
+        self.type = element.get("type") or ""
+        self.text = element.get("text") or ""
+        self.group_ids = element.get("groupIds") or []
+        self.bound_elements = element.get("boundElements") or []
+        # Set on text bound to a shape or arrow
+        self.container_id = element.get("containerId") or ""
+        # originalText is the label before Excalidraw wrapped it to the container
+        self.label = _clean_label(element.get("originalText") or self.text)
+
+    @property
+    def name(self) -> str:
+        """How the element is referred to in prompts: its label, else type#id"""
+        return self.label or f"{self.type or 'element'}#{self.id[:8]}"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "type": self.type,
+            "text": self.text,
+            "groupIds": self.group_ids,
+            "boundElements": self.bound_elements
+        }
+
+
+class DiagramEdge(DiagramElement):
+    """An arrow and the elements its ends are bound to"""
+
+    __slots__ = ("start_binding", "end_binding", "start_id", "end_id", "start_head", "end_head")
+
+    def __init__(self, element: Dict[str, Any]):
+        super().__init__(element)
+        start, end = element.get("startBinding"), element.get("endBinding")
+        self.start_binding = start if isinstance(start, dict) else {}
+        self.end_binding = end if isinstance(end, dict) else {}
+        self.start_id = self.start_binding.get("elementId") or ""
+        self.end_id = self.end_binding.get("elementId") or ""
+        # Excalidraw's default arrow points at its end
+        self.start_head = bool(element.get("startArrowhead"))
+        self.end_head = bool(element.get("endArrowhead", "arrow"))
+
+    def as_dict(self) -> Dict[str, Any]:
+        extracted = super().as_dict()
+        extracted["startBinding"] = self.start_binding
+        extracted["endBinding"] = self.end_binding
+        return extracted
+
+
+class DiagramGraph:
+    """Components, connections and text of a diagram, indexed by element id"""
+
+    __slots__ = (
+        "provided", "total", "records", "components", "connections", "texts", "annotations",
+        "by_id", "outgoing", "incoming"
+    )
+
+    def __init__(self, diagram: Optional[Dict[str, Any]]):
+        self.provided = bool(diagram) and isinstance(diagram, dict)
+        elements = (diagram.get("elements") or []) if self.provided else []
+        # Every entry counts, like the extractors always reported
+        self.total = len(elements)
+        # All records in element (z) order
+        self.records: List[DiagramElement] = []
+        self.components: List[DiagramElement] = []
+        self.connections: List[DiagramEdge] = []
+        self.texts: List[DiagramElement] = []
+        # Text not bound to an element of the diagram
+        self.annotations: List[DiagramElement] = []
+        self.by_id: Dict[str, DiagramElement] = {}
+        self.outgoing: Dict[str, List[DiagramEdge]] = {}
+        self.incoming: Dict[str, List[DiagramEdge]] = {}
+
+        for element in elements:
+            if not isinstance(element, dict):
+                continue
+            kind = element.get("type")
+            if kind == "arrow":
+                record = DiagramEdge(element)
+                self.connections.append(record)
+                if record.start_id:
+                    self.outgoing.setdefault(record.start_id, []).append(record)
+                if record.end_id:
+                    self.incoming.setdefault(record.end_id, []).append(record)
+            elif kind == "text":
+                record = DiagramElement(element)
+                self.texts.append(record)
+            else:
+                # Shapes; anything unknown counts as a component too
+                record = DiagramElement(element)
+                self.components.append(record)
+            self.records.append(record)
+            if record.id:
+                self.by_id[record.id] = record
+
+        self._attach_bound_text()
+
+    def _attach_bound_text(self) -> None:
+        """Label each container with its bound text (in z order), the rest are annotations"""
+        bound: Dict[str, List[str]] = {}
+        for text in self.texts:
+            container = self.by_id.get(text.container_id) if text.container_id else None
+            if container is None or container is text:
+                self.annotations.append(text)
+            elif text.label:
+                bound.setdefault(text.container_id, []).append(text.label)
+        for container_id, labels in bound.items():
+            container = self.by_id[container_id]
+            container.label = " ".join([container.label, *labels] if container.label else labels)
+
+    def endpoint_name(self, element_id: str) -> str:
+        """Name of the element an arrow end is bound to"""
+        if not element_id:
+            return "(unbound)"
+        record = self.by_id.get(element_id)
+        return record.name if record is not None else f"(missing #{element_id[:8]})"
+
+    def edge(self, arrow: DiagramEdge) -> str:
+        """'API Gateway -> Auth Service: label', following the arrowheads"""
+        start, end = self.endpoint_name(arrow.start_id), self.endpoint_name(arrow.end_id)
+        if arrow.start_head and arrow.end_head:
+            line = f"{start} <-> {end}"
+        elif arrow.start_head:
+            line = f"{end} -> {start}"
+        elif arrow.end_head:
+            line = f"{start} -> {end}"
+        else:
+            line = f"{start} -- {end}"
+        return f"{line}: {arrow.label}" if arrow.label else line
+
+    def edge_list(self) -> List[str]:
+        """Named topology: one line per connection"""
+        return [self.edge(arrow) for arrow in self.connections]
+
+    def degree(self, element_id: str) -> int:
+        """Arrows bound to an element, either end"""
+        return len(self.outgoing.get(element_id, ())) + len(self.incoming.get(element_id, ()))
+
+    def as_dicts(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Plain-dict form of the three categories (GET /sessions/{id}/extract)"""
+        return {
+            "components": [c.as_dict() for c in self.components],
+            "arrows": [a.as_dict() for a in self.connections],
+            "text_elements": [t.as_dict() for t in self.texts]
+        }
+
+
+def diagram_graph(diagram: Optional[Dict[str, Any]], diagram_hash: Optional[str] = None) -> DiagramGraph:
+    """
+    The graph of a diagram, memoized when its diagram_hash is given.
+    Graphs are shared: treat them as read-only.
+    """
+    if diagram_hash:
+        graph = _graphs.get(diagram_hash)
+        if graph is not None:
+            return graph
+    graph = DiagramGraph(diagram)
+    if diagram_hash:
+        _graphs.set(diagram_hash, graph)
+    return graph
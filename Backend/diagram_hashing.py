@@ -0,0 +1,280 @@
+"""
+Incremental diagram hashing.
+The diagram hash is a SHA-256 hash list: SHA-256 over a digest of appState
+and the rest of the document, a digest of the per-file digests (by file id)
+and one SHA-256 digest per element, in z-order, each over the element's
+canonical JSON. It is collision-resistant, so it doubles as the key of the
+shared content-addressed store.
+
+Each session keeps the per-element and per-file digests of its last hashed
+diagram. A full hash reuses an element's digest when its identity check
+(version, versionNonce, updated, key count and text) matches the memoized
+one, so an autosave only serializes what the client changed; checking text
+too catches the edits clients make without bumping the version. An element
+delta serializes only the upserted elements and files, which are always
+rehashed (and counted when their content changed under an unchanged
+version). The root is then one SHA-256 over the 32-byte digests. Memoized
+states are never mutated (a delta builds a new one), so offload threads can
+read them while the event loop hashes the next save.
+
+Hashes carry a "m2:" prefix. Older hashes are bare MD5 hex of the whole
+diagram's JSON, or "m1:" sums of element digests; they stay valid store keys
+and are replaced on the next save.
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from cache import LRUTTLCache
+from metrics import REGISTRY
+
+
+HASH_PREFIX = "m2:"
+# json.dumps builds a new encoder per call when given options; reuse one
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+try:
+    # encode() still builds a C encoder per call, which dominates small
+    # elements; build it once (same output as _encoder.encode)
+    _c_encode = json.encoder.c_make_encoder(
+        None, _encoder.default, json.encoder.encode_basestring_ascii, None,
+        _encoder.key_separator, _encoder.item_separator, True, False, True
+    )
+except TypeError:  # C accelerator missing or with another signature
+    _c_encode = None
+
+# memo key (session id) -> DiagramHashState of the last diagram hashed for it
+_states = LRUTTLCache(
+    "diagram_hash_states",
+    maxsize=int(os.getenv("DIAGRAM_HASH_STATE_CACHE_SIZE", "256")),
+    ttl=None
+)
+
+unbumped_elements = REGISTRY.counter(
+    "diagram_hash_unbumped_elements_total",
+    "Elements whose content changed under an unchanged version/versionNonce"
+)
+
+
+def _digest(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def _canonical(value: Any) -> bytes:
+    if _c_encode is not None:
+        return "".join(_c_encode(value, 0)).encode()
+    return _encoder.encode(value).encode()
+
+
+def _element_identity(element: Any) -> Optional[tuple]:
+    """What a full hash compares before reusing a memoized element digest"""
+    if not isinstance(element, dict) or element.get("version") is None:
+        return None
+    return (
+        element.get("version"), element.get("versionNonce"), element.get("updated"),
+        len(element), element.get("text")
+    )
+
+
+def _file_identity(file: Any) -> Optional[tuple]:
+    """Same for an entry of files (Excalidraw file ids are content hashes)"""
+    if not isinstance(file, dict):
+        return None
+    data_url = file.get("dataURL")
+    return (
+        file.get("mimeType"), file.get("created"), file.get("lastRetrieved"),
+        len(file), len(data_url) if isinstance(data_url, str) else None
+    )
+
+
+def _extras_digest(diagram: Dict[str, Any]) -> Tuple[bytes, int]:
+    """Digest and size of everything except the elements and the files mapping"""
+    rest = _canonical({
+        k: v for k, v in diagram.items()
+        if k != "elements" and not (k == "files" and isinstance(v, dict))
+    })
+    return _digest(b"rest\x00" + rest), len(rest)
+
+
+def _hash_file(file_id: str, file: Any) -> tuple:
+    raw = _canonical(file)
+    return (_file_identity(file), _digest(b"file\x00" + _canonical(file_id) + b"\x00" + raw), len(raw))
+
+
+class DiagramHashState:
+    """Per-element digests, in z-order, and per-file digests of one hashed diagram"""
+
+    __slots__ = ("keys", "elements", "files", "extras", "extras_size", "size", "unique", "root")
+
+    def __init__(self):
+        # Element ids in z-order; ("position", n) for a missing or repeated id,
+        # a namespace no element id can take
+        self.keys: List[Hashable] = []
+        # key -> (identity, digest, size)
+        self.elements: Dict[Hashable, tuple] = {}
+        # file id -> (identity, digest, size); None when files is not a mapping
+        self.files: Optional[Dict[str, tuple]] = None
+        self.extras = b""
+        self.extras_size = 0
+        self.size = 0
+        self.unique = True
+        self.root = ""
+
+    def copy(self) -> "DiagramHashState":
+        """Shallow copy of the containers; entries are immutable tuples"""
+        state = DiagramHashState()
+        state.keys = list(self.keys)
+        state.elements = dict(self.elements)
+        state.files = dict(self.files) if self.files is not None else None
+        state.extras, state.extras_size = self.extras, self.extras_size
+        state.size, state.unique, state.root = self.size, self.unique, self.root
+        return state
+
+    def finish(self) -> "DiagramHashState":
+        root = hashlib.sha256(b"diagram\x00" + self.extras)
+        self.size = self.extras_size + sum(entry[2] for entry in self.elements.values())
+        if self.files is not None:
+            files = b"".join(self.files[file_id][1] for file_id in sorted(self.files))
+            root.update(_digest(b"files\x00" + files))
+            self.size += sum(entry[2] for entry in self.files.values())
+        root.update(b"".join(self.elements[key][1] for key in self.keys))
+        self.root = HASH_PREFIX + root.hexdigest()
+        return self
+
+    @staticmethod
+    def _hash_element(element: Any, known: Optional[tuple] = None, identity: Optional[tuple] = None) -> tuple:
+        """Digest of an element; known is its memoized entry, checked against the content"""
+        identity = identity or _element_identity(element)
+        raw = _canonical(element)
+        entry = (identity, _digest(b"element\x00" + raw), len(raw))
+        if known and identity and known[0] and known[0][:2] == identity[:2] and known[1] != entry[1]:
+            unbumped_elements.inc()
+        return entry
+
+    def hash_files(self, files: Dict[str, Any], file_ids: Iterable[str], previous: Optional[Dict[str, tuple]] = None):
+        """(Re)hash file_ids of files, reusing previous entries whose identity matches"""
+        if self.files is None:
+            self.files = {}
+        for file_id in file_ids:
+            file = files[file_id]
+            known = previous.get(file_id) if previous else None
+            identity = _file_identity(file)
+            if known and identity is not None and known[0] == identity:
+                self.files[file_id] = known
+            else:
+                self.files[file_id] = _hash_file(file_id, file)
+
+
+def _full_state(diagram: Dict[str, Any], previous: Optional[DiagramHashState]) -> DiagramHashState:
+    state = DiagramHashState()
+    known_elements = previous.elements if previous is not None else {}
+    for position, element in enumerate(diagram.get("elements") or []):
+        element_id = element.get("id") if isinstance(element, dict) else None
+        if isinstance(element_id, str) and element_id and element_id not in state.elements:
+            key = element_id
+            known = known_elements.get(key)
+        else:
+            key, known = ("position", position), None
+            state.unique = False
+        identity = _element_identity(element)
+        if known and identity is not None and known[0] == identity:
+            entry = known
+        else:
+            entry = state._hash_element(element, known, identity)
+        state.keys.append(key)
+        state.elements[key] = entry
+    files = diagram.get("files")
+    if isinstance(files, dict):
+        state.hash_files(files, files, previous.files if previous is not None else None)
+    state.extras, state.extras_size = _extras_digest(diagram)
+    return state.finish()
+
+
+def hash_diagram(diagram: Dict[str, Any], memo_key: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Hash of a diagram plus its approximate serialized size in bytes.
+    With memo_key the digests are kept for the next hash_diagram or
+    apply_delta_hash of the same key, which reuse the unchanged ones.
+    """
+    previous = _states.get(memo_key) if memo_key else None
+    state = _full_state(diagram, previous)
+    if memo_key:
+        _states.set(memo_key, state)
+    return state.root, state.size
+
+
+def calculate_diagram_hash(diagram: Dict[str, Any], memo_key: Optional[str] = None) -> str:
+    """Calculate hash of diagram data (change detection and store key)"""
+    return hash_diagram(diagram, memo_key)[0]
+
+
+def apply_delta_hash(
+    memo_key: str,
+    base_hash: str,
+    diagram: Dict[str, Any],
+    upserts: Iterable[Dict[str, Any]],
+    deletes: Iterable[str],
+    files: Optional[Dict[str, Any]] = None
+) -> Optional[Tuple[str, int]]:
+    """
+    Update the memoized hash of base_hash by an element delta, serializing
+    only the changed elements and the files of the delta. diagram is the
+    result of diagram_delta.apply_element_delta on the base (its appState
+    and the rest are rehashed, its other files are not). Returns None when
+    no usable state for the base is memoized; the caller then uses
+    hash_diagram.
+    """
+    base = _states.get(memo_key)
+    if base is None or base.root != base_hash or not base.unique:
+        return None
+
+    # Copy on write: hash_diagram may be reading the memoized state on an
+    # offload thread (run_diagram_op) while this runs on the event loop
+    state = base.copy()
+    for element in upserts:
+        key = element["id"]
+        known = state.elements.get(key)
+        if not known:
+            state.keys.append(key)
+        state.elements[key] = state._hash_element(element, known)
+
+    removed = set()
+    for key in deletes:
+        if state.elements.pop(key, None):
+            removed.add(key)
+    if removed:
+        state.keys = [key for key in state.keys if key not in removed]
+
+    merged = diagram.get("files")
+    if isinstance(merged, dict):
+        # A base without a files mapping has nothing memoized to keep
+        state.hash_files(merged, merged if state.files is None else (files or ()))
+    state.extras, state.extras_size = _extras_digest(diagram)
+    state.finish()
+    _states.set(memo_key, state)
+    return state.root, state.size
+
+
+def forget(memo_key: str) -> None:
+    """Drop the memoized state of a key (e.g. when its session ends)"""
+    _states.invalidate(memo_key)
+
+
+# ---------- Compatibility ----------
+
+def is_legacy_hash(diagram_hash: Optional[str]) -> bool:
+    """True for hashes written before incremental hashing (bare MD5 hex)"""
+    return bool(diagram_hash) and ":" not in diagram_hash
+
+
+def legacy_diagram_hash(diagram: Dict[str, Any]) -> str:
+    """The previous scheme: MD5 of the whole diagram's key-sorted JSON"""
+    return hashlib.md5(json.dumps(diagram, sort_keys=True).encode()).hexdigest()
+
+
+def diagram_hash_matches(diagram_hash: str, diagram: Dict[str, Any]) -> bool:
+    """Check a stored hash of either scheme against a diagram"""
+    if is_legacy_hash(diagram_hash):
+        return legacy_diagram_hash(diagram) == diagram_hash
+    # "m1:" sums are not recomputed: the diagram is rehashed under the current scheme
+    return calculate_diagram_hash(diagram) == diagram_hash
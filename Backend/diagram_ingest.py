@@ -0,0 +1,275 @@
+"""
+Request body limits and streaming ingestion of diagram payloads.
+Diagrams with embedded images can be tens of MB. A Pydantic body parameter
+makes FastAPI buffer the whole body, decode it into a str, parse it and then
+validate a copy before the route runs. The diagram routes read their body
+through read_diagram_body instead:
+  - by default the bytes are buffered (bounded by the route's limit) and
+    parsed by json.loads, off the event loop for large bodies
+  - bodies declaring at least DIAGRAM_STREAM_MIN_BYTES (when ijson's C
+    backend is installed): the body is parsed chunk by chunk as it arrives,
+    elements are built one at a time and the element limit is enforced
+    before the rest of the body is read. This keeps peak memory down for
+    the largest bodies but costs several times the CPU of json.loads, on
+    the event loop, so it is not used for ordinary ones
+Either way only the parsed objects outlive the request body.
+
+BodySizeLimitMiddleware caps every request body: per-route limits for the
+diagram routes, MAX_BODY_BYTES for everything else. Declared lengths are
+rejected before reading, chunked bodies as soon as they cross the limit.
+"""
+import json
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Dict, Iterable, NamedTuple, Type
+
+from fastapi import HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
+
+from diagram_offload import run_diagram_op
+from metrics import REGISTRY
+
+try:
+    import ijson
+    IJSON_AVAILABLE = True
+except ImportError:  # optional dependency
+    ijson = None
+    IJSON_AVAILABLE = False
+
+
+MIB = 1024 * 1024
+
+MAX_BODY_BYTES = int(os.getenv("MAX_BODY_BYTES", str(1 * MIB)))
+AUTOSAVE_MAX_BODY_BYTES = int(os.getenv("AUTOSAVE_MAX_BODY_BYTES", str(64 * MIB)))
+SUBMISSION_MAX_BODY_BYTES = int(os.getenv("SUBMISSION_MAX_BODY_BYTES", str(64 * MIB)))
+CHAT_MAX_BODY_BYTES = int(os.getenv("CHAT_MAX_BODY_BYTES", str(16 * MIB)))
+DIAGRAM_MAX_ELEMENTS = int(os.getenv("DIAGRAM_MAX_ELEMENTS", "50000"))
+# auto (ijson above DIAGRAM_STREAM_MIN_BYTES when its C backend is installed) | ijson | buffered
+DIAGRAM_BODY_PARSER = os.getenv("DIAGRAM_BODY_PARSER", "auto").lower()
+DIAGRAM_STREAM_MIN_BYTES = int(os.getenv("DIAGRAM_STREAM_MIN_BYTES", str(16 * MIB)))
+
+body_rejected = REGISTRY.counter("request_body_rejected_total", "Request bodies refused for size, by route limit")
+ingest_seconds = REGISTRY.histogram("diagram_ingest_seconds", "Time to receive and parse a diagram body, by parser")
+
+
+class BodyLimit(NamedTuple):
+    name: str
+    method: str
+    pattern: str
+    limit: int
+
+
+BODY_LIMITS = [
+    BodyLimit("autosave", "PUT", r"^/sessions/[^/]+/autosave(/delta)?/?$", AUTOSAVE_MAX_BODY_BYTES),
+    BodyLimit("ai_chat", "POST", r"^/sessions/[^/]+/ai-chat/?$", CHAT_MAX_BODY_BYTES),
+    BodyLimit("submission_create", "POST", r"^/submissions/?$", SUBMISSION_MAX_BODY_BYTES),
+    BodyLimit("submission_update", "PUT", r"^/submissions/[^/]+/?$", SUBMISSION_MAX_BODY_BYTES),
+]
+
+
+# 413 is named differently across Starlette versions
+PAYLOAD_TOO_LARGE = 413
+
+
+class BodyTooLarge(HTTPException):
+    def __init__(self, detail: str):
+        super().__init__(status_code=PAYLOAD_TOO_LARGE, detail=detail)
+
+
+def _too_large(limit: int) -> str:
+    return f"Request body too large (limit {limit} bytes)"
+
+
+# ---------- Middleware ----------
+
+class BodySizeLimitMiddleware:
+    """ASGI middleware enforcing BODY_LIMITS (first match) or default_limit"""
+
+    def __init__(self, app, limits: Iterable[BodyLimit] = BODY_LIMITS, default_limit: int = MAX_BODY_BYTES):
+        self.app = app
+        self.default_limit = default_limit
+        self.limits = [(rule, re.compile(rule.pattern)) for rule in limits]
+
+    def limit_for(self, method: str, path: str) -> tuple:
+        for rule, pattern in self.limits:
+            if rule.method == method and pattern.match(path):
+                return rule.name, rule.limit
+        return "default", self.default_limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        name, limit = self.limit_for(scope["method"], scope["path"])
+        declared = dict(scope.get("headers") or []).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            body_rejected.inc(labels={"route": name})
+            response = JSONResponse({"detail": _too_large(limit)}, status_code=PAYLOAD_TOO_LARGE)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    body_rejected.inc(labels={"route": name})
+                    # An HTTPException, so FastAPI's body parsing re-raises it as is
+                    raise BodyTooLarge(_too_large(limit))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# ---------- Ingestion ----------
+
+def _use_ijson(request: Request) -> bool:
+    if DIAGRAM_BODY_PARSER == "buffered" or not IJSON_AVAILABLE:
+        return False
+    if DIAGRAM_BODY_PARSER == "ijson":
+        return True
+    # The pure-Python backend is too slow for tens of MB on the event loop
+    if ijson.backend not in ("yajl2_c", "yajl2_cffi"):
+        return False
+    # Chunked bodies of unknown length are buffered (bounded by the middleware)
+    declared = request.headers.get("content-length", "")
+    return declared.isdigit() and int(declared) >= DIAGRAM_STREAM_MIN_BYTES
+
+
+def _invalid_json(error: str) -> RequestValidationError:
+    return RequestValidationError([{
+        "type": "json_invalid",
+        "loc": ("body",),
+        "msg": "JSON decode error",
+        "input": {},
+        "ctx": {"error": error}
+    }])
+
+
+def _too_many_elements() -> BodyTooLarge:
+    return BodyTooLarge(f"Diagram has more than {DIAGRAM_MAX_ELEMENTS} elements")
+
+
+class _StreamReader:
+    """Async file-like view of a body chunk stream, for ijson"""
+
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks.__aiter__()
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson probes with read(0) for the data type and drops the result
+        if size == 0:
+            return b""
+        # Otherwise any non-empty read is accepted; b"" means end of body
+        async for chunk in self._chunks:
+            if chunk:
+                return chunk
+        return b""
+
+
+async def parse_streaming(chunks: AsyncIterator[bytes], diagram_key: str = "diagram_data") -> Any:
+    """Build the JSON document from chunks as they arrive, one element at a time"""
+    elements_prefix = f"{diagram_key}.elements.item"
+    builder = ijson.ObjectBuilder()
+    elements = 0
+    try:
+        async for prefix, event, value in ijson.parse_async(_StreamReader(chunks), use_float=True):
+            if prefix == elements_prefix and event not in ("end_map", "end_array", "map_key"):
+                elements += 1
+                if elements > DIAGRAM_MAX_ELEMENTS:
+                    raise _too_many_elements()
+            builder.event(event, value)
+    except ijson.JSONError as e:
+        raise _invalid_json(str(e))
+    if not hasattr(builder, "value"):
+        raise _invalid_json("empty body")
+    return builder.value
+
+
+async def parse_buffered(chunks: AsyncIterator[bytes], diagram_key: str = "diagram_data") -> Any:
+    """Read the whole body (bounded by the middleware), then parse it"""
+    raw = bytearray()
+    async for chunk in chunks:
+        raw += chunk
+    try:
+        body = await run_diagram_op("parse", len(raw), json.loads, raw, process_safe=True)
+    except ValueError as e:  # JSONDecodeError and bad UTF-8
+        raise _invalid_json(str(e))
+    del raw
+
+    diagram = body.get(diagram_key) if isinstance(body, dict) else None
+    if isinstance(diagram, dict) and len(diagram.get("elements") or []) > DIAGRAM_MAX_ELEMENTS:
+        raise _too_many_elements()
+    return body
+
+
+async def read_diagram_body(request: Request, diagram_key: str = "diagram_data") -> Dict[str, Any]:
+    """
+    The JSON object body of a diagram route. Raises RequestValidationError
+    (422, like a Pydantic body parameter) for malformed JSON or a non-object,
+    and BodyTooLarge (413) past the element limit.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type and "json" not in content_type:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Expected an application/json body"
+        )
+
+    parser = "ijson" if _use_ijson(request) else "buffered"
+    started = time.perf_counter()
+    try:
+        if parser == "ijson":
+            body = await parse_streaming(request.stream(), diagram_key)
+        else:
+            body = await parse_buffered(request.stream(), diagram_key)
+    finally:
+        ingest_seconds.observe(time.perf_counter() - started, labels={"parser": parser})
+
+    if not isinstance(body, dict):
+        raise RequestValidationError([{
+            "type": "model_attributes_type",
+            "loc": ("body",),
+            "msg": "Input should be a valid dictionary or object to extract fields from",
+            "input": None
+        }])
+    return body
+
+
+def validate_body(model: Type[BaseModel], body: Dict[str, Any]) -> BaseModel:
+    """model(**body), reported like FastAPI's own body validation"""
+    try:
+        return model(**body)
+    except ValidationError as e:
+        raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors()])
+
+
+# Nested models of json_body_schema bodies, added to the OpenAPI components by add_body_schemas
+BODY_SCHEMA_COMPONENTS: Dict[str, Any] = {}
+
+
+def json_body_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """openapi_extra documenting model as the JSON body of a route that reads it itself"""
+    schema = model.model_json_schema(ref_template="#/components/schemas/{model}")
+    BODY_SCHEMA_COMPONENTS.update(schema.pop("$defs", {}))
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": schema}}
+        }
+    }
+
+
+def add_body_schemas(openapi_schema: Dict[str, Any]) -> Dict[str, Any]:
+    """Register BODY_SCHEMA_COMPONENTS in an OpenAPI document, keeping FastAPI's own components"""
+    components = openapi_schema.setdefault("components", {}).setdefault("schemas", {})
+    for name, schema in BODY_SCHEMA_COMPONENTS.items():
+        components.setdefault(name, schema)
+    return openapi_schema
@@ -0,0 +1,144 @@
+"""
+Diagram work off the event loop.
+Hashing, encoding, merging and prompt extraction are plain CPU work on the
+request's event loop: one multi-megabyte diagram stalls every other request
+of the worker. run_diagram_op keeps small diagrams inline (a pool hop costs
+more than the work) and runs large ones on a bounded executor:
+  - thread (default): the loop keeps getting the GIL between bytecode slices,
+    and hashlib / zstd release it while they work
+  - process: true parallelism for pure functions (process_safe=True); others
+    still use threads since they touch per-worker caches
+  - none: everything inline (the previous behaviour)
+At most DIAGRAM_OFFLOAD_MAX_PENDING jobs are queued or running; further
+callers wait asynchronously for a slot.
+
+The metrics split each operation's time into what it cost the event loop and
+what it cost in total, and a sampler records how late the loop wakes up.
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from metrics import REGISTRY
+
+
+DIAGRAM_OFFLOAD_EXECUTOR = os.getenv("DIAGRAM_OFFLOAD_EXECUTOR", "thread").lower()
+# Estimated serialized size from which a diagram leaves the event loop
+DIAGRAM_OFFLOAD_MIN_BYTES = int(os.getenv("DIAGRAM_OFFLOAD_MIN_BYTES", str(256 * 1024)))
+DIAGRAM_OFFLOAD_WORKERS = max(1, int(os.getenv("DIAGRAM_OFFLOAD_WORKERS", str(min(4, os.cpu_count() or 1)))))
+DIAGRAM_OFFLOAD_MAX_PENDING = max(1, int(os.getenv("DIAGRAM_OFFLOAD_MAX_PENDING", str(DIAGRAM_OFFLOAD_WORKERS * 2))))
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_SECONDS", "0.5"))
+
+# Average canonical JSON size of an Excalidraw element; only used to route work
+ELEMENT_BYTES_ESTIMATE = 400
+
+diagram_op_seconds = REGISTRY.histogram("diagram_op_seconds", "Wall time of a diagram operation, by op and mode")
+diagram_op_loop_seconds = REGISTRY.histogram(
+    "diagram_op_loop_seconds",
+    "Event-loop time blocked by a diagram operation, by op (inline runs only)"
+)
+diagram_offload_wait_seconds = REGISTRY.histogram(
+    "diagram_offload_wait_seconds",
+    "Time an offloaded diagram operation waited for an executor slot"
+)
+diagram_offload_in_flight = REGISTRY.gauge("diagram_offload_in_flight", "Diagram operations queued or running on an executor")
+event_loop_lag_seconds = REGISTRY.histogram("event_loop_lag_seconds", "How late the event loop woke up for a timer")
+
+T = TypeVar("T")
+
+_executors: Dict[str, Executor] = {}
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def estimate_diagram_size(diagram: Optional[Dict[str, Any]]) -> int:
+    """Cheap O(elements) stand-in for the serialized size: no serialization"""
+    if not isinstance(diagram, dict):
+        return 0
+    size = len(diagram.get("elements") or []) * ELEMENT_BYTES_ESTIMATE
+    for file in (diagram.get("files") or {}).values():
+        if isinstance(file, dict):
+            size += len(file.get("dataURL") or "")
+    return size
+
+
+def _executor(mode: str) -> Executor:
+    executor = _executors.get(mode)
+    if executor is None:
+        if mode == "process":
+            # spawn: forking would copy the worker's event loop and MongoDB client
+            executor = ProcessPoolExecutor(
+                max_workers=DIAGRAM_OFFLOAD_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        else:
+            executor = ThreadPoolExecutor(max_workers=DIAGRAM_OFFLOAD_WORKERS, thread_name_prefix="diagram")
+        _executors[mode] = executor
+    return executor
+
+
+def _slot_semaphore() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(DIAGRAM_OFFLOAD_MAX_PENDING)
+    return _slots
+
+
+async def run_diagram_op(op: str, size: int, fn: Callable[..., T], *args: Any, process_safe: bool = False) -> T:
+    """
+    Run fn(*args) for a diagram of roughly size bytes: inline when small,
+    otherwise on the executor. process_safe marks fn as a picklable pure
+    function that may run in another process. fn must not rely on running on
+    the event loop thread.
+    """
+    if size < DIAGRAM_OFFLOAD_MIN_BYTES or DIAGRAM_OFFLOAD_EXECUTOR not in ("thread", "process"):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            diagram_op_seconds.observe(elapsed, labels={"op": op, "mode": "inline"})
+            diagram_op_loop_seconds.observe(elapsed, labels={"op": op})
+
+    mode = "process" if process_safe and DIAGRAM_OFFLOAD_EXECUTOR == "process" else "thread"
+    queued = time.perf_counter()
+    diagram_offload_in_flight.inc()
+    try:
+        async with _slot_semaphore():
+            started = time.perf_counter()
+            diagram_offload_wait_seconds.observe(started - queued, labels={"op": op})
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    _executor(mode), functools.partial(fn, *args)
+                )
+            finally:
+                diagram_op_seconds.observe(time.perf_counter() - started, labels={"op": op, "mode": mode})
+    finally:
+        diagram_offload_in_flight.dec()
+
+
+def shutdown_diagram_executors() -> None:
+    """Stop the pools (on shutdown); running jobs finish first"""
+    for executor in _executors.values():
+        executor.shutdown(wait=True)
+    _executors.clear()
+
+
+# ---------- Event-loop lag ----------
+
+async def _sample_loop_lag(interval: float) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag_seconds.observe(max(0.0, loop.time() - expected))
+
+
+def start_loop_lag_monitor() -> Optional[asyncio.Task]:
+    """Record how late a periodic timer fires; None when disabled"""
+    if EVENT_LOOP_LAG_INTERVAL_SECONDS <= 0:
+        return None
+    return asyncio.create_task(_sample_loop_lag(EVENT_LOOP_LAG_INTERVAL_SECONDS))
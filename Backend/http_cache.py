@@ -0,0 +1,126 @@
+"""
+HTTP validators and conditional GETs.
+ETags are derived from fields every write already maintains (version,
+diagram_hash, updated_at), so a revalidation is answered 304 from document
+metadata before a diagram is loaded or anything is serialized.
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from diagram_codec import ZSTD_AVAILABLE, diagram_json_bytes, zstd_spliced
+from metrics import REGISTRY
+
+
+# Public problem endpoints: lets a reverse proxy / browser absorb catalog reads
+PROBLEM_CACHE_CONTROL = os.getenv(
+    "PROBLEM_HTTP_CACHE_CONTROL",
+    "public, max-age=60, stale-while-revalidate=300"
+)
+# Per-user documents: cacheable by the browser only, revalidated on every use
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+not_modified_total = REGISTRY.counter("http_not_modified_total", "Conditional GETs answered 304")
+
+
+def make_etag(*parts: Any) -> str:
+    """Strong ETag over the given parts (None and datetimes allowed)"""
+    raw = "\x00".join(p.isoformat() if isinstance(p, datetime) else str(p) for p in parts)
+    return '"' + hashlib.sha256(raw.encode()).hexdigest()[:32] + '"'
+
+
+def _utc_seconds(value: datetime) -> datetime:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def validator_headers(
+    etag: str,
+    last_modified: Optional[datetime] = None,
+    cache_control: str = PRIVATE_CACHE_CONTROL
+) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(_utc_seconds(last_modified), usegmt=True)
+    return headers
+
+
+def _strip_weak(tag: str) -> str:
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """
+    True when the client's copy is current. If-None-Match wins over
+    If-Modified-Since (RFC 9110); tags are compared weakly since proxies that
+    compress may have weakened ours.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {_strip_weak(tag.strip()) for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None:
+            return False
+        return _utc_seconds(last_modified) <= _utc_seconds(since)
+    return False
+
+
+def not_modified(headers: Dict[str, str], route: str) -> Response:
+    """Empty 304 carrying the validators"""
+    not_modified_total.inc(labels={"route": route})
+    return Response(status_code=304, headers=headers)
+
+
+# ---------- Diagram responses ----------
+
+def _envelope_parts(envelope: Dict[str, Any], key: str) -> Tuple[bytes, bytes]:
+    head = json.dumps(jsonable_encoder(envelope), separators=(",", ":")).encode()[:-1]
+    prefix = head + (b"," if envelope else b"") + json.dumps(key).encode() + b":"
+    return prefix, b"}"
+
+
+def accepts_zstd(accept_encoding: str) -> bool:
+    """Whether diagram_response will pass zstd blobs through for this Accept-Encoding"""
+    accepted = {token.split(";")[0].strip() for token in accept_encoding.lower().split(",")}
+    return ZSTD_AVAILABLE and "zstd" in accepted
+
+
+def diagram_response(
+    envelope: Dict[str, Any],
+    record: Optional[Dict[str, Any]],
+    accept_encoding: str = "",
+    key: str = "diagram_data"
+) -> Response:
+    """
+    JSON response of envelope plus the diagram under key, built from the stored
+    bytes. A zstd blob is passed through untouched to clients that accept zstd.
+    """
+    prefix, suffix = _envelope_parts(envelope, key)
+
+    body = zstd_spliced(prefix, record, suffix) if accepts_zstd(accept_encoding) else None
+    if body is not None:
+        return Response(
+            content=body,
+            media_type="application/json",
+            headers={"Content-Encoding": "zstd", "Vary": "Accept-Encoding"}
+        )
+
+    return Response(
+        content=prefix + diagram_json_bytes(record) + suffix,
+        media_type="application/json",
+        headers={"Vary": "Accept-Encoding"}
+    )
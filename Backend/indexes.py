@@ -0,0 +1,257 @@
+"""
+Index bootstrapper
+Declares the indexes every CRUD access pattern needs, creates them at startup,
+and can explain() each known query shape to prove none of them is a COLLSCAN.
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+from CRUD.pagination import keyset_filter, keyset_sort, encode_cursor
+
+
+AUTO_CREATE_INDEXES = os.getenv("MONGO_AUTO_CREATE_INDEXES", "true").lower() in ("1", "true", "yes")
+
+
+# ---------- Declared indexes ----------
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    "problems": [
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_at_id"),
+        # Catalog ETag: latest updated_at
+        IndexModel([("updated_at", DESCENDING)], name="updated_at"),
+        IndexModel(
+            [("created_by", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="created_by_created_at_id",
+        ),
+        # Relevance-ranked search: title > requirements > description
+        IndexModel(
+            [("title", TEXT), ("requirements", TEXT), ("description", TEXT)],
+            name="problem_search_text",
+            weights={"title": 10, "requirements": 5, "description": 1},
+            default_language="english",
+        ),
+    ],
+    "sessions": [
+        IndexModel(
+            [("user_id", ASCENDING), ("problem_id", ASCENDING), ("status", ASCENDING)],
+            name="user_problem_status",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_created_at_id",
+        ),
+        IndexModel([("status", ASCENDING), ("updated_at", ASCENDING)], name="status_updated_at"),
+    ],
+    "submissions": [
+        IndexModel(
+            [("user_id", ASCENDING), ("submitted_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_submitted_at_id",
+        ),
+        IndexModel(
+            [("problem_id", ASCENDING), ("submitted_at", DESCENDING), ("_id", DESCENDING)],
+            name="problem_submitted_at_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("problem_id", ASCENDING), ("submitted_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_problem_submitted_at_id",
+        ),
+        IndexModel(
+            [("user_id", ASCENDING), ("problem_id", ASCENDING), ("session_id", ASCENDING),
+             ("submitted_at", DESCENDING), ("_id", DESCENDING)],
+            name="user_problem_session_submitted_at_id",
+        ),
+    ],
+    "chat_messages": [
+        IndexModel(
+            [("session_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)],
+            name="session_timestamp_id",
+        ),
+        # Cached /check feedback lookup by diagram hash
+        IndexModel(
+            [("session_id", ASCENDING), ("role", ASCENDING), ("diagram_hash", ASCENDING), ("timestamp", DESCENDING)],
+            name="session_role_diagram_hash_timestamp",
+        ),
+    ],
+    "diagram_history": [
+        IndexModel([("session_id", ASCENDING), ("seq", ASCENDING)], name="session_seq", unique=True),
+        IndexModel(
+            [("session_id", ASCENDING), ("kind", ASCENDING), ("seq", DESCENDING)],
+            name="session_kind_seq",
+        ),
+        IndexModel(
+            [("session_id", ASCENDING), ("saved_at", DESCENDING), ("_id", DESCENDING)],
+            name="session_saved_at_id",
+        ),
+        IndexModel(
+            [("session_id", ASCENDING), ("diagram_hash", ASCENDING), ("seq", DESCENDING)],
+            name="session_diagram_hash_seq",
+        ),
+    ],
+}
+
+
+async def ensure_indexes(db) -> None:
+    """
+    Create every declared index. createIndexes is idempotent, so this is cheap
+    when they already exist. A failing index (e.g. duplicate emails blocking the
+    unique index) is reported but does not stop the worker from starting.
+    """
+    if not AUTO_CREATE_INDEXES:
+        return
+
+    for collection_name, models in INDEXES.items():
+        try:
+            await db.get_collection(collection_name).create_indexes(models)
+        except OperationFailure as e:
+            print(f"WARNING: failed to create indexes on '{collection_name}': {e}")
+
+
+# ---------- Query shapes ----------
+# One entry per query the CRUD layer issues. Values are placeholders; only the
+# shape matters to the planner. Keep this list in sync when adding a query.
+
+_SAMPLE_ID = ObjectId()
+_SAMPLE_CURSOR = encode_cursor(datetime.utcnow(), _SAMPLE_ID)
+
+QUERY_SHAPES: List[Dict[str, Any]] = [
+    # user_crud
+    {"name": "user_crud.get_user_by_email", "collection": "users",
+     "filter": {"email": "user@example.com"}},
+
+    # problem_crud
+    {"name": "problem_crud.get_problem_by_id", "collection": "problems",
+     "filter": {"_id": _SAMPLE_ID}},
+    {"name": "problem_crud.get_all_problems", "collection": "problems",
+     "filter": {}, "sort": keyset_sort("created_at")},
+    {"name": "problem_crud.get_all_problems (cursor)", "collection": "problems",
+     "filter": keyset_filter({}, "created_at", _SAMPLE_CURSOR), "sort": keyset_sort("created_at")},
+    {"name": "problem_crud.get_problems_by_user", "collection": "problems",
+     "filter": {"created_by": "user@example.com"}, "sort": keyset_sort("created_at")},
+    {"name": "problem_crud.get_problems_by_user (cursor)", "collection": "problems",
+     "filter": keyset_filter({"created_by": "user@example.com"}, "created_at", _SAMPLE_CURSOR),
+     "sort": keyset_sort("created_at")},
+    {"name": "problem_crud.get_catalog_state", "collection": "problems",
+     "filter": {}, "projection": {"updated_at": 1, "_id": 0}, "sort": [("updated_at", DESCENDING)]},
+    {"name": "problem_crud.search_problems", "collection": "problems",
+     "filter": {"$text": {"$search": "cache"}, "difficulty": "medium"},
+     "projection": {"score": {"$meta": "textScore"}},
+     "sort": [("score", {"$meta": "textScore"}), ("created_at", DESCENDING)]},
+
+    # session_crud
+    {"name": "session_crud.get_session_by_id", "collection": "sessions",
+     "filter": {"_id": _SAMPLE_ID}},
+    {"name": "session_crud.get_active_session_for_problem", "collection": "sessions",
+     "filter": {"user_id": "user@example.com", "problem_id": "p", "status": {"$in": ["active", "paused"]}}},
+    {"name": "session_crud.get_sessions_by_user", "collection": "sessions",
+     "filter": {"user_id": "user@example.com"}, "sort": keyset_sort("created_at")},
+    {"name": "session_crud.get_sessions_by_user (cursor)", "collection": "sessions",
+     "filter": keyset_filter({"user_id": "user@example.com"}, "created_at", _SAMPLE_CURSOR),
+     "sort": keyset_sort("created_at")},
+    {"name": "session_crud.cleanup_old_sessions", "collection": "sessions",
+     "filter": {"status": "abandoned", "updated_at": {"$lt": datetime.utcnow()}}},
+
+    # submission_crud
+    {"name": "submission_crud.get_submission_by_id", "collection": "submissions",
+     "filter": {"_id": _SAMPLE_ID}},
+    {"name": "submission_crud.get_submissions_by_user", "collection": "submissions",
+     "filter": {"user_id": "user@example.com"}, "sort": keyset_sort("submitted_at")},
+    {"name": "submission_crud.get_submissions_by_user (cursor)", "collection": "submissions",
+     "filter": keyset_filter({"user_id": "user@example.com"}, "submitted_at", _SAMPLE_CURSOR),
+     "sort": keyset_sort("submitted_at")},
+    {"name": "submission_crud.get_submissions_by_problem", "collection": "submissions",
+     "filter": {"problem_id": "p"}, "sort": keyset_sort("submitted_at")},
+    {"name": "submission_crud.get_submissions_by_problem (cursor)", "collection": "submissions",
+     "filter": keyset_filter({"problem_id": "p"}, "submitted_at", _SAMPLE_CURSOR),
+     "sort": keyset_sort("submitted_at")},
+    {"name": "submission_crud.get_user_submission_for_problem", "collection": "submissions",
+     "filter": {"user_id": "user@example.com", "problem_id": "p"}},
+    {"name": "submission_crud.get_user_problem_submissions", "collection": "submissions",
+     "filter": {"user_id": "user@example.com", "problem_id": "p"}, "sort": keyset_sort("submitted_at")},
+    {"name": "submission_crud.get_session_submission", "collection": "submissions",
+     "filter": {"user_id": "user@example.com", "problem_id": "p", "session_id": "s"},
+     "sort": keyset_sort("submitted_at"), "limit": 1},
+
+    # chat_crud
+    {"name": "chat_crud.get_messages", "collection": "chat_messages",
+     "filter": {"session_id": "s"}, "sort": keyset_sort("timestamp"), "limit": 50},
+    {"name": "chat_crud.get_messages (cursor)", "collection": "chat_messages",
+     "filter": keyset_filter({"session_id": "s"}, "timestamp", _SAMPLE_CURSOR),
+     "sort": keyset_sort("timestamp"), "limit": 50},
+    {"name": "chat_crud.get_all_messages", "collection": "chat_messages",
+     "filter": {"session_id": "s"}, "sort": [("timestamp", ASCENDING), ("_id", ASCENDING)]},
+    {"name": "chat_crud.find_check_feedback", "collection": "chat_messages",
+     "filter": {"session_id": "s", "role": "system_check", "diagram_hash": "h"},
+     "sort": [("timestamp", DESCENDING)], "limit": 1},
+    {"name": "chat_crud.get_latest_check_hash", "collection": "chat_messages",
+     "filter": {"session_id": "s", "role": "system_check"},
+     "sort": [("timestamp", DESCENDING)], "limit": 1},
+    {"name": "chat_crud.delete_messages", "collection": "chat_messages",
+     "filter": {"session_id": {"$in": ["s"]}}},
+
+    # history_crud
+    {"name": "history_crud.get_history", "collection": "diagram_history",
+     "filter": {"session_id": "s"}, "sort": keyset_sort("saved_at"), "limit": 50},
+    {"name": "history_crud.get_history (cursor)", "collection": "diagram_history",
+     "filter": keyset_filter({"session_id": "s"}, "saved_at", _SAMPLE_CURSOR),
+     "sort": keyset_sort("saved_at"), "limit": 50},
+    {"name": "history_crud.get_latest_entry", "collection": "diagram_history",
+     "filter": {"session_id": "s"}, "sort": [("seq", DESCENDING)], "limit": 1},
+    {"name": "history_crud.get_entry_at_time", "collection": "diagram_history",
+     "filter": {"session_id": "s", "saved_at": {"$lte": datetime.utcnow()}},
+     "sort": [("saved_at", DESCENDING), ("_id", DESCENDING)], "limit": 1},
+    {"name": "history_crud.get_entry_for_hash", "collection": "diagram_history",
+     "filter": {"session_id": "s", "diagram_hash": "h"}, "sort": [("seq", DESCENDING)], "limit": 1},
+    {"name": "history_crud.get_diagram_at (snapshot)", "collection": "diagram_history",
+     "filter": {"session_id": "s", "kind": "snapshot", "seq": {"$lte": 10}},
+     "sort": [("seq", DESCENDING)], "limit": 1},
+    {"name": "history_crud.get_diagram_at (deltas)", "collection": "diagram_history",
+     "filter": {"session_id": "s", "seq": {"$gt": 0, "$lte": 10}}, "sort": [("seq", ASCENDING)]},
+    {"name": "history_crud.delete_history", "collection": "diagram_history",
+     "filter": {"session_id": {"$in": ["s"]}, "kind": "snapshot"}},
+]
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    """Flatten every stage name in an explain() plan tree"""
+    stages = [plan.get("stage", "")]
+    for key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(key), dict):
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []) or []:
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+async def explain_query_shapes(db) -> List[Dict[str, Any]]:
+    """
+    explain() every declared query shape.
+
+    Returns one result per shape: {name, collection, stages, collscan}
+    """
+    results = []
+    for shape in QUERY_SHAPES:
+        cursor = db.get_collection(shape["collection"]).find(shape["filter"], shape.get("projection"))
+        if shape.get("sort"):
+            cursor = cursor.sort(shape["sort"])
+        if shape.get("limit"):
+            cursor = cursor.limit(shape["limit"])
+
+        explanation = await cursor.explain()
+        winning_plan = explanation.get("queryPlanner", {}).get("winningPlan", {})
+        stages = _plan_stages(winning_plan)
+
+        results.append({
+            "name": shape["name"],
+            "collection": shape["collection"],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        })
+    return results
@@ -1,16 +1,56 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
 from Agents.chatbot import chat
+from Agents.tools.token_budget import load_token_encoding
 from routes.user_routes import user_router
 from routes.problem_routes import problem_router
 from routes.submission_routes import submission_router
 from routes.session_routes import router as session_router
+from CRUD.problem_crud import start_problem_cache_watcher
+from CRUD.session_crud import start_autosave_buffer, stop_autosave_buffer
+from database import lifespan as db_lifespan
+from diagram_offload import start_loop_lag_monitor, shutdown_diagram_executors
+from diagram_ingest import BodySizeLimitMiddleware, add_body_schemas
+from metrics import REGISTRY
 
 
-app = FastAPI(title="SystemDesign-io API", version="1.0.3")
+@asynccontextmanager
+async def lifespan(app):
+    async with db_lifespan(app):
+        problem_watcher = start_problem_cache_watcher()
+        start_autosave_buffer()
+        lag_monitor = start_loop_lag_monitor()
+        await asyncio.to_thread(load_token_encoding)
+        yield
+        # Buffered autosaves must reach MongoDB before the client closes
+        await stop_autosave_buffer()
+        if problem_watcher:
+            problem_watcher.cancel()
+        if lag_monitor:
+            lag_monitor.cancel()
+        shutdown_diagram_executors()
 
 
+app = FastAPI(title="SystemDesign-io API", version="1.0.3", lifespan=lifespan)
+_fastapi_openapi = app.openapi
+
+
+def openapi():
+    """FastAPI's schema plus the nested models of bodies the diagram routes read themselves"""
+    if app.openapi_schema is None:
+        app.openapi_schema = add_body_schemas(_fastapi_openapi())
+    return app.openapi_schema
+
+
+app.openapi = openapi
+
+
+# Added before CORS so that CORS wraps it and 413s stay readable by the browser
+app.add_middleware(BodySizeLimitMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -34,4 +74,19 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def readiness_check(request: Request):
+    """Ready once the lifespan warmup has pinged MongoDB and filled the pool"""
+    if not getattr(request.app.state, "db_ready", False):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Database not ready"
+        )
+    return {"status": "ready"}
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint (per worker process)"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
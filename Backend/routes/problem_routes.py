@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
 from CRUD.problem_crud import (
@@ -8,7 +8,18 @@ from CRUD.problem_crud import (
     get_problems_by_user,
     update_problem,
     delete_problem,
-    search_problems
+    search_problems,
+    count_search_results,
+    count_problems,
+    get_catalog_state
+)
+from CRUD.pagination import next_cursor
+from http_cache import (
+    PROBLEM_CACHE_CONTROL,
+    make_etag,
+    validator_headers,
+    is_not_modified,
+    not_modified
 )
 from auth import verify_access_token
 
@@ -117,9 +128,10 @@ async def create_new_problem(
 
 
 @problem_router.get("/{problem_id}")
-async def get_problem(problem_id: str):
+async def get_problem(problem_id: str, request: Request, response: Response):
     """
     Get a specific problem by ID. Public endpoint (no auth required).
+    Cacheable; revalidate with If-None-Match / If-Modified-Since for a 304.
     """
     problem = await get_problem_by_id(problem_id)
     
@@ -129,6 +141,15 @@ async def get_problem(problem_id: str):
             detail="Problem not found"
         )
 
+    headers = validator_headers(
+        make_etag("problem", problem["_id"], problem["updated_at"]),
+        problem["updated_at"],
+        PROBLEM_CACHE_CONTROL
+    )
+    if is_not_modified(request, headers["ETag"], problem["updated_at"]):
+        return not_modified(headers, "problem")
+    response.headers.update(headers)
+
     return {
         "id": problem["_id"],
         "title": problem["title"],
@@ -145,20 +166,46 @@ async def get_problem(problem_id: str):
     }
 
 
+def invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid pagination cursor"
+    )
+
+
 @problem_router.get("/")
 async def list_problems(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=100)
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
     """
     Get all problems with pagination. Public endpoint (no auth required).
+    Pass next_cursor back as cursor for constant-cost deep pages.
+    Cacheable; the ETag covers the whole catalog, so a 304 skips reading the page.
     """
-    problems = await get_all_problems(skip=skip, limit=limit)
+    # No Last-Modified: a delete changes the count but not the latest updated_at
+    total, latest = await get_catalog_state()
+    headers = validator_headers(
+        make_etag("problems", total, latest, skip, limit, cursor),
+        cache_control=PROBLEM_CACHE_CONTROL
+    )
+    if is_not_modified(request, headers["ETag"]):
+        return not_modified(headers, "problem_list")
+    response.headers.update(headers)
+
+    try:
+        problems = await get_all_problems(skip=skip, limit=limit, cursor=cursor)
+    except ValueError:
+        raise invalid_cursor()
     
     return {
-        "total": len(problems),
+        "total": total,
         "skip": skip,
         "limit": limit,
+        "next_cursor": next_cursor(problems, "created_at", limit),
         "problems": [
             {
                 "id": problem["_id"],
@@ -183,17 +230,22 @@ async def list_problems(
 async def get_my_problems(
     current_user_email: str = Depends(get_current_user_email),
     skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=100)
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
     """
     Get all problems created by the authenticated user.
     """
-    problems = await get_problems_by_user(current_user_email, skip=skip, limit=limit)
+    try:
+        problems = await get_problems_by_user(current_user_email, skip=skip, limit=limit, cursor=cursor)
+    except ValueError:
+        raise invalid_cursor()
     
     return {
-        "total": len(problems),
+        "total": await count_problems(created_by=current_user_email),
         "skip": skip,
         "limit": limit,
+        "next_cursor": next_cursor(problems, "created_at", limit),
         "problems": [
             {
                 "id": problem["_id"],
@@ -289,16 +341,25 @@ async def delete_existing_problem(
 @problem_router.get("/search/query")
 async def search_for_problems(
     q: str = Query(..., min_length=1),
+    difficulty: Optional[str] = Query(None, description='"easy" | "medium" | "hard"'),
+    categories: Optional[List[str]] = Query(None, description="Match any of these categories"),
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100)
 ):
     """
-    Search problems by title or description.
+    Full-text search over problem titles, requirements and descriptions.
+    Results are ranked by relevance; filter by difficulty and categories.
     """
-    problems = await search_problems(q, skip=skip, limit=limit)
+    problems = await search_problems(
+        q,
+        skip=skip,
+        limit=limit,
+        difficulty=difficulty,
+        categories=categories
+    )
     
     return {
-        "total": len(problems),
+        "total": await count_search_results(q, difficulty=difficulty, categories=categories),
         "query": q,
         "skip": skip,
         "limit": limit,
@@ -315,7 +376,8 @@ async def search_for_problems(
                 "hints": problem.get("hints", []),
                 "created_by": problem.get("created_by", "Unknown"),
                 "created_at": problem["created_at"].isoformat(),
-                "updated_at": problem["updated_at"].isoformat()
+                "updated_at": problem["updated_at"].isoformat(),
+                "relevance": problem.get("score")
             }
             for problem in problems
         ]
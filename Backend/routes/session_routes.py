@@ -1,17 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse
-from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Union, Set, Tuple
+from pydantic import BaseModel, Field, ValidationError
 from datetime import datetime
+import asyncio
 import json
-from auth import get_current_user
+import time
+from auth import get_current_user, verify_access_token
 from models import User
 from database import db
 from bson import ObjectId
 import CRUD.session_crud as session_crud
 import CRUD.problem_crud as problem_crud
+import CRUD.submission_crud as submission_crud
+import CRUD.chat_crud as chat_crud
+import CRUD.history_crud as history_crud
+from CRUD.pagination import next_cursor
+from CRUD.diagram_crud import retain_diagram, release_diagram, attach_diagram_record, holds_reference, hash_diagram_data, get_diagram
+from diagram_delta import element_changes
+from http_cache import make_etag, validator_headers, is_not_modified, not_modified, diagram_response, accepts_zstd
+from CRUD.projections import (
+    SESSION_FIELDS,
+    SESSION_SUMMARY_PROJECTION,
+    SUBMISSION_SUMMARY_PROJECTION,
+    PROBLEM_SUBMISSION_FIELDS,
+    parse_fields,
+    fields_projection
+)
 from Agents.checking_agent import analyze_user_solution
 from Agents.submit_agent import evaluate_submission
+from Agents.chatbot import stream_chat_reply
+from diagram_graph import diagram_graph
+from diagram_diff import diff_diagrams
+from diagram_offload import run_diagram_op, estimate_diagram_size
+from diagram_ingest import read_diagram_body, validate_body, json_body_schema
+from session_channel import (
+    CHANNEL_MAX_BACKGROUND,
+    ChannelConnection,
+    session_hub,
+    channel_messages,
+    channel_message_seconds
+)
 
 router = APIRouter(prefix="/sessions", tags=["sessions"])
 
@@ -27,10 +57,33 @@ class SessionCreate(BaseModel):
 class SessionAutosave(BaseModel):
     diagram_data: Dict[Any, Any]
     time_spent: int
+    base_version: Optional[int] = None                      # version of the last ack; enables merge on conflict
+
+class SessionDeltaAutosave(BaseModel):
+    base_hash: str                                          # diagram_hash the delta was computed against
+    time_spent: int
+    upserts: List[Dict[str, Any]] = Field(default_factory=list)  # added or changed elements (by id)
+    deletes: List[str] = Field(default_factory=list)             # removed element ids
+    app_state: Optional[Dict[str, Any]] = None              # replaces appState when given
+    files: Optional[Dict[str, Any]] = None                  # merged into files by id
+
+class SessionAck(BaseModel):
+    """Compact acknowledgement of an autosave/pause/resume (no diagram, no chat)"""
+    session_id: str
+    status: str
+    diagram_hash: str
+    time_spent: int
+    last_saved_at: datetime
+    version: int                                            # bumped by every save and status change
+    merged: bool = False                                    # a concurrent save was merged in: reload the diagram
 
 class SessionPause(BaseModel):
     time_spent: int
 
+class SessionRestore(BaseModel):
+    seq: Optional[int] = None                               # history version to restore
+    at: Optional[datetime] = None                           # or the last version saved at/before this time (UTC)
+
 class ChatMessageCreate(BaseModel):
     role: str
     content: str
@@ -75,6 +128,8 @@ class ExcalidrawExtractResponse(BaseModel):
     components: List[Dict[str, Any]]
     arrows: List[Dict[str, Any]]
     text_elements: List[Dict[str, Any]]
+    # Named topology, e.g. "API Gateway -> Auth Service"
+    edges: List[str] = []
     raw_diagram_data: Dict[Any, Any]
 
 class SessionResponse(BaseModel):
@@ -86,6 +141,7 @@ class SessionResponse(BaseModel):
     time_spent: int
     status: str
     chat_messages: List[ChatMessage]
+    message_count: int = 0
     last_saved_at: datetime
     started_at: datetime
     ended_at: Optional[datetime]
@@ -95,13 +151,16 @@ class SessionResponse(BaseModel):
     class Config:
         from_attributes = True
 
-def format_session(session: Dict[str, Any]) -> Dict[str, Any]:
-    """Format session document for response"""
-    # Ensure chat_messages contents are strings to satisfy response model
-    raw_messages = session.get("chat_messages", []) or []
+class SessionDiagramResponse(BaseModel):
+    session_id: str
+    diagram_hash: str
+    diagram_data: Dict[Any, Any]
+
+def sanitize_chat_messages(raw_messages: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Ensure chat_messages contents are strings to satisfy response model"""
     sanitized_messages: List[Dict[str, Any]] = []
 
-    for m in raw_messages:
+    for m in raw_messages or []:
         try:
             role = m.get("role", "")
             content = m.get("content", "")
@@ -122,15 +181,18 @@ def format_session(session: Dict[str, Any]) -> Dict[str, Any]:
             # Fallback: skip malformed message
             continue
 
+    return sanitized_messages
+
+def format_session_summary(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Format session document for list views (no diagram, no chat)"""
     return {
         "id": str(session["_id"]),
-        "user_id": session["user_id"],
-        "problem_id": session["problem_id"],
-        "diagram_data": session.get("diagram_data", {}),
+        "user_id": session.get("user_id"),
+        "problem_id": session.get("problem_id"),
         "diagram_hash": session.get("diagram_hash", ""),
         "time_spent": session.get("time_spent", 0),
-        "status": session["status"],
-        "chat_messages": sanitized_messages,
+        "status": session.get("status"),
+        "message_count": session.get("message_count", 0),
         "last_saved_at": session.get("last_saved_at"),
         "started_at": session.get("started_at"),
         "ended_at": session.get("ended_at"),
@@ -138,6 +200,61 @@ def format_session(session: Dict[str, Any]) -> Dict[str, Any]:
         "updated_at": session.get("updated_at")
     }
 
+def format_session(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Format session document for response"""
+    formatted = format_session_summary(session)
+    formatted["diagram_data"] = session.get("diagram_data", {})
+    formatted["chat_messages"] = sanitize_chat_messages(session.get("chat_messages"))
+    return formatted
+
+def format_session_ack(session: Dict[str, Any]) -> Dict[str, Any]:
+    """Format a compact acknowledgement"""
+    return {
+        "session_id": str(session["_id"]),
+        "status": session.get("status"),
+        "diagram_hash": session.get("diagram_hash", ""),
+        "time_spent": session.get("time_spent", 0),
+        "last_saved_at": session.get("last_saved_at"),
+        "version": session.get("version", 0),
+        "merged": session.get("merged", False)
+    }
+
+def session_validators(session: Dict[str, Any], accept_encoding: str) -> Dict[str, str]:
+    """
+    ETag/Last-Modified of a full session response. Every write bumps version
+    or updated_at; the encoding flag keeps zstd and plain bodies apart.
+    """
+    etag = make_etag(
+        "session",
+        session["_id"],
+        session.get("version", 0),
+        session.get("diagram_hash", ""),
+        session.get("updated_at"),
+        session.get("message_count", 0),
+        session.get("status"),
+        accepts_zstd(accept_encoding)
+    )
+    return validator_headers(etag, session.get("updated_at"))
+
+def format_session_fields(session: Dict[str, Any], requested: List[str]) -> Dict[str, Any]:
+    """Format only the requested sparse fieldset of a session"""
+    formatted = format_session_summary(session)
+    if "diagram_data" in requested:
+        formatted["diagram_data"] = session.get("diagram_data", {})
+    if "chat_messages" in requested:
+        formatted["chat_messages"] = sanitize_chat_messages(session.get("chat_messages"))
+    return {name: formatted.get(name) for name in requested}
+
+def parse_fields_or_400(fields: Optional[str], allowed: Dict[str, str]) -> Optional[List[str]]:
+    """Parse a fields= query value, turning unknown names into a 400"""
+    try:
+        return parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
 @router.post("/", response_model=SessionResponse, status_code=status.HTTP_201_CREATED)
 async def create_session(
     session_data: SessionCreate,
@@ -159,6 +276,7 @@ async def create_session(
         
         if existing_session:
             # Return existing session (auto-resume)
+            await session_crud.attach_recent_messages(existing_session)
             return format_session(existing_session)
         
         # Create new session
@@ -180,10 +298,15 @@ async def create_session(
 @router.get("/{session_id}", response_model=SessionResponse)
 async def get_session(
     session_id: str,
+    request: Request,
     current_user: User = Depends(get_current_user)
 ):
-    """Get session by ID"""
-    session = await session_crud.get_session_by_id(session_id)
+    """
+    Get session by ID (the diagram is spliced in from its stored bytes).
+    Revalidate with If-None-Match / If-Modified-Since: an unchanged session is
+    answered 304 before its diagram and messages are loaded.
+    """
+    session = await session_crud.get_session_by_id(session_id, with_diagram=False)
     
     if not session:
         raise HTTPException(
@@ -198,7 +321,46 @@ async def get_session(
             detail="Not authorized to access this session"
         )
     
-    return format_session(session)
+    accept_encoding = request.headers.get("accept-encoding", "")
+    headers = session_validators(session, accept_encoding)
+    if is_not_modified(request, headers["ETag"], session.get("updated_at")):
+        return not_modified(headers, "session")
+    
+    await attach_diagram_record(session)
+    await session_crud.attach_recent_messages(session)
+    envelope = format_session_summary(session)
+    envelope["chat_messages"] = sanitize_chat_messages(session.get("chat_messages"))
+    response = diagram_response(envelope, session["diagram_record"], accept_encoding)
+    response.headers.update(headers)
+    return response
+
+@router.get("/{session_id}/diagram", response_model=SessionDiagramResponse)
+async def get_session_diagram(
+    session_id: str,
+    request: Request,
+    current_user: User = Depends(get_current_user)
+):
+    """Get only the diagram of a session (list views leave it out)"""
+    session = await session_crud.get_session_diagram(session_id, decode=False)
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    # Verify ownership
+    if session["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this session"
+        )
+    
+    return diagram_response(
+        {"session_id": session_id, "diagram_hash": session.get("diagram_hash", "")},
+        session["diagram_record"],
+        request.headers.get("accept-encoding", "")
+    )
 
 @router.get("/problem/{problem_id}", response_model=Optional[SessionResponse])
 async def get_active_session_for_problem(
@@ -217,27 +379,58 @@ async def get_active_session_for_problem(
     if not session:
         return None
     
+    await session_crud.attach_recent_messages(session)
     return format_session(session)
 
-@router.put("/{session_id}/autosave", response_model=SessionResponse)
+@router.put(
+    "/{session_id}/autosave",
+    response_model=Union[SessionResponse, SessionAck],
+    openapi_extra=json_body_schema(SessionAutosave)
+)
 async def autosave_session(
     session_id: str,
-    autosave_data: SessionAutosave,
+    request: Request,
+    full: bool = Query(False, description="Return the full session instead of a compact acknowledgement"),
     current_user: User = Depends(get_current_user)
 ):
     """
     Auto-save session data (called every 10 seconds from frontend).
     
+    - Body: SessionAutosave, parsed as it streams in (see diagram_ingest)
     - Only saves if diagram data actually changed (hash comparison)
     - Always updates time_spent
     - Updates last_saved_at timestamp
+    - With AUTOSAVE_WRITE_BEHIND, repeat saves are acknowledged from the
+      worker's buffer and flushed in batches
+    - With base_version (the version of the last acknowledgement) a save that
+      races with another tab is merged per element instead of overwriting it
+      (against that version's diagram, so elements either tab deleted stay
+      deleted); the acknowledgement then has merged=true and the client
+      should reload
+    - Returns a compact acknowledgement; ?full=true returns the whole session
     """
-    session = await session_crud.autosave_session(
-        session_id=session_id,
-        diagram_data=autosave_data.diagram_data,
-        time_spent=autosave_data.time_spent,
-        user_id=current_user.id
-    )
+    autosave_data = validate_body(SessionAutosave, await read_diagram_body(request))
+    return await save_autosave(session_id, autosave_data, full, current_user)
+
+async def save_autosave(session_id: str, autosave_data: SessionAutosave, full: bool, current_user: User):
+    """Full autosave shared by the HTTP route and the live channel"""
+    try:
+        session = await session_crud.autosave_session(
+            session_id=session_id,
+            diagram_data=autosave_data.diagram_data,
+            time_spent=autosave_data.time_spent,
+            user_id=current_user.id,
+            full=full,
+            expected_version=autosave_data.base_version
+        )
+    except session_crud.DiagramConflict as conflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Session is being saved concurrently; retry",
+                "diagram_hash": conflict.current_hash
+            }
+        )
     
     if not session:
         raise HTTPException(
@@ -245,22 +438,75 @@ async def autosave_session(
             detail="Session not found or access denied"
         )
     
+    if not full:
+        return format_session_ack(session)
     return format_session(session)
 
-@router.put("/{session_id}/pause", response_model=SessionResponse)
+@router.put("/{session_id}/autosave/delta", response_model=SessionAck)
+async def delta_autosave_session(
+    session_id: str,
+    delta: SessionDeltaAutosave,
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Auto-save only the elements changed since base_hash.
+    
+    - upserts replace elements with the same id in place and append new ones
+    - deletes removes elements by id
+    - 409 with the current diagram_hash when base_hash is stale: the client
+      must resync with a full PUT /autosave
+    - returns the new diagram_hash to use as the next base
+    """
+    try:
+        session = await session_crud.delta_autosave_session(
+            session_id=session_id,
+            user_id=current_user.id,
+            base_hash=delta.base_hash,
+            time_spent=delta.time_spent,
+            upserts=delta.upserts,
+            deletes=delta.deletes,
+            app_state=delta.app_state,
+            files=delta.files
+        )
+    except session_crud.DiagramConflict as conflict:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                "message": "Diagram changed since base_hash; resync with a full autosave",
+                "diagram_hash": conflict.current_hash
+            }
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found or access denied"
+        )
+    
+    return format_session_ack(session)
+
+@router.put("/{session_id}/pause", response_model=Union[SessionResponse, SessionAck])
 async def pause_session(
     session_id: str,
     pause_data: SessionPause,
+    full: bool = Query(False, description="Return the full session instead of a compact acknowledgement"),
     current_user: User = Depends(get_current_user)
 ):
     """
     Pause a session (user navigates away from practice page).
     Updates time_spent and sets status to 'paused'.
+    Returns a compact acknowledgement; ?full=true returns the whole session.
     """
     session = await session_crud.pause_session(
         session_id=session_id,
         user_id=current_user.id,
-        time_spent=pause_data.time_spent
+        time_spent=pause_data.time_spent,
+        full=full
     )
     
     if not session:
@@ -269,20 +515,25 @@ async def pause_session(
             detail="Session not found or access denied"
         )
     
+    if not full:
+        return format_session_ack(session)
     return format_session(session)
 
-@router.put("/{session_id}/resume", response_model=SessionResponse)
+@router.put("/{session_id}/resume", response_model=Union[SessionResponse, SessionAck])
 async def resume_session(
     session_id: str,
+    full: bool = Query(False, description="Return the full session instead of a compact acknowledgement"),
     current_user: User = Depends(get_current_user)
 ):
     """
     Resume a paused session.
     Sets status back to 'active'.
+    Returns a compact acknowledgement; ?full=true returns the whole session.
     """
     session = await session_crud.resume_session(
         session_id=session_id,
-        user_id=current_user.id
+        user_id=current_user.id,
+        full=full
     )
     
     if not session:
@@ -291,6 +542,8 @@ async def resume_session(
             detail="Session not found or access denied"
         )
     
+    if not full:
+        return format_session_ack(session)
     return format_session(session)
 
 @router.post("/{session_id}/chat", response_model=SessionResponse)
@@ -302,6 +555,8 @@ async def add_chat_message(
     """
     Add a chat message to the session.
     Used during practice for AI assistance.
+    The response carries the latest messages; page further back with
+    GET /sessions/{id}/messages.
     """
     session = await session_crud.add_chat_message_to_session(
         session_id=session_id,
@@ -316,6 +571,278 @@ async def add_chat_message(
             detail="Session not found or access denied"
         )
     
+    await session_crud.attach_recent_messages(session)
+    return format_session(session)
+
+@router.get("/{session_id}/messages")
+async def get_session_messages(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Page through a session's chat, newest page first.
+    Messages within a page are in chronological order; pass next_cursor back
+    as cursor to load the page before it.
+    """
+    session = await session_crud.get_session_by_id(session_id, with_diagram=False)
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    # Verify ownership
+    if session["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this session"
+        )
+    
+    try:
+        messages = await chat_crud.get_messages(session_id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+    
+    page_cursor = next_cursor(messages, "timestamp", limit)
+    messages.reverse()
+    
+    return {
+        "session_id": session_id,
+        "message_count": session.get("message_count", 0),
+        "limit": limit,
+        "next_cursor": page_cursor,
+        "messages": sanitize_chat_messages(messages)
+    }
+
+async def get_owned_session(session_id: str, current_user: User) -> Dict[str, Any]:
+    """Session document without its diagram, or 404/403"""
+    session = await session_crud.get_session_by_id(session_id, with_diagram=False)
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found"
+        )
+    
+    # Verify ownership
+    if session["user_id"] != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not authorized to access this session"
+        )
+    return session
+
+def format_history_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "seq": entry["seq"],
+        "kind": entry["kind"],
+        "diagram_hash": entry["diagram_hash"],
+        "saved_at": entry["saved_at"],
+        "changed": entry.get("changed", 0)
+    }
+
+@router.get("/{session_id}/history")
+async def get_session_history(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Page through the saved versions of a session's diagram, newest first.
+    changed is the number of elements touched (all elements for snapshots).
+    """
+    await get_owned_session(session_id, current_user)
+    
+    try:
+        entries = await history_crud.get_history(session_id, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
+    
+    return {
+        "session_id": session_id,
+        "limit": limit,
+        "next_cursor": next_cursor(entries, "saved_at", limit),
+        "entries": [format_history_entry(entry) for entry in entries]
+    }
+
+@router.get("/{session_id}/history/diff")
+async def diff_session_versions(
+    session_id: str,
+    from_seq: Optional[int] = Query(None, description="Defaults to the version of the latest /check"),
+    to_seq: Optional[int] = Query(None, description="Defaults to the latest version (the submitted one after submit)"),
+    current_user: User = Depends(get_current_user)
+):
+    """Element ids added, removed and changed between two versions of a session's diagram"""
+    await get_owned_session(session_id, current_user)
+    
+    if from_seq is None:
+        checked_hash = await chat_crud.get_latest_check_hash(session_id)
+        checked = await history_crud.get_entry_for_hash(session_id, checked_hash) if checked_hash else None
+        if not checked:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="No checked version in this session's history"
+            )
+        from_seq = checked["seq"]
+    if to_seq is None:
+        latest = await history_crud.get_latest_entry(session_id)
+        to_seq = latest["seq"] if latest else from_seq
+    
+    before = await history_crud.get_diagram_at(session_id, from_seq)
+    after = await history_crud.get_diagram_at(session_id, to_seq)
+    if not before or not after:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Version not found in history"
+        )
+    
+    return {
+        "session_id": session_id,
+        "from": format_history_entry(before[0]),
+        "to": format_history_entry(after[0]),
+        **element_changes(before[1], after[1])
+    }
+
+DIAGRAM_VERSION_PATTERN = "^(current|check|submission|[0-9]+)$"
+
+async def load_session_version(
+    session_id: str,
+    session: Dict[str, Any],
+    version: str
+) -> Tuple[Dict[str, Any], Dict[str, Any], Optional[str]]:
+    """
+    (description, diagram, diagram_hash) of one version of a session's diagram:
+    current, the one the latest /check ran on, the submitted one, or a history seq
+    """
+    current_hash = session.get("diagram_hash") if holds_reference(session) else None
+    diagram = diagram_hash = None
+    load_current = version == "current"
+    
+    if version == "check":
+        diagram_hash = await chat_crud.get_latest_check_hash(session_id)
+        if diagram_hash and diagram_hash == current_hash:
+            load_current = True
+        elif diagram_hash:
+            diagram = await get_diagram(diagram_hash)
+            if diagram is None:
+                # Released from the store; rebuild it from the history
+                checked = await history_crud.get_entry_for_hash(session_id, diagram_hash)
+                rebuilt = await history_crud.get_diagram_at(session_id, checked["seq"]) if checked else None
+                diagram = rebuilt[1] if rebuilt else None
+    elif version == "submission":
+        submission = await submission_crud.get_session_submission(
+            session["user_id"], session["problem_id"], session_id
+        )
+        if submission:
+            diagram = submission.get("diagram_data")
+            diagram_hash = submission["diagram_hash"] if holds_reference(submission) else None
+    elif not load_current:
+        rebuilt = await history_crud.get_diagram_at(session_id, int(version))
+        if rebuilt:
+            diagram, diagram_hash = rebuilt[1], rebuilt[0]["diagram_hash"]
+    
+    if load_current:
+        diagram_hash = current_hash
+        if "diagram_data" in session:
+            # Embedded (legacy) diagram, or an autosave not flushed yet
+            diagram = session["diagram_data"] or {}
+        elif current_hash:
+            diagram = await get_diagram(current_hash)
+        else:
+            diagram = {}
+    
+    if diagram is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No {version} version of this session's diagram"
+        )
+    return {"version": version, "diagram_hash": diagram_hash}, diagram, diagram_hash
+
+@router.get("/{session_id}/diagram/diff")
+async def diff_session_diagram(
+    session_id: str,
+    base: str = Query("check", pattern=DIAGRAM_VERSION_PATTERN, description="current, check, submission or a history seq"),
+    target: str = Query("current", pattern=DIAGRAM_VERSION_PATTERN, description="current, check, submission or a history seq"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Structural changes between two versions of a session's diagram: components
+    and connections added, removed, relabeled or rewired, and free text changed.
+    Defaults to what changed since the latest /check.
+    """
+    session = await get_owned_session(session_id, current_user)
+    
+    base_info, before, before_hash = await load_session_version(session_id, session, base)
+    target_info, after, after_hash = await load_session_version(session_id, session, target)
+    
+    changes = await run_diagram_op(
+        "diff", estimate_diagram_size(before) + estimate_diagram_size(after),
+        diff_diagrams, before, after, before_hash, after_hash
+    )
+    return {"session_id": session_id, "base": base_info, "target": target_info, **changes}
+
+@router.get("/{session_id}/history/{seq}")
+async def get_session_version(
+    session_id: str,
+    seq: int,
+    current_user: User = Depends(get_current_user)
+):
+    """The session's diagram as of version seq (rebuilt from a snapshot plus deltas)"""
+    await get_owned_session(session_id, current_user)
+    
+    rebuilt = await history_crud.get_diagram_at(session_id, seq)
+    if not rebuilt:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Version not found in history"
+        )
+    
+    entry, diagram = rebuilt
+    return {"session_id": session_id, **format_history_entry(entry), "diagram_data": diagram}
+
+@router.post("/{session_id}/history/restore", response_model=Union[SessionResponse, SessionAck])
+async def restore_session_version(
+    session_id: str,
+    restore: SessionRestore,
+    full: bool = Query(False, description="Return the full session instead of a compact acknowledgement"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Make a past version current again, by seq or by time ("10 minutes ago").
+    The restore is saved as a new version, so it can itself be undone.
+    """
+    if restore.seq is None and restore.at is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Give seq or at"
+        )
+    
+    session = await session_crud.restore_session_version(
+        session_id=session_id,
+        user_id=current_user.id,
+        seq=restore.seq,
+        at=restore.at,
+        full=full
+    )
+    
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session or version not found, or access denied"
+        )
+    
+    if not full:
+        return format_session_ack(session)
     return format_session(session)
 
 @router.delete("/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -389,49 +916,19 @@ async def extract_excalidraw_data(
             raw_diagram_data=diagram_data
         )
     
-    # Extract and categorize elements
-    elements = diagram_data.get("elements", [])
-    components = []
-    arrows = []
-    text_elements = []
-    
-    for elem in elements:
-        if not isinstance(elem, dict):
-            continue
-        
-        # Extract required fields
-        extracted = {
-            "id": elem.get("id", ""),
-            "type": elem.get("type", ""),
-            "text": elem.get("text", ""),
-            "groupIds": elem.get("groupIds", []),
-            "boundElements": elem.get("boundElements", [])
-        }
-        
-        # Categorize by type
-        elem_type = elem.get("type", "")
-        
-        if elem_type == "arrow":
-            # Add arrow-specific fields
-            extracted["startBinding"] = elem.get("startBinding", {})
-            extracted["endBinding"] = elem.get("endBinding", {})
-            arrows.append(extracted)
-        elif elem_type == "text":
-            text_elements.append(extracted)
-        elif elem_type in ["rectangle", "ellipse", "diamond"]:
-            components.append(extracted)
-        else:
-            # Other shapes also count as components
-            components.append(extracted)
+    # Categorized by the (memoized) diagram graph
+    graph = await run_diagram_op(
+        "extract", estimate_diagram_size(diagram_data), diagram_graph, diagram_data,
+        session["diagram_hash"] if holds_reference(session) else None
+    )
     
     return ExcalidrawExtractResponse(
         session_id=session_id,
         problem_id=session.get("problem_id", ""),
-        total_elements=len(elements),
-        components=components,
-        arrows=arrows,
-        text_elements=text_elements,
-        raw_diagram_data=diagram_data
+        total_elements=graph.total,
+        edges=graph.edge_list(),
+        raw_diagram_data=diagram_data,
+        **graph.as_dicts()
     )
 
 @router.post("/{session_id}/check", response_model=CheckFeedbackResponse)
@@ -444,7 +941,7 @@ async def check_solution(
     
     - Analyzes Excalidraw diagram against question requirements
     - Uses hash-based caching: returns cached feedback if diagram unchanged
-    - Saves feedback to session's chat_messages as assistant message
+    - Saves feedback to the session's chat as a system_check message
     - Returns: what's implemented, what's missing, next steps
     """
     # Get session
@@ -463,32 +960,25 @@ async def check_solution(
             detail="Not authorized to access this session"
         )
     
-    # Compute current diagram hash from stored diagram_data (ensure we use the
-    # actual diagram the user has, rather than relying on an older session field)
-    diagram_data = session.get("diagram_data", {})
-    try:
-        current_hash = session_crud.calculate_diagram_hash(diagram_data)
-    except Exception:
-        # Fallback to stored hash if calculation fails
-        current_hash = session.get("diagram_hash", "")
+    # Sessions using the diagram store keep diagram_hash in step with the
+    # diagram. Older sessions embedding diagram_data could carry a stale hash,
+    # so only those are rehashed.
+    if holds_reference(session):
+        current_hash = session["diagram_hash"]
+    else:
+        current_hash = await hash_diagram_data(session.get("diagram_data", {}))
     
-    # Check if we have cached feedback for this exact diagram
-    # Look for last assistant message with role="system_check"
-    chat_messages = session.get("chat_messages", [])
+    # Check if we have cached feedback for this exact diagram: the latest
+    # system_check message tagged with its hash (an indexed lookup)
     cached_feedback = None
-    
-    for msg in reversed(chat_messages):
-        if msg.get("role") == "system_check":
-            # Check if this feedback was for the same diagram version
-            if msg.get("diagram_hash") == current_hash:
-                cached_feedback_str = msg.get("content", "")
-                try:
-                    # Parse JSON string back to dict
-                    cached_feedback = json.loads(cached_feedback_str)
-                except (json.JSONDecodeError, TypeError):
-                    # If parsing fails, skip this cached entry
-                    continue
-                break
+    cached_message = await chat_crud.find_check_feedback(session_id, current_hash)
+    if cached_message:
+        try:
+            # Parse JSON string back to dict
+            cached_feedback = json.loads(cached_message.get("content", ""))
+        except (json.JSONDecodeError, TypeError):
+            # Unreadable cache entry: run the check again
+            cached_feedback = None
     
     # If diagram unchanged and we have feedback, return cached
     if cached_feedback:
@@ -529,7 +1019,8 @@ async def check_solution(
     try:
         feedback = await analyze_user_solution(
             problem_data=problem_data,
-            diagram_data=diagram_data
+            diagram_data=diagram_data,
+            diagram_hash=current_hash
         )
     except Exception as e:
         raise HTTPException(
@@ -537,40 +1028,17 @@ async def check_solution(
             detail=f"AI analysis failed: {str(e)}"
         )
     
-    # Save feedback to session's chat_messages with special role
-    # Store as JSON string to maintain compatibility with chat_messages schema
+    # Save feedback to the session's chat with special role, tagged with
+    # the diagram_hash so future checks can find it.
+    # Store as JSON string to maintain compatibility with the message schema
     await session_crud.add_chat_message_to_session(
         session_id=session_id,
         user_id=current_user.id,
-        role="system_check",
-        content=json.dumps(feedback)  # Convert dict to JSON string
-    )
-
-    # Update the session's stored diagram_hash and attach diagram_hash to the
-    # appended chat message so future checks can quickly find cached feedback.
-    from database import db
-    sessions_collection = db.get_collection("sessions")
-
-    # Update session-level diagram_hash (useful for other flows)
-    await sessions_collection.update_one(
-        {"_id": session["_id"]},
-        {"$set": {
-            "diagram_hash": current_hash,
-            "updated_at": datetime.utcnow()
-        }}
+        role=chat_crud.CHECK_ROLE,
+        content=json.dumps(feedback),  # Convert dict to JSON string
+        diagram_hash=current_hash,
+        with_diagram=False
     )
-
-    # Attach diagram_hash to the newly appended chat message. We compute the
-    # index as the current length of chat_messages (before append) which is
-    # stored in chat_messages variable earlier.
-    try:
-        await sessions_collection.update_one(
-            {"_id": session["_id"]},
-            {"$set": {f"chat_messages.{len(chat_messages)}.diagram_hash": current_hash}}
-        )
-    except Exception:
-        # Non-critical: if this fails, it's ok — caching will still work next time
-        pass
     
     return CheckFeedbackResponse(
         session_id=session_id,
@@ -581,22 +1049,59 @@ async def check_solution(
         cached=False
     )
 
-@router.get("/user/my-sessions", response_model=List[SessionResponse])
+@router.get("/user/my-sessions")
 async def get_my_sessions(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = Query(None, description="Comma-separated sparse fieldset, e.g. id,problem_id,status"),
     current_user: User = Depends(get_current_user)
 ):
     """
     Get all sessions for the current user.
     Includes active, paused, submitted, and abandoned sessions.
+    
+    - view=summary leaves diagram_data and chat_messages out (fetch a diagram
+      with GET /sessions/{id}/diagram)
+    - chat lives in its own collection: page it with GET /sessions/{id}/messages
+    - fields=a,b,c returns only those fields (overrides view)
+    - the body stays a plain list; X-Total-Count and X-Next-Cursor headers
+      carry the real total and the keyset cursor for the next page
     """
-    sessions = await session_crud.get_sessions_by_user(
-        user_id=current_user.id,
-        skip=skip,
-        limit=limit
-    )
+    requested = parse_fields_or_400(fields, SESSION_FIELDS)
+    
+    if requested:
+        projection = fields_projection(requested, SESSION_FIELDS)
+    elif view == "summary":
+        projection = SESSION_SUMMARY_PROJECTION
+    else:
+        projection = None
+    
+    try:
+        sessions = await session_crud.get_sessions_by_user(
+            user_id=current_user.id,
+            skip=skip,
+            limit=limit,
+            projection=projection,
+            cursor=cursor
+        )
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
     
+    response.headers["X-Total-Count"] = str(await session_crud.count_sessions_by_user(current_user.id))
+    page_cursor = next_cursor(sessions, "created_at", limit)
+    if page_cursor:
+        response.headers["X-Next-Cursor"] = page_cursor
+    
+    if requested:
+        return [format_session_fields(session, requested) for session in sessions]
+    if view == "summary":
+        return [format_session_summary(session) for session in sessions]
     return [format_session(session) for session in sessions]
 
 @router.post("/{session_id}/submit", response_model=SubmitResponse)
@@ -670,11 +1175,17 @@ async def submit_solution(
             detail="Cannot submit empty diagram. Please draw your solution first."
         )
     
+    if holds_reference(session):
+        diagram_hash = session["diagram_hash"]
+    else:
+        diagram_hash = await hash_diagram_data(diagram_data)
+    
     # Run submission evaluation
     try:
         evaluation = await evaluate_submission(
             problem_data=problem_data,
-            diagram_data=diagram_data
+            diagram_data=diagram_data,
+            diagram_hash=diagram_hash
         )
     except Exception as e:
         raise HTTPException(
@@ -682,15 +1193,19 @@ async def submit_solution(
             detail=f"Submission evaluation failed: {str(e)}"
         )
     
-    # Create submission record in database
+    # Create submission record in database; the diagram is shared with the
+    # session through the content-addressed store, so this only adds a reference
     from database import db
     submissions_collection = db.get_collection("submissions")
     
+    await retain_diagram(diagram_hash, diagram_data)
+    
     submission_doc = {
         "user_id": current_user.id,
         "problem_id": session["problem_id"],
         "session_id": session_id,
-        "diagram_data": diagram_data,
+        "diagram_hash": diagram_hash,
+        "diagram_stored": True,
         "score": evaluation["score"],
         "max_score": evaluation["max_score"],
         "breakdown": evaluation["breakdown"],
@@ -704,7 +1219,12 @@ async def submit_solution(
         "updated_at": datetime.utcnow()
     }
     
-    result = await submissions_collection.insert_one(submission_doc)
+    try:
+        result = await submissions_collection.insert_one(submission_doc)
+    except Exception:
+        # Don't leak the reference taken above
+        await release_diagram(diagram_hash)
+        raise
     submission_id = str(result.inserted_id)
     
     # Update session status to 'submitted'
@@ -731,31 +1251,298 @@ async def submit_solution(
 @router.get("/problem/{problem_id}/submissions")
 async def get_problem_submissions(
     problem_id: str,
+    view: str = Query("full", pattern="^(full|summary)$"),
+    fields: Optional[str] = Query(None, description="Comma-separated sparse fieldset, e.g. submission_id,score"),
     current_user: User = Depends(get_current_user)
 ):
     """
     Get all submissions for a specific problem by the current user.
     Used to show previous solutions in the Solutions tab.
+    
+    - view=summary leaves diagram_data out (fetch a diagram with
+      GET /submissions/{id}/diagram)
+    - fields=a,b,c returns only those fields (overrides view)
     """
-    from database import db
-    submissions_collection = db.get_collection("submissions")
+    requested = parse_fields_or_400(fields, PROBLEM_SUBMISSION_FIELDS)
     
-    # Find all submissions for this problem by this user
-    cursor = submissions_collection.find({
-        "user_id": current_user.id,
-        "problem_id": problem_id
-    }).sort("submitted_at", -1)  # Most recent first
+    if requested:
+        projection = fields_projection(requested, PROBLEM_SUBMISSION_FIELDS)
+    elif view == "summary":
+        projection = SUBMISSION_SUMMARY_PROJECTION
+    else:
+        projection = None
+    
+    # Most recent first
+    docs = await submission_crud.get_user_problem_submissions(
+        current_user.id,
+        problem_id,
+        projection=projection
+    )
     
     submissions = []
-    async for doc in cursor:
-        submissions.append({
+    for doc in docs:
+        item = {
             "submission_id": str(doc["_id"]),
             "session_id": doc.get("session_id"),
             "score": doc.get("score", 0),
             "max_score": doc.get("max_score", 100),
-            "diagram_data": doc.get("diagram_data", {}),
             "submitted_at": doc.get("submitted_at"),
             "time_spent": doc.get("time_spent", 0)
-        })
+        }
+        if view == "full" or (requested and "diagram_data" in requested):
+            item["diagram_data"] = doc.get("diagram_data", {})
+        if requested:
+            item = {name: item.get(name) for name in requested}
+        submissions.append(item)
     
     return submissions
+
+@router.get("/problem/{problem_id}/submissions/diff")
+async def diff_problem_submissions(
+    problem_id: str,
+    from_submission: Optional[str] = Query(None, description="Defaults to the attempt before the latest"),
+    to_submission: Optional[str] = Query(None, description="Defaults to the latest attempt"),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Structural changes between two of the current user's attempts at a problem
+    (components and connections added, removed, relabeled or rewired).
+    """
+    if from_submission is None or to_submission is None:
+        # Most recent first; ids only, the two diagrams are loaded below
+        attempts = await submission_crud.get_user_problem_submissions(
+            current_user.id, problem_id, projection={"_id": 1}
+        )
+        ids = [str(doc["_id"]) for doc in attempts]
+        if to_submission is None:
+            to_submission = ids[0] if ids else None
+        if from_submission is None:
+            older = ids[ids.index(to_submission) + 1:] if to_submission in ids else []
+            from_submission = older[0] if older else None
+        if not from_submission or not to_submission:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Fewer than two submissions to compare"
+            )
+    
+    versions = []
+    for submission_id in (from_submission, to_submission):
+        submission = await submission_crud.get_submission_diagram(submission_id)
+        if (
+            not submission
+            or submission.get("user_id") != current_user.id
+            or submission.get("problem_id") != problem_id
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Submission {submission_id} not found"
+            )
+        versions.append(submission)
+    before, after = versions
+    
+    changes = await run_diagram_op(
+        "diff",
+        estimate_diagram_size(before.get("diagram_data")) + estimate_diagram_size(after.get("diagram_data")),
+        diff_diagrams,
+        before.get("diagram_data"),
+        after.get("diagram_data"),
+        before.get("diagram_hash") if holds_reference(before) else None,
+        after.get("diagram_hash") if holds_reference(after) else None
+    )
+    return {"problem_id": problem_id, "from": from_submission, "to": to_submission, **changes}
+
+# ---------- Live session channel (protocol in session_channel.py) ----------
+
+async def _channel_autosave(session: Dict[str, Any], user: User, connection: ChannelConnection, frame: Dict[str, Any]):
+    """Full ("diagram_data") or delta autosave; other tabs get the result (and the delta to apply)"""
+    session_id = str(session["_id"])
+    fields = {k: v for k, v in frame.items() if k not in ("type", "id")}
+    if "diagram_data" in fields:
+        ack = await save_autosave(session_id, SessionAutosave(**fields), False, user)
+        saved = {"type": "saved", **ack}
+    else:
+        delta = SessionDeltaAutosave(**fields)
+        ack = await delta_autosave_session(session_id, delta, current_user=user)
+        saved = {
+            "type": "saved",
+            **ack,
+            "delta": {
+                "base_hash": delta.base_hash,
+                "upserts": delta.upserts,
+                "deletes": delta.deletes,
+                "app_state": delta.app_state,
+                "files": delta.files
+            }
+        }
+    await connection.send({"type": "ack", "id": frame.get("id"), **ack})
+    await session_hub.publish(session_id, saved, exclude=connection)
+
+async def _channel_heartbeat(session: Dict[str, Any], user: User, connection: ChannelConnection, frame: Dict[str, Any]):
+    """time_spent only: no diagram is hashed, read or written"""
+    updated = await session_crud.record_heartbeat(str(session["_id"]), user.id, int(frame.get("time_spent")))
+    if not updated:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session not found or access denied"
+        )
+    await connection.send({
+        "type": "ack",
+        "id": frame.get("id"),
+        "time_spent": updated["time_spent"],
+        "status": updated["status"]
+    })
+
+async def _channel_chat(session: Dict[str, Any], user: User, connection: ChannelConnection, frame: Dict[str, Any]):
+    """Stream the AI reply as chat_chunk frames; other tabs get the question and the full answer"""
+    session_id = str(session["_id"])
+    message = frame.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="message must be a non-empty string"
+        )
+    
+    problem = await problem_crud.get_problem_by_id(session["problem_id"])
+    if not problem:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Problem not found"
+        )
+    
+    diagram_data = frame.get("diagram_data")
+    diagram_hash = None
+    if diagram_data is None:
+        stored = await session_crud.get_session_diagram(session_id)
+        diagram_data = (stored or {}).get("diagram_data") or {}
+        if holds_reference(stored):
+            diagram_hash = stored["diagram_hash"]
+    
+    await session_hub.publish(session_id, {"type": "chat_message", "role": "user", "content": message}, exclude=connection)
+    reply = []
+    async for chunk in stream_chat_reply(session_id, problem, diagram_data, message, diagram_hash):
+        reply.append(chunk)
+        await connection.send({"type": "chat_chunk", "id": frame.get("id"), "content": chunk})
+    await connection.send({"type": "chat_done", "id": frame.get("id")})
+    await session_hub.publish(
+        session_id,
+        {"type": "chat_message", "role": "assistant", "content": "".join(reply)},
+        exclude=connection
+    )
+
+async def _channel_check(session: Dict[str, Any], user: User, connection: ChannelConnection, frame: Dict[str, Any]):
+    """Same as POST /check; the result goes to every tab"""
+    session_id = str(session["_id"])
+    result = jsonable_encoder(await check_solution(session_id, current_user=user))
+    await connection.send({"type": "check_result", "id": frame.get("id"), **result})
+    await session_hub.publish(session_id, {"type": "check_result", **result}, exclude=connection)
+
+CHANNEL_HANDLERS = {
+    "autosave": _channel_autosave,
+    "heartbeat": _channel_heartbeat,
+    "chat": _channel_chat,
+    "check": _channel_check,
+}
+# Slow frames run in the background so autosaves and heartbeats keep flowing
+CHANNEL_BACKGROUND = {"chat", "check"}
+
+async def _handle_frame(session: Dict[str, Any], user: User, connection: ChannelConnection, frame: Dict[str, Any]):
+    kind = frame.get("type")
+    handler = CHANNEL_HANDLERS.get(kind)
+    labels = {"type": kind if handler else "unknown"}
+    channel_messages.inc(labels=labels)
+    started = time.perf_counter()
+    error = None
+    try:
+        if handler is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown frame type: {kind}"
+            )
+        await handler(session, user, connection, frame)
+    except HTTPException as e:
+        error = (e.status_code, e.detail)
+    except ValidationError as e:
+        error = (status.HTTP_422_UNPROCESSABLE_ENTITY, jsonable_encoder(e.errors()))
+    except (TypeError, ValueError) as e:
+        error = (status.HTTP_422_UNPROCESSABLE_ENTITY, str(e))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"WARNING: session channel {kind} frame failed: {e}")
+        error = (status.HTTP_500_INTERNAL_SERVER_ERROR, "Internal error")
+    finally:
+        channel_message_seconds.observe(time.perf_counter() - started, labels=labels)
+    
+    if error:
+        try:
+            await connection.send({"type": "error", "id": frame.get("id"), "code": error[0], "detail": error[1]})
+        except Exception:
+            pass  # the socket is gone; the receive loop ends on its own
+
+@router.websocket("/{session_id}/ws")
+async def session_channel(
+    websocket: WebSocket,
+    session_id: str,
+    token: Optional[str] = Query(None, description="Access token (browsers cannot set headers on WebSockets)")
+):
+    """
+    Live channel for one practice tab: autosave, heartbeat, chat and check
+    over one connection, with other tabs of the session kept in sync.
+    The token (or an Authorization: Bearer header) and ownership are checked
+    once here; the socket is closed with 1008 when they fail or the token
+    expires.
+    """
+    if not token:
+        authorization = websocket.headers.get("authorization", "")
+        if authorization.lower().startswith("bearer "):
+            token = authorization[7:]
+    try:
+        token_data = verify_access_token(token or "")
+        current_user = await get_current_user(token_data)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    session = await session_crud.get_session_by_id(session_id, with_diagram=False)
+    if not session or session["user_id"] != current_user.id:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    
+    await websocket.accept()
+    connection = ChannelConnection(websocket, current_user.id, token_data.get("exp"))
+    session_hub.join(session_id, connection)
+    background: Set[asyncio.Task] = set()
+    try:
+        while True:
+            text = await websocket.receive_text()
+            if connection.expired():
+                await connection.send({"type": "error", "code": 401, "detail": "Token expired. Please login again."})
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                break
+            
+            try:
+                frame = json.loads(text)
+            except json.JSONDecodeError:
+                frame = None
+            if not isinstance(frame, dict):
+                await connection.send({"type": "error", "code": 400, "detail": "Frames must be JSON objects"})
+                continue
+            
+            if frame.get("type") in CHANNEL_BACKGROUND:
+                if len(background) >= CHANNEL_MAX_BACKGROUND:
+                    await connection.send({
+                        "type": "error", "id": frame.get("id"), "code": 429,
+                        "detail": "Too many chat/check requests in progress"
+                    })
+                    continue
+                task = asyncio.create_task(_handle_frame(session, current_user, connection, frame))
+                background.add(task)
+                task.add_done_callback(background.discard)
+            else:
+                await _handle_frame(session, current_user, connection, frame)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session_hub.leave(session_id, connection)
+        for task in background:
+            task.cancel()
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
 from pydantic import BaseModel
 from typing import Optional, List
 from CRUD.submission_crud import (
     create_submission,
     get_submission_by_id,
+    get_submission_diagram,
     get_submissions_by_user,
+    count_submissions_by_user,
     get_submissions_by_problem,
     get_user_submission_for_problem,
     update_submission,
@@ -12,8 +14,13 @@ from CRUD.submission_crud import (
     delete_submission
 )
 from CRUD.session_crud import get_session_by_id, mark_session_submitted
+from CRUD.chat_crud import get_all_messages
+from CRUD.diagram_crud import holds_reference, hydrate_diagram
 import CRUD.problem_crud as problem_crud
+from CRUD.pagination import next_cursor
+from http_cache import make_etag, validator_headers, is_not_modified, not_modified, diagram_response
 from auth import verify_access_token
+from diagram_ingest import read_diagram_body, validate_body, json_body_schema
 
 submission_router = APIRouter(prefix="/submissions", tags=["Submissions"])
 
@@ -82,14 +89,16 @@ async def get_current_user_email(token_data: dict = Depends(verify_access_token)
 
 # ---------- Routes ----------
 
-@submission_router.post("/", status_code=status.HTTP_201_CREATED)
+@submission_router.post("/", status_code=status.HTTP_201_CREATED, openapi_extra=json_body_schema(SubmissionCreate))
 async def create_new_submission(
-    payload: SubmissionCreate,
+    request: Request,
     current_user_email: str = Depends(get_current_user_email)
 ):
     """
     Create a new submission. Requires authentication.
+    The SubmissionCreate body is parsed as it streams in (see diagram_ingest).
     """
+    payload = validate_body(SubmissionCreate, await read_diagram_body(request))
     submission = await create_submission(
         user_id=current_user_email,
         problem_id=payload.problem_id,
@@ -157,12 +166,23 @@ async def create_submission_from_session(
             detail="Session already submitted"
         )
     
-    # Create submission from session data
+    # Snapshot the whole conversation (still-embedded messages first)
+    chat_messages = (session.get("chat_messages") or []) + await get_all_messages(session_id)
+    
+    # Create submission from session data (time and chat copied in the same insert)
     submission = await create_submission(
         user_id=session["user_id"],
         problem_id=session["problem_id"],
         diagram_data=session.get("diagram_data", {}),
-        status="completed"
+        status="completed",
+        time_spent=session.get("time_spent", 0),
+        chat_messages=[
+            {"role": m.get("role"), "content": m.get("content", ""), "timestamp": m.get("timestamp")}
+            for m in chat_messages
+        ],
+        # Already hashed and stored for the session: just share it
+        diagram_hash=session["diagram_hash"] if holds_reference(session) else None,
+        session_id=session_id
     )
     
     if not submission:
@@ -171,40 +191,23 @@ async def create_submission_from_session(
             detail="Failed to create submission"
         )
     
-    # Copy session data to submission
-    from datetime import datetime
-    from database import db
-    submissions_collection = db.get_collection("submissions")
-    
-    await submissions_collection.update_one(
-        {"_id": submission["_id"]},
-        {"$set": {
-            "time_spent": session.get("time_spent", 0),
-            "chat_messages": session.get("chat_messages", []),
-            "updated_at": datetime.utcnow()
-        }}
-    )
-    
     # Mark session as submitted
     await mark_session_submitted(session_id, current_user_email)
     
-    # Fetch updated submission
-    updated_submission = await get_submission_by_id(str(submission["_id"]))
-    
     return {
         "message": "Submission created from session successfully",
         "submission": {
-            "id": str(updated_submission["_id"]),
-            "user_id": updated_submission["user_id"],
-            "problem_id": updated_submission["problem_id"],
-            "diagram_data": updated_submission["diagram_data"],
-            "score": updated_submission["score"],
-            "time_spent": updated_submission["time_spent"],
-            "status": updated_submission["status"],
-            "feedback": updated_submission["feedback"],
-            "chat_messages": updated_submission["chat_messages"],
-            "submitted_at": updated_submission["submitted_at"].isoformat(),
-            "updated_at": updated_submission["updated_at"].isoformat()
+            "id": str(submission["_id"]),
+            "user_id": submission["user_id"],
+            "problem_id": submission["problem_id"],
+            "diagram_data": submission["diagram_data"],
+            "score": submission["score"],
+            "time_spent": submission["time_spent"],
+            "status": submission["status"],
+            "feedback": submission["feedback"],
+            "chat_messages": submission["chat_messages"],
+            "submitted_at": submission["submitted_at"].isoformat(),
+            "updated_at": submission["updated_at"].isoformat()
         }
     }
 
@@ -212,12 +215,15 @@ async def create_submission_from_session(
 @submission_router.get("/{submission_id}")
 async def get_submission(
     submission_id: str,
+    request: Request,
+    response: Response,
     current_user_email: str = Depends(get_current_user_email)
 ):
     """
     Get a specific submission by ID. User can only access their own submissions.
+    Revalidate with If-None-Match / If-Modified-Since for a 304.
     """
-    submission = await get_submission_by_id(submission_id)
+    submission = await get_submission_by_id(submission_id, with_diagram=False)
     
     if not submission:
         raise HTTPException(
@@ -232,6 +238,16 @@ async def get_submission(
             detail="You are not authorized to view this submission"
         )
 
+    # Every update (diagram, feedback, chat) sets updated_at
+    headers = validator_headers(
+        make_etag("submission", submission["_id"], submission.get("diagram_hash"), submission["updated_at"]),
+        submission["updated_at"]
+    )
+    if is_not_modified(request, headers["ETag"], submission["updated_at"]):
+        return not_modified(headers, "submission")
+    response.headers.update(headers)
+
+    await hydrate_diagram(submission)
     return {
         "id": submission["_id"],
         "user_id": submission["user_id"],
@@ -247,21 +263,61 @@ async def get_submission(
     }
 
 
+@submission_router.get("/{submission_id}/diagram")
+async def get_submission_diagram_only(
+    submission_id: str,
+    request: Request,
+    current_user_email: str = Depends(get_current_user_email)
+):
+    """
+    Get only the diagram of a submission (list views leave it out).
+    """
+    submission = await get_submission_diagram(submission_id, decode=False)
+    
+    if not submission:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Submission not found"
+        )
+    
+    # Ensure user can only access their own submissions
+    if submission["user_id"] != current_user_email:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to view this submission"
+        )
+
+    return diagram_response(
+        {"id": submission["_id"], "problem_id": submission.get("problem_id")},
+        submission["diagram_record"],
+        request.headers.get("accept-encoding", "")
+    )
+
+
 @submission_router.get("/user/my-submissions")
 async def get_my_submissions(
     current_user_email: str = Depends(get_current_user_email),
     skip: int = Query(0, ge=0),
-    limit: int = Query(100, ge=1, le=100)
+    limit: int = Query(100, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page")
 ):
     """
     Get all submissions by the authenticated user.
+    Pass next_cursor back as cursor for constant-cost deep pages.
     """
-    submissions = await get_submissions_by_user(current_user_email, skip=skip, limit=limit)
+    try:
+        submissions = await get_submissions_by_user(current_user_email, skip=skip, limit=limit, cursor=cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
     
     return {
-        "total": len(submissions),
+        "total": await count_submissions_by_user(current_user_email),
         "skip": skip,
         "limit": limit,
+        "next_cursor": next_cursor(submissions, "submitted_at", limit),
         "submissions": [
             {
                 "id": submission["_id"],
@@ -309,15 +365,17 @@ async def get_my_submission_for_problem(
     }
 
 
-@submission_router.put("/{submission_id}")
+@submission_router.put("/{submission_id}", openapi_extra=json_body_schema(SubmissionUpdate))
 async def update_existing_submission(
     submission_id: str,
-    payload: SubmissionUpdate,
+    request: Request,
     current_user_email: str = Depends(get_current_user_email)
 ):
     """
     Update a submission. Only the owner can update.
+    The SubmissionUpdate body is parsed as it streams in (see diagram_ingest).
     """
+    payload = validate_body(SubmissionUpdate, await read_diagram_body(request))
     updated_submission = await update_submission(
         submission_id=submission_id,
         diagram_data=payload.diagram_data,
@@ -0,0 +1,35 @@
+"""
+Query plan check
+Ensures the declared indexes exist, explain()s every CRUD query shape and exits
+non-zero if any of them would run as a collection scan.
+
+Usage (from Backend/):
+    python -m scripts.check_query_plans
+"""
+import asyncio
+import sys
+
+from database import db, client
+from indexes import ensure_indexes, explain_query_shapes
+
+
+async def main() -> int:
+    await ensure_indexes(db)
+    results = await explain_query_shapes(db)
+
+    failures = [r for r in results if r["collscan"]]
+    for result in results:
+        marker = "FAIL" if result["collscan"] else "ok  "
+        print(f"{marker} {result['name']:<55} {' <- '.join(result['stages'])}")
+
+    client.close()
+
+    if failures:
+        print(f"\n{len(failures)} query shape(s) fall back to COLLSCAN")
+        return 1
+    print(f"\nAll {len(results)} query shapes are served by an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
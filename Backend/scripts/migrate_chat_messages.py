@@ -0,0 +1,78 @@
+"""
+Chat message migration
+Moves the chat_messages arrays embedded in session documents into the
+chat_messages collection and sets each session's message_count.
+
+Messages are copied first, then the session is claimed with a conditional
+$unset on the exact array that was read; if an old worker appended a message
+in between, the copies are removed and the session is retried, so nothing is
+lost or duplicated. Safe to re-run.
+
+Usage (from Backend/):
+    python -m scripts.migrate_chat_messages [--dry-run] [--batch-size 200]
+"""
+import argparse
+import asyncio
+
+from database import db, client
+from CRUD.chat_crud import chat_collection, build_message
+
+
+EMBEDDED_FILTER = {"chat_messages": {"$exists": True}}
+
+
+async def migrate(batch_size: int, dry_run: bool) -> int:
+    sessions = db.get_collection("sessions")
+    if dry_run:
+        return await sessions.count_documents(EMBEDDED_FILTER)
+
+    migrated = 0
+    while True:
+        batch = await sessions.find(
+            EMBEDDED_FILTER, {"user_id": 1, "chat_messages": 1}
+        ).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            return migrated
+
+        for session in batch:
+            raw = session.get("chat_messages")
+            embedded = raw or []
+            messages = [
+                build_message(
+                    str(session["_id"]),
+                    session.get("user_id"),
+                    m.get("role", ""),
+                    m.get("content", ""),
+                    diagram_hash=m.get("diagram_hash"),
+                    timestamp=m.get("timestamp")
+                )
+                for m in embedded
+            ]
+            inserted_ids = []
+            if messages:
+                inserted_ids = (await chat_collection.insert_many(messages)).inserted_ids
+
+            claimed = await sessions.update_one(
+                {"_id": session["_id"], "chat_messages": raw},
+                {"$unset": {"chat_messages": ""}, "$inc": {"message_count": len(embedded)}}
+            )
+            if not claimed.modified_count:
+                # Changed underneath us: undo and pick it up again next batch
+                await chat_collection.delete_many({"_id": {"$in": inserted_ids}})
+                continue
+            migrated += 1
+
+
+async def main(batch_size: int, dry_run: bool) -> None:
+    count = await migrate(batch_size, dry_run)
+    verb = "would migrate" if dry_run else "migrated"
+    print(f"sessions: {verb} {count} embedded chat array(s)")
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
@@ -0,0 +1,105 @@
+"""
+Diagram storage migration
+1. Moves diagrams still embedded in sessions/submissions (diagram_data, written
+   before the content-addressed store) into the diagrams collection.
+2. Re-encodes stored diagrams kept as nested BSON (`data`) with the configured
+   DIAGRAM_CODEC.
+
+Safe to re-run and to run against a live deployment: each document is swapped
+with a conditional update, so a concurrent autosave wins and the migration's
+reference is released again.
+
+Usage (from Backend/):
+    python -m scripts.migrate_diagram_storage [--dry-run] [--batch-size 200]
+"""
+import argparse
+import asyncio
+
+from database import db, client
+from diagram_codec import DIAGRAM_CODEC, encode_diagram
+from CRUD.diagram_crud import diagrams_collection, calculate_diagram_hash, retain_diagram, release_diagram
+from diagram_hashing import diagram_hash_matches
+
+
+EMBEDDED_FILTER = {"diagram_data": {"$exists": True}, "diagram_stored": {"$ne": True}}
+
+
+async def migrate_embedded(collection_name: str, batch_size: int, dry_run: bool) -> int:
+    """Move embedded diagram_data of one collection into the store"""
+    collection = db.get_collection(collection_name)
+    if dry_run:
+        return await collection.count_documents(EMBEDDED_FILTER)
+
+    moved = 0
+    last_id = None
+    while True:
+        query = dict(EMBEDDED_FILTER, **({"_id": {"$gt": last_id}} if last_id else {}))
+        batch = await collection.find(
+            query, {"diagram_data": 1, "diagram_hash": 1}
+        ).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            return moved
+
+        last_id = batch[-1]["_id"]
+        for doc in batch:
+            diagram_data = doc.get("diagram_data") or {}
+            # Keep a correct existing (possibly legacy MD5) hash so check
+            # feedback cached under it still matches
+            diagram_hash = doc.get("diagram_hash")
+            if not diagram_hash or not diagram_hash_matches(diagram_hash, diagram_data):
+                diagram_hash = calculate_diagram_hash(diagram_data)
+            await retain_diagram(diagram_hash, diagram_data)
+
+            # Only swap if the embedded diagram is still the one we hashed
+            result = await collection.update_one(
+                {"_id": doc["_id"], "diagram_data": diagram_data, "diagram_stored": {"$ne": True}},
+                {
+                    "$set": {"diagram_hash": diagram_hash, "diagram_stored": True},
+                    "$unset": {"diagram_data": ""}
+                }
+            )
+            if result.modified_count:
+                moved += 1
+            else:
+                await release_diagram(diagram_hash)
+
+
+async def reencode_store(batch_size: int, dry_run: bool) -> int:
+    """Re-encode nested store records with the configured codec"""
+    query = {"data": {"$exists": True}}
+    if dry_run or DIAGRAM_CODEC == "none":
+        return await diagrams_collection.count_documents(query) if dry_run else 0
+
+    encoded = 0
+    while True:
+        batch = await diagrams_collection.find(query, {"data": 1}).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            return encoded
+
+        for record in batch:
+            await diagrams_collection.update_one(
+                {"_id": record["_id"], "data": {"$exists": True}},
+                {"$set": encode_diagram(record.get("data") or {}), "$unset": {"data": ""}}
+            )
+            encoded += 1
+
+
+async def main(batch_size: int, dry_run: bool) -> None:
+    verb = "would move" if dry_run else "moved"
+    for name in ("sessions", "submissions"):
+        count = await migrate_embedded(name, batch_size, dry_run)
+        print(f"{name}: {verb} {count} embedded diagram(s) into the store")
+
+    count = await reencode_store(batch_size, dry_run)
+    verb = "would re-encode" if dry_run else "re-encoded"
+    print(f"diagrams: {verb} {count} record(s) as {DIAGRAM_CODEC}")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.dry_run))
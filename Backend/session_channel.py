@@ -0,0 +1,136 @@
+"""
+Live session channel.
+One authenticated WebSocket per open practice tab (GET /sessions/{id}/ws)
+carries what the page used to send as separate HTTP requests. The token and
+session ownership are checked once, when the socket opens.
+
+Client -> server frames (JSON; "id" is echoed back in the reply):
+    {"type": "autosave", "id", "base_hash", "time_spent", "upserts", "deletes", ...}
+    {"type": "autosave", "id", "diagram_data", "time_spent", "base_version"}
+    {"type": "heartbeat", "id", "time_spent"}
+    {"type": "chat", "id", "message", "diagram_data"?}
+    {"type": "check", "id"}
+Server -> client frames:
+    {"type": "ack", "id", ...}                   autosave / heartbeat acknowledgement
+    {"type": "chat_chunk", "id", "content"}      streamed reply tokens, then
+    {"type": "chat_done", "id"}
+    {"type": "check_result", "id"?, ...}         same body as POST /check
+    {"type": "error", "id", "code", "detail"}    HTTP-style status code
+    {"type": "saved" | "chat_message", ...}      fan-out of another tab's activity
+
+Fan-out reaches the tabs connected to the same worker; route a session's
+sockets to one worker (sticky by session id) when running several.
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Dict, Optional, Set
+
+from fastapi import WebSocket
+from fastapi.encoders import jsonable_encoder
+
+from metrics import REGISTRY
+
+
+# A tab that cannot take a frame within this many seconds is dropped
+CHANNEL_SEND_TIMEOUT_SECONDS = 5.0
+# Dropped tabs are closed with 1013 (Try Again Later) so the client reconnects
+CHANNEL_DROP_CLOSE_CODE = 1013
+# chat/check frames one connection may have running at once; more get a 429
+CHANNEL_MAX_BACKGROUND = int(os.getenv("SESSION_CHANNEL_MAX_BACKGROUND", "2"))
+
+channel_connections = REGISTRY.gauge("session_channel_connections", "Open session WebSockets")
+channel_messages = REGISTRY.counter("session_channel_messages_total", "Frames received, by type")
+channel_message_seconds = REGISTRY.histogram("session_channel_message_seconds", "Time to handle one frame, by type")
+channel_fanout = REGISTRY.counter("session_channel_fanout_total", "Frames delivered to other tabs")
+channel_dropped = REGISTRY.counter("session_channel_dropped_total", "Connections dropped because a send failed or timed out")
+
+
+def encode_frame(frame: Dict[str, Any]) -> str:
+    return json.dumps(jsonable_encoder(frame), separators=(",", ":"))
+
+
+class ChannelConnection:
+    """One socket; sends are serialized since replies and fan-out can interleave"""
+
+    __slots__ = ("websocket", "user_id", "expires_at", "_send_lock")
+
+    def __init__(self, websocket: WebSocket, user_id: str, expires_at: Optional[float] = None):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self._send_lock = asyncio.Lock()
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.time() >= self.expires_at
+
+    async def send_text(self, text: str) -> None:
+        async with self._send_lock:
+            await asyncio.wait_for(self.websocket.send_text(text), CHANNEL_SEND_TIMEOUT_SECONDS)
+
+    async def send(self, frame: Dict[str, Any]) -> None:
+        await self.send_text(encode_frame(frame))
+
+    async def close(self, code: int, reason: str = "") -> None:
+        """Close the socket, ignoring one that is already gone"""
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code, reason=reason), CHANNEL_SEND_TIMEOUT_SECONDS)
+        except Exception:
+            pass
+
+
+class SessionHub:
+    """session_id -> connections of this worker, for fan-out"""
+
+    def __init__(self):
+        self._sessions: Dict[str, Set[ChannelConnection]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(connections) for connections in self._sessions.values())
+
+    def join(self, session_id: str, connection: ChannelConnection) -> None:
+        self._sessions.setdefault(session_id, set()).add(connection)
+        channel_connections.inc()
+
+    def leave(self, session_id: str, connection: ChannelConnection) -> None:
+        connections = self._sessions.get(session_id)
+        if connections and connection in connections:
+            connections.discard(connection)
+            channel_connections.dec()
+            if not connections:
+                del self._sessions[session_id]
+
+    async def publish(
+        self,
+        session_id: str,
+        frame: Dict[str, Any],
+        exclude: Optional[ChannelConnection] = None
+    ) -> int:
+        """
+        Send frame to every tab of the session except exclude; returns how many
+        got it. A tab whose send fails or times out is closed, so it reconnects
+        instead of staying half-connected without fan-out.
+        """
+        targets = [c for c in self._sessions.get(session_id, ()) if c is not exclude]
+        if not targets:
+            return 0
+
+        text = encode_frame(frame)  # encoded once for all tabs
+        results = await asyncio.gather(*(c.send_text(text) for c in targets), return_exceptions=True)
+        delivered = 0
+        dropped = []
+        for connection, result in zip(targets, results):
+            if isinstance(result, BaseException):
+                channel_dropped.inc()
+                self.leave(session_id, connection)
+                dropped.append(connection)
+            else:
+                delivered += 1
+        if dropped:
+            await asyncio.gather(*(c.close(CHANNEL_DROP_CLOSE_CODE, "Fell behind; reconnect") for c in dropped))
+        channel_fanout.inc(delivered)
+        return delivered
+
+
+session_hub = SessionHub()
@@ -0,0 +1,165 @@
+"""
+Write-behind buffer.
+Keeps only the latest pending value per key in memory and hands dirty entries
+to a flush function in batches, on a timer, on demand for a single key, under
+memory pressure, and on shutdown. Values being flushed stay readable until
+the flush has applied (or re-queued) them, so readers never fall back to the
+older stored value in between. Each worker has its own buffer; the metrics
+expose how much acknowledged data is not yet durable.
+"""
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from metrics import REGISTRY
+
+
+buffer_bytes = REGISTRY.gauge("write_behind_buffered_bytes", "Approximate bytes held in a write-behind buffer")
+buffer_pending = REGISTRY.gauge("write_behind_pending", "Keys with an unflushed value")
+buffer_oldest_age = REGISTRY.gauge(
+    "write_behind_oldest_pending_seconds",
+    "Age of the oldest unflushed value when the last flush started (data-at-risk window)",
+)
+buffer_puts = REGISTRY.counter("write_behind_puts_total", "Values accepted into a buffer")
+buffer_coalesced = REGISTRY.counter("write_behind_coalesced_total", "Values that replaced a still-pending value")
+buffer_rejected = REGISTRY.counter("write_behind_rejected_total", "Values refused because the byte bound was reached")
+buffer_flushes = REGISTRY.counter("write_behind_flushes_total", "Flushes by trigger")
+buffer_flushed = REGISTRY.counter("write_behind_flushed_total", "Values written by flushes")
+buffer_dropped = REGISTRY.counter("write_behind_dropped_total", "Values the flush function did not apply (stale or no longer writable)")
+buffer_failures = REGISTRY.counter("write_behind_flush_failures_total", "Flushes that raised; their values were re-queued")
+buffer_flush_seconds = REGISTRY.histogram("write_behind_flush_seconds", "Time spent in one flush")
+
+
+# Receives {key: value} and returns how many of them it applied
+FlushFn = Callable[[Dict[Hashable, Any]], Awaitable[int]]
+
+
+class WriteBehindBuffer:
+    """Latest-value-wins buffer flushed in batches by flush_fn"""
+
+    def __init__(self, name: str, flush_fn: FlushFn, flush_interval: float = 5.0, max_bytes: int = 64 * 1024 * 1024):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self._labels = {"buffer": name}
+        # key -> (value, size, enqueued_at)
+        self._entries: Dict[Hashable, tuple] = {}
+        # Entries taken by the running flush, same shape
+        self._in_flight: Dict[Hashable, tuple] = {}
+        self._bytes = 0
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _update_gauges(self) -> None:
+        buffer_bytes.set(self._bytes, labels=self._labels)
+        buffer_pending.set(len(self._entries), labels=self._labels)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """The newest unflushed value of key: pending, else being flushed"""
+        entry = self._entries.get(key) or self._in_flight.get(key)
+        return entry[0] if entry else None
+
+    def get_pending(self, key: Hashable) -> Optional[Any]:
+        """The value of key waiting for the next flush (not the one being flushed)"""
+        entry = self._entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key: Hashable, value: Any, size: int) -> bool:
+        """
+        Buffer value for key, replacing any pending one. Returns False (and
+        starts an early flush) when it would exceed max_bytes; the caller must
+        then write through.
+        """
+        previous = self._entries.get(key)
+        projected = self._bytes - (previous[1] if previous else 0) + size
+        if projected > self.max_bytes:
+            buffer_rejected.inc(labels=self._labels)
+            self._schedule_flush("pressure")
+            return False
+
+        # Keep the original enqueue time: it measures how long the key has been dirty
+        enqueued_at = previous[2] if previous else time.monotonic()
+        self._entries[key] = (value, size, enqueued_at)
+        self._bytes = projected
+        buffer_puts.inc(labels=self._labels)
+        if previous:
+            buffer_coalesced.inc(labels=self._labels)
+        self._update_gauges()
+        return True
+
+    def _take(self, keys=None) -> Dict[Hashable, tuple]:
+        keys = list(self._entries) if keys is None else [k for k in keys if k in self._entries]
+        taken = {key: self._entries.pop(key) for key in keys}
+        self._in_flight.update(taken)
+        self._bytes -= sum(entry[1] for entry in taken.values())
+        self._update_gauges()
+        return taken
+
+    def _requeue(self, taken: Dict[Hashable, tuple]) -> None:
+        for key, entry in taken.items():
+            if key not in self._entries:  # a newer value wins over the failed one
+                self._entries[key] = entry
+                self._bytes += entry[1]
+        self._update_gauges()
+
+    async def _flush(self, keys, trigger: str) -> int:
+        async with self._flush_lock:
+            taken = self._take(keys)
+            if not taken:
+                return 0
+
+            buffer_flushes.inc(labels={**self._labels, "trigger": trigger})
+            buffer_oldest_age.set(time.monotonic() - min(e[2] for e in taken.values()), labels=self._labels)
+            started = time.perf_counter()
+            try:
+                applied = await self.flush_fn({key: entry[0] for key, entry in taken.items()})
+            except Exception as e:
+                buffer_failures.inc(labels=self._labels)
+                self._requeue(taken)
+                print(f"WARNING: write-behind flush of '{self.name}' failed, {len(taken)} value(s) re-queued: {e}")
+                return 0
+            finally:
+                # Applied, dropped or re-queued: either way no longer in flight
+                for key in taken:
+                    self._in_flight.pop(key, None)
+                buffer_flush_seconds.observe(time.perf_counter() - started, labels=self._labels)
+
+            buffer_flushed.inc(applied, labels=self._labels)
+            buffer_dropped.inc(len(taken) - applied, labels=self._labels)
+            return applied
+
+    async def flush(self, trigger: str = "manual") -> int:
+        """Flush every pending value"""
+        return await self._flush(None, trigger)
+
+    async def flush_key(self, key: Hashable, trigger: str = "sync") -> int:
+        """Flush one key now (waits for an in-flight flush first so writes stay ordered)"""
+        return await self._flush([key], trigger)
+
+    def _schedule_flush(self, trigger: str) -> None:
+        if not self._flush_lock.locked():
+            asyncio.get_running_loop().create_task(self.flush(trigger))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush("timer")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the timer and flush everything that is left"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush("shutdown")